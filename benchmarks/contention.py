@@ -0,0 +1,215 @@
+# benchmarks/contention.py
+#
+# Contention check: runs many scon invocations at once against the fake runtime in
+# fake_runtime.py, all on a few shared SCs, the way several CI jobs and shells on
+# one host would. Afterwards it checks that no invocation's work was lost:
+#   every successful start left a container entry and every successful stop or
+#   snapshot a snapshot entry in the SC's record, and each SC's recorded status
+#   matches what the runtime has.
+# It reports the wall time and how long invocations waited for SC locks (from the
+# `scon --trace` spans).
+#
+#   python benchmarks/contention.py [--scs 4] [--invocations 64] [--parallel 16]
+#                                   [--backend sqlite|journal|json] [--latency-ms 20]
+#                                   [--seed 1] [--keep] [--json]
+#
+# Exits non-zero when a check fails.
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+import fake_runtime
+from scon.utils import state_store
+
+STATE_FILES = {'sqlite': 'stateful_containers.db', 'journal': 'stateful_containers.journal',
+               'json': 'stateful_containers.json'}
+# Single-SC invocations, and now and then one over every SC
+ACTIONS = ['start', 'stop', 'snapshot']
+BULK_SHARE = 0.1
+SUCCESS_PATTERNS = {
+    'start': re.compile(r"^Started container '([^']+)'"),
+    'stop': re.compile(r"^Stopped and saved state of '([^']+)'"),
+    'snapshot': re.compile(r"^Snapshot created successfully as '(.+)_snapshot_\d+'"),
+}
+
+def sc_names(count):
+    return [f"shared-{number}" for number in range(count)]
+
+def environment(work_dir, bin_dir, latency_ms):
+    return dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}", PYTHONPATH=ROOT,
+                XDG_CONFIG_HOME=os.path.join(work_dir, 'config'), XDG_DATA_HOME=os.path.join(work_dir, 'data'),
+                XDG_RUNTIME_DIR=work_dir, SCON_NO_DAEMON='1',
+                **{fake_runtime.STATE_ENV: os.path.join(work_dir, 'runtime.json'),
+                   fake_runtime.LATENCY_ENV: str(latency_ms)})
+
+def scon(argv, env, trace_path=None):
+    if trace_path:
+        env = dict(env, SCON_TRACE=trace_path)
+    started_at = time.perf_counter()
+    process = subprocess.run([sys.executable, '-m', 'scon.cli', *argv], env=env, cwd=env['XDG_RUNTIME_DIR'],
+                             stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    return {'argv': argv, 'exit_code': process.returncode, 'stdout': process.stdout, 'stderr': process.stderr,
+            'ms': round((time.perf_counter() - started_at) * 1000, 1)}
+
+def prepare(work_dir, args):
+    # SCs that each have one committed snapshot and are stopped
+    bin_dir = os.path.join(work_dir, 'bin')
+    fake_runtime.install(bin_dir)
+    fake_runtime.init(os.path.join(work_dir, 'runtime.json'))
+    config_dir = os.path.join(work_dir, 'config', 'scon')
+    os.makedirs(config_dir)
+    with open(os.path.join(config_dir, 'scon_config.json'), 'w') as file:
+        # Retention would prune the entries the checks count
+        json.dump({'use_sudo': False, 'container_runtime': 'docker', 'runtime_api': 'cli',
+                   'state_backend': args.backend, 'max_snapshots': 100000}, file)
+    env = environment(work_dir, bin_dir, 0)
+    for name in sc_names(args.scs):
+        result = scon(['create', name, fake_runtime.BASE_IMAGE], env)
+        if result['exit_code']:
+            sys.exit(f"Seeding failed: {result['stderr'] or result['stdout']}")
+        subprocess.run(['docker', 'run', '-d', '--name', name, fake_runtime.BASE_IMAGE, 'sleep', 'infinity'],
+                       env=env, check=True, capture_output=True)
+    result = scon(['stop', '--all'], env)
+    if result['exit_code'] or 'Failed' in result['stdout']:
+        sys.exit(f"Seeding failed: {result['stderr'] or result['stdout']}")
+    return bin_dir
+
+def read_records(work_dir, backend):
+    path = os.path.join(work_dir, 'data', 'scon', STATE_FILES[backend])
+    store = {'json': state_store.JsonStateStore, 'journal': state_store.JournalStateStore,
+             'sqlite': state_store.SqliteStateStore}[backend](path)
+    try:
+        return {record['name']: record for record in store.load_all()}
+    finally:
+        store.close()
+
+def plan_invocations(args):
+    rng = random.Random(args.seed)
+    names = sc_names(args.scs)
+    invocations = []
+    for _ in range(args.invocations):
+        action = rng.choice(ACTIONS)
+        invocations.append([action, '--all'] if rng.random() < BULK_SHARE else [action, rng.choice(names)])
+    return invocations
+
+def successes(results):
+    # Counter of (action, SC) over what the invocations reported as done
+    done = Counter()
+    for result in results:
+        action = result['argv'][0]
+        for line in result['stdout'].splitlines():
+            match = SUCCESS_PATTERNS[action].match(line)
+            if match:
+                done[action, match.group(1)] += 1
+    return done
+
+def lock_waits(trace_dir):
+    waits = []
+    for filename in os.listdir(trace_dir):
+        with open(os.path.join(trace_dir, filename)) as file:
+            waits += [span['ms'] for span in map(json.loads, file) if span['op'] == 'lock.wait']
+    return waits
+
+def check(before, after, done, runtime_state):
+    running = {container['name'] for container in runtime_state['containers'].values() if container['running']}
+    problems = []
+    for name, record in sorted(after.items()):
+        expected_containers = len(before[name]['containers']) + done['start', name]
+        expected_snapshots = len(before[name]['snapshots']) + done['stop', name] + done['snapshot', name]
+        if len(record['containers']) != expected_containers:
+            problems.append(f"{name}: {len(record['containers'])} container entries, expected {expected_containers}")
+        if len(record['snapshots']) != expected_snapshots:
+            problems.append(f"{name}: {len(record['snapshots'])} snapshot entries, expected {expected_snapshots}")
+        status = record['containers'][-1]['status']
+        if (status == 'running') != (name in running):
+            problems.append(f"{name}: recorded as {status} but {'running' if name in running else 'not running'}"
+                            " in the runtime")
+    return problems
+
+def run(args, work_dir):
+    bin_dir = prepare(work_dir, args)
+    before = read_records(work_dir, args.backend)
+    env = environment(work_dir, bin_dir, args.latency_ms)
+    trace_dir = os.path.join(work_dir, 'traces')
+    os.makedirs(trace_dir)
+
+    invocations = plan_invocations(args)
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+        results = list(pool.map(lambda item: scon(item[1], env, os.path.join(trace_dir, f"{item[0]}.jsonl")),
+                                enumerate(invocations)))
+    wall_ms = (time.perf_counter() - started_at) * 1000
+
+    with open(os.path.join(work_dir, 'runtime.json')) as file:
+        runtime_state = json.load(file)
+    done = successes(results)
+    problems = check(before, read_records(work_dir, args.backend), done, runtime_state)
+    problems += [f"`scon {' '.join(result['argv'])}` crashed: {result['stderr'].strip().splitlines()[-1]}"
+                 for result in results if result['stderr'].strip()]
+    waits = lock_waits(trace_dir)
+    return {
+        'backend': args.backend,
+        'scs': args.scs,
+        'invocations': len(invocations),
+        'parallel': args.parallel,
+        'latency_ms': args.latency_ms,
+        'wall_ms': round(wall_ms, 1),
+        'max_invocation_ms': max(result['ms'] for result in results),
+        'succeeded': {action: sum(count for (done_action, _), count in done.items() if done_action == action)
+                      for action in ACTIONS},
+        'lock_waits': len(waits),
+        'lock_wait_ms': round(sum(waits), 1),
+        'max_lock_wait_ms': max(waits, default=0),
+        'problems': problems,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scs', type=int, default=4, help='Shared SCs the invocations pick from')
+    parser.add_argument('--invocations', type=int, default=64)
+    parser.add_argument('--parallel', type=int, default=16, help='Invocations running at once')
+    parser.add_argument('--backend', choices=sorted(STATE_FILES), default='sqlite')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Added to every fake runtime call')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the mix of invocations')
+    parser.add_argument('--keep', action='store_true', help='Keep the work directory')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='scon-contention-')
+    try:
+        result = run(args, work_dir)
+    finally:
+        if args.keep:
+            print(f"Work directory: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['invocations']} invocations ({result['parallel']} at once) on {result['scs']} SCs, "
+              f"{result['backend']} backend: {result['wall_ms']:.0f} ms, slowest {result['max_invocation_ms']:.0f} ms")
+        print("Succeeded: " + ', '.join(f"{count} {action}" for action, count in result['succeeded'].items()))
+        print(f"Lock waits: {result['lock_waits']}, {result['lock_wait_ms']:.0f} ms in total, "
+              f"longest {result['max_lock_wait_ms']:.0f} ms")
+        for problem in result['problems']:
+            print(f"  - {problem}")
+        print("No lost updates." if not result['problems'] else f"{len(result['problems'])} problem(s).")
+    sys.exit(1 if result['problems'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# benchmarks/fake_api.py
+#
+# Serves the fake runtime model over a Docker-compatible API socket, for benchmarking
+# scon with runtime_api set to 'api'. Runs in a thread of the benchmark process,
+# which reads the request counts from the server afterwards.
+
+import json
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlsplit
+from fake_runtime import FakeRuntime
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        started_at = time.perf_counter()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        with self.server.lock:
+            status, reply, op = route(self.server.runtime, method, parts, query, body)
+        if self.server.latency:
+            time.sleep(self.server.latency / 1000)
+        self.server.record(op, (time.perf_counter() - started_at) * 1000)
+        self._reply(status, reply)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def container_summary(container_id, container):
+    return {'Id': container_id, 'Names': [f"/{container['name']}"], 'Image': container['image'],
+            'State': 'running' if container['running'] else 'exited'}
+
+def route(runtime, method, parts, query, body):
+    # Returns (status, JSON body, operation name for the call log)
+    if parts == ['_ping']:
+        return 200, 'OK', 'GET /_ping'
+    if parts[0] == 'containers':
+        if parts[1:] == ['json']:
+            pattern = (json.loads(query.get('filters') or '{}').get('name') or [None])[0]
+            pattern = pattern.replace('^/?', '^') if pattern else None
+            containers = runtime.containers(pattern, include_stopped=query.get('all') == '1')
+            return 200, [container_summary(*item) for item in containers], 'GET /containers/json'
+        if parts[1:] == ['create']:
+            mounts = [(mount['Type'], mount.get('Source'), mount['Target'], mount.get('ReadOnly', False))
+                      for mount in (body.get('HostConfig') or {}).get('Mounts') or []]
+            container_id, error = runtime.create(query.get('name'), body['Image'], mounts=mounts)
+            if container_id:
+                return 201, {'Id': container_id}, 'POST /containers/create'
+            return (409 if 'Conflict' in error else 404), {'message': error}, 'POST /containers/create'
+        ref, action = parts[1], parts[2] if len(parts) > 2 else None
+        op = f"{method} /containers/{{id}}" + (f"/{action}" if action else '')
+        if method == 'DELETE':
+            return (204, None, op) if runtime.remove_container(ref) else (404, {'message': 'No such container'}, op)
+        container_id = runtime.find(ref)
+        if container_id is None:
+            return 404, {'message': f"No such container: {ref}"}, op
+        container = runtime.state['containers'][container_id]
+        if action == 'json':
+            return 200, {'Id': container_id, 'Name': f"/{container['name']}", 'Mounts': container.get('mounts', []),
+                         'SizeRw': container.get('size_rw', 0)}, op
+        if action in ('start', 'stop'):
+            if container['running'] == (action == 'start'):
+                return 304, None, op
+            runtime.set_running(container_id, action == 'start')
+            return 204, None, op
+        if action == 'rename':
+            return (204, None, op) if runtime.rename(container_id, query['name']) else (409, {'message': 'Conflict'}, op)
+        if action == 'exec':
+            # Runs at once; only `false` fails
+            exec_id = uuid.uuid4().hex
+            runtime.execs[exec_id] = 1 if body['Cmd'][:1] == ['false'] else 0
+            return 201, {'Id': exec_id}, op
+    if parts[0] == 'exec':
+        op = f"{method} /exec/{{id}}/{parts[2]}"
+        if parts[1] not in runtime.execs:
+            return 404, {'message': f"No such exec instance: {parts[1]}"}, op
+        if parts[2] == 'start':
+            return 200, None, op
+        return 200, {'Running': False, 'ExitCode': runtime.execs[parts[1]]}, op
+    if parts == ['commit']:
+        image = f"{query['repo']}:{query.get('tag') or 'latest'}"
+        image_id = runtime.commit(query['container'], image)
+        return (201, {'Id': image_id}, 'POST /commit') if image_id else (404, {'message': 'No such container'}, 'POST /commit')
+    if parts[0] == 'images':
+        if parts[1:] == ['json']:
+            return 200, [{'Id': info['Id'], 'RepoTags': info['RepoTags'], 'Size': info['Size']}
+                         for info in map(runtime.image_info, runtime.image_refs())], 'GET /images/json'
+        ref = '/'.join(parts[1:-1] if parts[-1] == 'json' else parts[1:])
+        if method == 'GET':
+            info = runtime.image_info(ref)
+            return (200, info, 'GET /images/{id}/json') if info else (404, {'message': f"No such image: {ref}"}, 'GET /images/{id}/json')
+        outcome = runtime.remove_image(ref)
+        if outcome == 'removed':
+            return 200, [{'Untagged': f"{ref}:latest"}], 'DELETE /images/{id}'
+        return (404 if outcome == 'missing' else 409), {'message': f"{outcome}: {ref}"}, 'DELETE /images/{id}'
+    return 404, {'message': f"fake runtime: unsupported endpoint {method} /{'/'.join(parts)}"}, f"{method} unsupported"
+
+
+class FakeApiServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, state, latency=0):
+        super().__init__(path, ApiHandler)
+        self.runtime = FakeRuntime(state)
+        self.runtime.execs = {}
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def record(self, op, ms):
+        with self.lock:
+            self.calls.append((op, round(ms, 3)))
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
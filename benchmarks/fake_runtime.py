@@ -0,0 +1,351 @@
+# benchmarks/fake_runtime.py
+#
+# Stand-in container runtime for the benchmarks: a model of containers and images
+# that answers the subset of the docker CLI scon uses. fake_api.py serves the same
+# model over a fake API socket.
+#
+#   python benchmarks/fake_runtime.py install BIN_DIR    # writes BIN_DIR/docker and BIN_DIR/podman
+#   python benchmarks/fake_runtime.py init STATE [HOST...] # empty runtimes, local and per host
+#
+# The installed executable keeps its state in $FAKE_RUNTIME_STATE (JSON, flock'ed),
+# appends one line per invocation to $FAKE_RUNTIME_STATE.calls and sleeps
+# $FAKE_RUNTIME_LATENCY_MS (or the state's 'latency_ms') before answering. Each
+# `-H`/`--url` host is a runtime of its own, kept in host_state_path(); a host
+# without a state file cannot be connected to.
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import uuid
+
+STATE_ENV = "FAKE_RUNTIME_STATE"
+LATENCY_ENV = "FAKE_RUNTIME_LATENCY_MS"
+BASE_IMAGE = "alpine"
+LAYER_SIZE = 1024 * 1024
+SC_PREFIX = "bench-"
+SNAPSHOT_IMAGE = re.compile(r'^bench-(\d+)_snapshot_(\d+)$')
+
+def sc_name(index):
+    return f"{SC_PREFIX}{index:05d}"
+
+def seeded_image(sc_index, number, seed):
+    return f"{sc_name(sc_index)}_snapshot_{seed['base_ts'] + number}"
+
+def seeded_layer_depth(number):
+    return 2 + number % 8
+
+def digest(text):
+    return 'sha256:' + hashlib.sha256(text.encode()).hexdigest()
+
+def normalize(ref):
+    return ref[:-len(':latest')] if ref.endswith(':latest') else ref
+
+def host_state_path(path, host):
+    return f"{path}@{re.sub(r'[^A-Za-z0-9_.-]+', '_', host)}"
+
+def empty_state(seed=None):
+    return {'containers': {}, 'images': {BASE_IMAGE: [f"{BASE_IMAGE}/0"]}, 'removed': [], 'seed': seed}
+
+
+class FakeRuntime:
+    # state: {'containers': {id: {'name', 'image', 'running', 'size_rw' (optional)}}, 'images': {ref: [layer names]},
+    #         'removed': [seeded refs since removed], 'seed': {'scs', 'per_sc', 'base_ts'} or None}
+
+    def __init__(self, state):
+        self.state = state
+        self._removed = set(state['removed'])
+        self._ids = None
+
+    def _seeded_layers(self, ref):
+        # Seeded snapshot images exist without being listed in the state, so a run
+        # with 100k history entries does not have every call parse all of them
+        seed = self.state.get('seed')
+        match = SNAPSHOT_IMAGE.match(ref)
+        if not seed or not match or ref in self._removed:
+            return None
+        index, number = int(match.group(1)), int(match.group(2)) - seed['base_ts']
+        if index >= seed['scs'] or not 0 <= number < seed['per_sc']:
+            return None
+        # Snapshots of one SC share their lower layers, as commits of one container do
+        depth = seeded_layer_depth(number)
+        return [f"{BASE_IMAGE}/0"] + [f"{sc_name(index)}/{m}" for m in range(1, depth - 1)] + [f"{ref}/top"]
+
+    def image_refs(self):
+        refs = list(self.state['images'])
+        seed = self.state.get('seed')
+        if seed:
+            refs.extend(ref for index in range(seed['scs']) for number in range(seed['per_sc'])
+                        if (ref := seeded_image(index, number, seed)) not in self._removed)
+        return refs
+
+    def resolve_image(self, ref):
+        ref = normalize(ref)
+        if ref.startswith('sha256:'):
+            if self._ids is None:
+                self._ids = {digest(r): r for r in self.image_refs()}
+            ref = self._ids.get(ref, ref)
+        return ref
+
+    def layers(self, ref):
+        ref = self.resolve_image(ref)
+        return self.state['images'].get(ref) or self._seeded_layers(ref)
+
+    def image_info(self, ref):
+        layers = self.layers(ref)
+        if layers is None:
+            return None
+        ref = self.resolve_image(ref)
+        return {'Id': digest(ref), 'RepoTags': [f"{ref}:latest"], 'Size': LAYER_SIZE * len(layers),
+                'RootFS': {'Type': 'layers', 'Layers': [digest(layer) for layer in layers]},
+                'Config': {'Cmd': ['sh'], 'Env': ['PATH=/usr/bin:/bin']}}
+
+    def find(self, ref):
+        for container_id, container in self.state['containers'].items():
+            if ref in (container_id, container['name']):
+                return container_id
+        return None
+
+    def containers(self, pattern=None, include_stopped=True):
+        for container_id, container in self.state['containers'].items():
+            if not include_stopped and not container['running']:
+                continue
+            if pattern and not re.search(pattern, container['name']):
+                continue
+            yield container_id, container
+
+    def create(self, name, image, running=False, mounts=()):
+        # (container ID, None), or (None, error message). mounts are (type, source,
+        # destination, read-only) tuples; a volume without a source is anonymous.
+        if name and self.find(name):
+            return None, f"Conflict. The container name \"/{name}\" is already in use"
+        if self.layers(image) is None:
+            return None, f"No such image: {image}"
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        self.state['containers'][container_id] = {'name': name or container_id[:12],
+                                                  'image': self.resolve_image(image), 'running': running}
+        if mounts:
+            self.state['containers'][container_id]['mounts'] = [inspected_mount(*mount) for mount in mounts]
+        return container_id, None
+
+    def set_running(self, ref, running):
+        container_id = self.find(ref)
+        if container_id:
+            self.state['containers'][container_id]['running'] = running
+        return container_id is not None
+
+    def rename(self, ref, new_name):
+        container_id = self.find(ref)
+        if not container_id or self.find(new_name):
+            return False
+        self.state['containers'][container_id]['name'] = new_name
+        return True
+
+    def remove_container(self, ref):
+        container_id = self.find(ref)
+        if container_id:
+            del self.state['containers'][container_id]
+        return container_id is not None
+
+    def commit(self, ref, image):
+        container_id = self.find(ref)
+        if not container_id:
+            return None
+        image = normalize(image)
+        self.state['images'][image] = self.layers(self.state['containers'][container_id]['image']) + [f"{image}/top"]
+        self._ids = None
+        return digest(image)
+
+    def remove_image(self, ref):
+        # 'removed', 'missing' or 'in use'
+        ref = self.resolve_image(ref)
+        if self.layers(ref) is None:
+            return 'missing'
+        if any(container['image'] == ref for container in self.state['containers'].values()):
+            return 'in use'
+        if self.state['images'].pop(ref, None) is None:
+            self._removed.add(ref)
+            self.state['removed'].append(ref)
+        self._ids = None
+        return 'removed'
+
+
+def inspected_mount(kind, source, destination, read_only):
+    # A mount as `container inspect` shows it
+    mount = {'Type': kind, 'Destination': destination, 'RW': not read_only}
+    if kind == 'volume':
+        mount['Name'] = source or uuid.uuid4().hex + uuid.uuid4().hex
+        mount['Source'] = f"/var/lib/docker/volumes/{mount['Name']}/_data"
+    else:
+        mount['Source'] = source or ''
+    return mount
+
+# docker-compatible executable
+
+def option(args, name):
+    return args[args.index(name) + 1] if name in args else None
+
+def name_pattern(args):
+    value = option(args, '--filter')
+    return value[len('name='):] if value and value.startswith('name=') else None
+
+def positionals(args):
+    # Drops options and their values; good enough for the commands scon runs
+    result, skip = [], False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in ('--name', '--format', '--filter', '--change', '--mount'):
+            skip = True
+        elif not arg.startswith('-'):
+            result.append(arg)
+    return result
+
+def mount_fields(value):
+    # `--mount type=...,source=...,destination=...[,readonly]` as a create() mount
+    fields = dict(field.partition('=')[::2] for field in value.split(','))
+    return fields['type'], fields.get('source'), fields['destination'], 'readonly' in fields
+
+def run_cli(runtime, args, stdin=None):
+    # Returns (exit code, stdout, stderr) for one invocation
+    command, rest = args[0], args[1:]
+    if command in ('--version', 'version'):
+        return 0, "Docker version 0.0.0-fake\n", ""
+    if command == 'container' and rest and rest[0] == 'inspect':
+        lines, stderr = [], ''
+        for ref in positionals(rest[1:]):
+            container_id = runtime.find(ref)
+            if not container_id:
+                stderr += f"Error: No such container: {ref}\n"
+                continue
+            container = runtime.state['containers'][container_id]
+            size = container.get('size_rw', 0)
+            if '{{.Id}}' in (option(rest, '--format') or ''):
+                lines.append(f"{container_id} /{container['name']} {size}")
+            else:
+                lines.append(f"{size}" if '--size' in rest else json.dumps(container.get('mounts', [])))
+        return int(bool(stderr)), ''.join(f"{line}\n" for line in lines), stderr
+    if command == 'image' and rest and rest[0] == 'inspect':
+        infos = [runtime.image_info(ref) for ref in rest[1:]]
+        missing = [ref for ref, info in zip(rest[1:], infos) if info is None]
+        stderr = ''.join(f"Error: No such image: {ref}\n" for ref in missing)
+        return int(bool(missing)), json.dumps([info for info in infos if info]) + "\n", stderr
+    if command == 'ps':
+        lines = []
+        for container_id, container in runtime.containers(name_pattern(rest), include_stopped='-a' in rest):
+            if '{{.State}}' in (option(rest, '--format') or ''):
+                state = 'running' if container['running'] else 'exited'
+                lines.append(f"{container_id}\t{container['name']}\t{container['image']}\t{state}")
+            else:
+                lines.append(f"{container_id} {container['name']}")
+        return 0, ''.join(line + "\n" for line in lines), ""
+    if command == 'images':
+        lines = [f"{digest(ref)}\t{ref}:latest" for ref in runtime.image_refs()]
+        return 0, ''.join(line + "\n" for line in lines), ""
+    if command in ('run', 'create'):
+        image = positionals(rest)[0]
+        mounts = [mount_fields(value) for flag, value in zip(rest, rest[1:]) if flag == '--mount']
+        container_id, error = runtime.create(option(rest, '--name'), image, running=command == 'run', mounts=mounts)
+        return (0, container_id + "\n", "") if container_id else (125, "", f"Error: {error}\n")
+    if command in ('start', 'stop'):
+        ok = runtime.set_running(rest[0], command == 'start')
+        return (0, rest[0] + "\n", "") if ok else (1, "", f"Error: No such container: {rest[0]}\n")
+    if command == 'rename':
+        ok = runtime.rename(rest[0], rest[1])
+        return (0, "", "") if ok else (1, "", f"Error: cannot rename {rest[0]} to {rest[1]}\n")
+    if command == 'commit':
+        image_id = runtime.commit(rest[0], rest[1])
+        return (0, image_id + "\n", "") if image_id else (1, "", f"Error: No such container: {rest[0]}\n")
+    if command == 'rm':
+        refs = positionals(rest)
+        removed = [ref for ref in refs if runtime.remove_container(ref)]
+        stderr = ''.join(f"Error: No such container: {ref}\n" for ref in refs if ref not in removed)
+        return int(len(removed) < len(refs)), ''.join(ref + "\n" for ref in removed), stderr
+    if command == 'rmi':
+        stdout, stderr = [], []
+        for ref in rest:
+            outcome = runtime.remove_image(ref)
+            if outcome == 'removed':
+                stdout.append(f"Untagged: {normalize(ref)}:latest\n")
+            elif outcome == 'missing':
+                stderr.append(f"Error response from daemon: No such image: {normalize(ref)}:latest\n")
+            else:
+                stderr.append(f"Error response from daemon: conflict: unable to remove repository reference "
+                              f"\"{ref}\" (must force) - container is using its referenced image\n")
+        return int(bool(stderr)), ''.join(stdout), ''.join(stderr)
+    if command == 'save':
+        # Not a tar archive: scon only pipes it into another runtime's `load`
+        layers = runtime.layers(rest[0])
+        if layers is None:
+            return 1, "", f"Error: No such image: {rest[0]}\n"
+        return 0, json.dumps({'ref': runtime.resolve_image(rest[0]), 'layers': layers}) + "\n", ""
+    if command == 'load':
+        image = json.loads(stdin.read())
+        runtime.state['images'][image['ref']] = image['layers']
+        return 0, f"Loaded image: {image['ref']}:latest\n", ""
+    return 2, "", f"fake runtime: unsupported command: {' '.join(args)}\n"
+
+def cli_main(args):
+    started_at = time.perf_counter()
+    path = os.environ[STATE_ENV]
+    latency = float(os.environ.get(LATENCY_ENV) or 0)
+    if args[:1] in (['-H'], ['--url']):
+        host, args = args[1], args[2:]
+        path = host_state_path(path, host)
+        if not os.path.exists(path):
+            sys.stderr.write(f"Cannot connect to the Docker daemon at {host}. Is the docker daemon running?\n")
+            return 1
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        with open(path) as file:
+            state = json.load(file)
+        latency = state.get('latency_ms', latency)
+        runtime = FakeRuntime(state)
+        exit_code, stdout, stderr = run_cli(runtime, args or ['--version'], sys.stdin)
+        if exit_code == 0 or args[0] in ('rm', 'rmi'):
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w') as file:
+                json.dump(state, file)
+            os.replace(temp_path, path)
+    if latency:
+        time.sleep(latency / 1000)
+    with open(f"{path}.calls", 'a') as log:
+        log.write(json.dumps({'op': ' '.join(args[:2] if args[:1] in (['image'], ['container']) else args[:1]),
+                              'ms': round((time.perf_counter() - started_at) * 1000, 3)}) + "\n")
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return exit_code
+
+def install(bin_dir):
+    # Executables that import this module from where it lives, under both runtime names
+    os.makedirs(bin_dir, exist_ok=True)
+    script = (f"#!{sys.executable}\nimport sys\nsys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+              "from fake_runtime import cli_main\nsys.exit(cli_main(sys.argv[1:]))\n")
+    for name in ('docker', 'podman'):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as file:
+            file.write(script)
+        os.chmod(path, 0o755)
+
+def read_calls(path):
+    # [(op, ms)] of the invocations logged so far
+    if not os.path.exists(f"{path}.calls"):
+        return []
+    with open(f"{path}.calls") as file:
+        return [(call['op'], call['ms']) for call in map(json.loads, file)]
+
+def init(path, hosts=()):
+    for state_path in [path] + [host_state_path(path, host) for host in hosts]:
+        with open(state_path, 'w') as file:
+            json.dump(empty_state(), file)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == 'install':
+        install(sys.argv[2])
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'init':
+        init(sys.argv[2], sys.argv[3:])
+    else:
+        sys.exit("usage: fake_runtime.py install BIN_DIR | init STATE [HOST...]")
@@ -0,0 +1,382 @@
+# benchmarks/scale.py
+#
+# Scaling benchmark: seeds state with N stateful containers and M snapshot history
+# entries, then runs scon commands against the fake runtime in fake_runtime.py (or
+# its API socket, fake_api.py). Every command runs in a fresh process on a fresh copy
+# of the seeded state. Per command it records:
+#   wall time (median of --runs), runtime calls and forks (as the fake runtime saw
+#   them), state-store operations and bytes read/written (from the `scon --trace`
+#   spans), and the peak RSS of the scon process.
+#
+#   python benchmarks/scale.py [--points 10x100,100x1000,...] [--quick] [--runs 3]
+#                              [--commands list,stop,...] [--runtime cli|api]
+#                              [--backend sqlite|journal|json] [--latency-ms 0] [--endpoints 1]
+#                              [--output results.json] [--baseline baseline.json] [--json]
+#
+# A point NxM is N SCs sharing M history entries (rounded down to a multiple of N).
+# With --endpoints K the SCs are spread round-robin over the local runtime and K-1
+# more fake runtimes, configured as runtime endpoints.
+# `start` is a cold start; `start --warm` starts an SC outside both groups that has a
+# warm container seeded for its next snapshot, with warm_pool on.
+# Exits non-zero when a command fails or, with --baseline, when a result regressed
+# past the tolerances below.
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+import fake_runtime
+from scon.utils import state_store, warm_pool
+from scon.utils.garbage_collector import format_bytes
+
+RESULTS_FORMAT = 1
+DEFAULT_POINTS = [(10, 100), (100, 1000), (1000, 10000), (10000, 100000)]
+QUICK_POINTS = DEFAULT_POINTS[:2]
+# SCs in each of the two labelled groups: 'running' ones and 'stopped' ones
+GROUP_SIZE = 20
+# {running} is the first running SC, {stopped} the first stopped one with a snapshot to
+# start, {warm} a stopped one with a warm container for it
+COMMANDS = {
+    'list': ['list'],
+    'start': ['start', '{stopped}'],
+    'start --warm': ['start', '{warm}'],
+    'stop': ['stop', '{running}'],
+    'start --label': ['start', '--label', 'bench=stopped'],
+    'stop --label': ['stop', '--label', 'bench=running'],
+    # Snapshots prune the SC's history down to max_snapshots
+    'snapshot': ['snapshot', '{running}'],
+    'snapshot --label': ['snapshot', '--label', 'bench=running'],
+    'gc --dry-run': ['gc', '--dry-run'],
+    'reconcile': ['reconcile'],
+}
+# Config on top of the point's for single commands
+COMMAND_CONFIG = {'start --warm': {'warm_pool': True}}
+STATE_FILES = {'sqlite': 'stateful_containers.db', 'journal': 'stateful_containers.journal',
+               'json': 'stateful_containers.json'}
+# Allowed growth over the baseline, as a fraction, and the change below which a
+# difference is noise whatever its ratio
+TOLERANCES = {'wall_ms': 0.25, 'runtime_calls': 0, 'forks': 0, 'state_read_bytes': 0.10,
+              'state_write_bytes': 0.10, 'peak_rss_kb': 0.20}
+NOISE_FLOORS = {'wall_ms': 5, 'peak_rss_kb': 1024}
+
+def parse_points(value):
+    points = []
+    for point in value.split(','):
+        scs, _, history = point.partition('x')
+        points.append((int(scs), int(history or scs)))
+    return points
+
+def group_size(scs):
+    # Leaves one SC past both groups for the warm start
+    return max(1, min(GROUP_SIZE, (scs - 1) // 2))
+
+def warm_index(scs):
+    return min(2 * group_size(scs), scs - 1)
+
+def endpoint_names(count):
+    return ['local'] + [f"host-{number}" for number in range(1, count)]
+
+def host_url(name):
+    return f"tcp://{name}:2375"
+
+def endpoint_url(name, runtime, run_dir):
+    # CLI endpoints are `-H` hosts of the fake executable, API ones sockets of their own
+    return f"unix://{os.path.join(run_dir, name + '.sock')}" if runtime == 'api' else host_url(name)
+
+def runtime_state_path(directory, endpoint):
+    # The fake executable finds a host's runtime next to the local one
+    path = os.path.join(directory, 'runtime.json')
+    return path if endpoint == 'local' else fake_runtime.host_state_path(path, host_url(endpoint))
+
+def seed(scs, history, endpoint_count=1):
+    # Returns (records, {endpoint: fake runtime state}) for a point
+    per_sc = max(1, history // scs)
+    base = datetime.utcnow() - timedelta(seconds=per_sc + 60)
+    spec = {'scs': scs, 'per_sc': per_sc, 'base_ts': int(time.time()) - per_sc - 60}
+    names = endpoint_names(endpoint_count)
+    runtime_states = {name: fake_runtime.empty_state(spec) for name in names}
+    group = group_size(scs)
+    records = []
+    for index in range(scs):
+        name = fake_runtime.sc_name(index)
+        snapshots, containers = [], [{'name': name, 'container_id': None, 'image': fake_runtime.BASE_IMAGE,
+                                      'created_at': base.isoformat(), 'status': 'created'}]
+        image = fake_runtime.BASE_IMAGE
+        for number in range(per_sc):
+            created_at = (base + timedelta(seconds=number)).isoformat()
+            containers.append({'name': name, 'container_id': uuid.uuid4().hex, 'image': image,
+                               'created_at': created_at, 'status': 'stopped'})
+            image = fake_runtime.seeded_image(index, number, spec)
+            snapshots.append({'name': image, 'image_id': image, 'created_at': created_at,
+                              'layer_depth': fake_runtime.seeded_layer_depth(number),
+                              'source_container': f"{name}_stopped_{number}"})
+        labels = {}
+        endpoint = names[index % len(names)]
+        if index < group:
+            labels['bench'] = 'running'
+            container_id, _ = fake_runtime.FakeRuntime(runtime_states[endpoint]).create(name, image, running=True)
+            containers.append({'name': name, 'container_id': container_id, 'image': image,
+                               'created_at': datetime.utcnow().isoformat(), 'status': 'running'})
+        elif index < 2 * group:
+            labels['bench'] = 'stopped'
+        record = {'name': name, 'endpoint': endpoint, 'labels': labels, 'containers': containers,
+                  'snapshots': snapshots, 'next_snapshot_to_start': dict(snapshots[-1]), 'deleted': []}
+        if index == warm_index(scs) and index >= 2 * group:
+            # As refresh_warm_container leaves it after a stop with warm_pool on
+            warm_name = f"{warm_pool.WARM_PREFIX}{name}_{spec['base_ts']}"
+            container_id, _ = fake_runtime.FakeRuntime(runtime_states[endpoint]).create(warm_name, image)
+            record['warm_container'] = {'name': warm_name, 'container_id': container_id, 'image_id': image,
+                                        'created_at': datetime.utcnow().isoformat()}
+        records.append(record)
+    return records, runtime_states
+
+def write_state(records, backend, data_dir):
+    path = os.path.join(data_dir, STATE_FILES[backend])
+    if backend == 'json':
+        store = state_store.JsonStateStore(path)
+        store.replace_all(records)
+    else:
+        store = state_store.JournalStateStore(path) if backend == 'journal' else state_store.SqliteStateStore(path)
+        store.put_many(records)
+    store.close()
+
+def prepare_template(template, scs, history, args):
+    # Seeded config, data and runtime directories that every run starts from a copy of
+    run_dir = os.path.join(os.path.dirname(template), 'run')
+    data_dir = os.path.join(template, 'data', 'scon')
+    config_dir = os.path.join(template, 'config', 'scon')
+    os.makedirs(data_dir)
+    os.makedirs(config_dir)
+    config = {'use_sudo': False, 'container_runtime': 'docker', 'runtime_api': args.runtime,
+              'state_backend': args.backend}
+    if args.runtime == 'api':
+        config['runtime_socket'] = os.path.join(run_dir, 'api.sock')
+    if args.endpoints > 1:
+        config['endpoints'] = {name: endpoint_url(name, args.runtime, run_dir) for name in endpoint_names(args.endpoints)[1:]}
+    with open(os.path.join(config_dir, 'scon_config.json'), 'w') as file:
+        json.dump(config, file)
+    records, runtime_states = seed(scs, history, args.endpoints)
+    write_state(records, args.backend, data_dir)
+    for name, runtime_state in runtime_states.items():
+        with open(runtime_state_path(template, name), 'w') as file:
+            json.dump(runtime_state, file)
+    return sum(len(record['snapshots']) for record in records)
+
+def read_trace(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+def run_once(argv, template, run_dir, bin_dir, args, config=None):
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    shutil.copytree(template, run_dir)
+    if config:
+        config_path = os.path.join(run_dir, 'config', 'scon', 'scon_config.json')
+        with open(config_path) as file:
+            config = dict(json.load(file), **config)
+        with open(config_path, 'w') as file:
+            json.dump(config, file)
+    runtime_path = runtime_state_path(run_dir, 'local')
+    trace_path = os.path.join(run_dir, 'trace.jsonl')
+    env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}", PYTHONPATH=ROOT,
+               XDG_CONFIG_HOME=os.path.join(run_dir, 'config'), XDG_DATA_HOME=os.path.join(run_dir, 'data'),
+               XDG_RUNTIME_DIR=run_dir, SCON_NO_DAEMON='1', SCON_TRACE=trace_path,
+               **{fake_runtime.STATE_ENV: runtime_path, fake_runtime.LATENCY_ENV: str(args.latency_ms)})
+    servers = []
+    if args.runtime == 'api':
+        import fake_api
+        for name in endpoint_names(args.endpoints):
+            with open(runtime_state_path(run_dir, name)) as file:
+                socket_path = 'api.sock' if name == 'local' else f"{name}.sock"
+                servers.append(fake_api.FakeApiServer(os.path.join(run_dir, socket_path), json.load(file),
+                                                      args.latency_ms).start())
+
+    try:
+        with open(os.path.join(run_dir, 'stdout.log'), 'w') as out, open(os.path.join(run_dir, 'stderr.log'), 'w') as err:
+            started_at = time.perf_counter()
+            process = subprocess.Popen([sys.executable, '-m', 'scon.cli', *argv], cwd=run_dir, env=env,
+                                       stdout=out, stderr=err)
+            # wait4 rather than wait() for the child's own resource usage
+            _, status, usage = os.wait4(process.pid, 0)
+            wall_ms = (time.perf_counter() - started_at) * 1000
+            process.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        for server in servers:
+            server.stop()
+
+    if servers:
+        calls = [call for server in servers for call in server.calls]
+    else:
+        calls = [call for name in endpoint_names(args.endpoints)
+                 for call in fake_runtime.read_calls(runtime_state_path(run_dir, name))]
+    state_spans = [span for span in read_trace(trace_path) if span['op'].startswith('state.')]
+    result = {
+        'exit_code': process.returncode,
+        'wall_ms': round(wall_ms, 1),
+        'runtime_calls': len(calls),
+        'forks': 0 if servers else len(calls),
+        'runtime_ms': round(sum(ms for _, ms in calls), 1),
+        'state_ops': len(state_spans),
+        'state_read_bytes': sum(span.get('bytes_read', 0) for span in state_spans),
+        'state_write_bytes': sum(span.get('bytes_written', 0) for span in state_spans),
+        # ru_maxrss is in KB on Linux
+        'peak_rss_kb': usage.ru_maxrss,
+        'calls_by_op': dict(Counter(op for op, _ in calls)),
+    }
+    if process.returncode != 0:
+        with open(os.path.join(run_dir, 'stderr.log')) as file:
+            result['stderr'] = file.read()[-2000:]
+    return result
+
+def measure(name, argv, template, run_dir, bin_dir, args):
+    runs = [run_once(argv, template, run_dir, bin_dir, args, COMMAND_CONFIG.get(name)) for _ in range(args.runs)]
+    result = dict(runs[-1], command=name, argv=argv)
+    result['wall_ms'] = round(statistics.median(run['wall_ms'] for run in runs), 1)
+    result['wall_ms_min'] = min(run['wall_ms'] for run in runs)
+    result['peak_rss_kb'] = max(run['peak_rss_kb'] for run in runs)
+    return result
+
+def run_benchmarks(args, work_dir):
+    bin_dir = os.path.join(work_dir, 'bin')
+    fake_runtime.install(bin_dir)
+    results = []
+    for scs, history in args.points:
+        point_dir = os.path.join(work_dir, f"{scs}x{history}")
+        template = os.path.join(point_dir, 'template')
+        started_at = time.perf_counter()
+        # Seeding runs in its own process: a child's peak RSS starts from what this
+        # process had when it forked, so this one has to stay small
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            seeded = pool.submit(prepare_template, template, scs, history, args).result()
+        print(f"Seeded {scs} SCs with {seeded} history entries ({time.perf_counter() - started_at:.1f}s)",
+              file=sys.stderr)
+        group = group_size(scs)
+        names = {'running': fake_runtime.sc_name(0), 'stopped': fake_runtime.sc_name(min(group, scs - 1)),
+                 'warm': fake_runtime.sc_name(warm_index(scs))}
+        for command in args.commands:
+            argv = [arg.format(**names) for arg in COMMANDS[command]]
+            result = measure(command, argv, template, os.path.join(point_dir, 'run'), bin_dir, args)
+            result.update(scs=scs, history=seeded)
+            results.append(result)
+            print(f"  {command:<16} {result['wall_ms']:>9.1f} ms", file=sys.stderr)
+    return results
+
+def result_key(result):
+    return result['scs'], result['history'], result['command']
+
+def compare(results, baseline):
+    # Returns [(result, metric, baseline value, current value)] past the tolerances
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get(result_key(result))
+        if base is None:
+            continue
+        for metric, tolerance in TOLERANCES.items():
+            before, after = base.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + tolerance) and after - before > NOISE_FLOORS.get(metric, 0):
+                regressions.append((result, metric, before, after))
+    return regressions
+
+def print_table(results, baseline=None):
+    previous = {result_key(result): result for result in (baseline or {}).get('results', [])}
+    print(f"{'POINT':<13} {'COMMAND':<16} {'WALL MS':>9} {'VS BASE':>8} {'CALLS':>7} {'FORKS':>7} "
+          f"{'STATE OPS':>9} {'STATE READ':>11} {'STATE WRITTEN':>13} {'PEAK RSS':>10}")
+    for result in results:
+        base = previous.get(result_key(result))
+        change = f"{(result['wall_ms'] / base['wall_ms'] - 1) * 100:+.0f}%" if base and base['wall_ms'] else '-'
+        point = f"{result['scs']}x{result['history']}"
+        print(f"{point:<13} {result['command']:<16} "
+              f"{result['wall_ms']:>9.1f} {change:>8} {result['runtime_calls']:>7} {result['forks']:>7} "
+              f"{result['state_ops']:>9} {format_bytes(result['state_read_bytes']):>11} "
+              f"{format_bytes(result['state_write_bytes']):>13} {format_bytes(result['peak_rss_kb'] * 1024):>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how scon commands scale with SCs and history")
+    parser.add_argument('--points', type=parse_points, help='Comma-separated SCSxHISTORY points (default: '
+                        + ','.join(f"{s}x{h}" for s, h in DEFAULT_POINTS) + ')')
+    parser.add_argument('--quick', action='store_true', help='Only the two smallest default points')
+    parser.add_argument('--commands', help=f"Comma-separated commands to run (default: all of {', '.join(COMMANDS)})")
+    parser.add_argument('--runs', type=int, default=3, help='Runs per command; wall time is their median')
+    parser.add_argument('--runtime', choices=['cli', 'api'], default='cli', help='Fake runtime executable or API socket')
+    parser.add_argument('--backend', choices=list(STATE_FILES), default='sqlite', help='State backend')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Added latency of every runtime call')
+    parser.add_argument('--endpoints', type=int, default=1, help='Fake runtimes to spread the SCs over')
+    parser.add_argument('--work-dir', help='Keep the seeded state and the last run of each command here')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against results written earlier with --output')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+    args.points = args.points or (QUICK_POINTS if args.quick else DEFAULT_POINTS)
+    args.commands = args.commands.split(',') if args.commands else list(COMMANDS)
+    unknown = [command for command in args.commands if command not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown command(s): {', '.join(unknown)}")
+
+    if args.work_dir:
+        if os.path.exists(args.work_dir):
+            shutil.rmtree(args.work_dir)
+        os.makedirs(args.work_dir)
+        results = run_benchmarks(args, os.path.abspath(args.work_dir))
+    else:
+        with tempfile.TemporaryDirectory(prefix='scon-bench-') as work_dir:
+            results = run_benchmarks(args, work_dir)
+
+    report = {
+        'format': RESULTS_FORMAT,
+        'created_at': datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        # Results are only comparable between runs with the same params
+        'params': {'runtime': args.runtime, 'backend': args.backend, 'latency_ms': args.latency_ms,
+                   'endpoints': args.endpoints},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('params') != report['params']:
+            print(f"Warning: baseline was run with {baseline.get('params')}, not {report['params']}.", file=sys.stderr)
+    regressions = compare(results, baseline) if baseline else []
+    failed = [result for result in results if result['exit_code'] != 0]
+
+    if args.json:
+        report['regressions'] = [{'scs': result['scs'], 'history': result['history'], 'command': result['command'],
+                                  'metric': metric, 'baseline': before, 'current': after}
+                                 for result, metric, before, after in regressions]
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(results, baseline)
+        for result, metric, before, after in regressions:
+            print(f"REGRESSION {result['scs']}x{result['history']} {result['command']}: {metric} {before} -> {after}")
+        for result in failed:
+            print(f"FAILED {result['scs']}x{result['history']} {result['command']} "
+                  f"(exit {result['exit_code']}): {result.get('stderr', '').strip()}")
+    sys.exit(1 if regressions or failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# benchmarks/startup.py
+#
+# CLI startup time: median wall time of `scon --help` and a few cheap commands,
+# each in a fresh interpreter against an empty config/data directory.
+#
+#   python benchmarks/startup.py [--runs 20] [--target-ms 50] [--json]
+#
+# Exits non-zero when `scon --help` misses the target.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TARGET_MS = 50
+COMMANDS = {
+    'python -c pass': ['-c', 'pass'],
+    'scon --help': ['-m', 'scon.cli', '--help'],
+    'scon config show': ['-m', 'scon.cli', 'config', 'show'],
+    'scon jobs list': ['-m', 'scon.cli', 'jobs', 'list'],
+}
+
+def measure(args, runs, env):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {'median_ms': round(statistics.median(samples), 1), 'min_ms': round(min(samples), 1),
+            'max_ms': round(max(samples), 1), 'runs': runs}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure scon CLI startup time")
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--target-ms', type=float, default=DEFAULT_TARGET_MS)
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, XDG_CONFIG_HOME=os.path.join(home, 'config'),
+                   XDG_DATA_HOME=os.path.join(home, 'data'), PYTHONPATH=ROOT)
+        results = {name: measure(command, args.runs, env) for name, command in COMMANDS.items()}
+
+    passed = results['scon --help']['median_ms'] <= args.target_ms
+    if args.json:
+        print(json.dumps({'results': results, 'target_ms': args.target_ms, 'passed': passed}, indent=2))
+    else:
+        for name, result in results.items():
+            print(f"{name:<20} median {result['median_ms']:>7.1f} ms  (min {result['min_ms']:.1f}, max {result['max_ms']:.1f})")
+        print(f"scon --help target {args.target_ms:.0f} ms: {'ok' if passed else 'MISSED'}")
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
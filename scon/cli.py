@@ -1,20 +1,68 @@
 import argparse
-from scon.commands import create, start, stop, list_containers, delete, snapshot, config
+import importlib
+import sys
 
-def main():
+# Subcommand -> (module, function that adds its parser, help). Only the module of
+# the command being run is imported; the rest are listed for --help from here.
+COMMANDS = {
+    'create': ('scon.commands.create', 'add_create_command', 'Create a new stateful container'),
+    'start': ('scon.commands.start', 'add_start_command', 'Start one or more stateful containers'),
+    'stop': ('scon.commands.stop', 'add_stop_command', 'Stop one or more stateful containers and save their state'),
+    'list': ('scon.commands.list_containers', 'add_list_command', 'List all stateful containers'),
+    'delete': ('scon.commands.delete', 'add_delete_command', 'Delete a stateful container entry'),
+    'snapshot': ('scon.commands.snapshot', 'add_snapshot_command', 'Manually create a snapshot of one or more running containers'),
+    'config': ('scon.commands.config', 'add_config_command', 'Configure scon settings'),
+    'jobs': ('scon.commands.jobs', 'add_jobs_command', 'Inspect and run queued background jobs (deferred snapshot commits)'),
+    'gc': ('scon.commands.garbage_collect', 'add_gc_command', 'Remove snapshot images no stateful container still needs'),
+    'reconcile': ('scon.commands.reconcile', 'add_reconcile_command', 'Compare recorded state against the containers and images the runtime actually has'),
+    'watch': ('scon.commands.watch', 'add_watch_command', 'Run in the foreground and snapshot stateful containers as soon as they exit'),
+    'export': ('scon.commands.export_container', 'add_export_command', 'Export a stateful container and its snapshots into a deduplicated chunk store'),
+    'import': ('scon.commands.import_container', 'add_import_command', 'Import a stateful container exported with `scon export`'),
+    'du': ('scon.commands.du', 'add_du_command', 'Show how much disk the snapshots of each stateful container use'),
+    'stats': ('scon.commands.stats', 'add_stats_command', 'Show p50/p95/p99 timings of runtime calls, state operations and commands'),
+    'schedule': ('scon.commands.schedule', 'add_schedule_command', 'Snapshot running stateful containers periodically'),
+    'serve': ('scon.commands.serve', 'add_serve_command', 'Run the scon daemon that other scon invocations hand their commands to'),
+}
+
+def run(argv):
+    # Parses and runs one command in this process; returns its exit code
     parser = argparse.ArgumentParser(description="Stateful Containers CLI")
+    # Literal rather than from scon.utils.tracing, which `scon --help` should not have to import
+    parser.add_argument('--trace', action='store_true',
+                        help="Append a timing span per runtime call and state operation to trace.jsonl "
+                             "in the data directory (or set SCON_TRACE=1, or to a file path)")
     subparsers = parser.add_subparsers(dest='command', required=True)
 
-    create.add_create_command(subparsers)
-    start.add_start_command(subparsers)
-    stop.add_stop_command(subparsers)
-    list_containers.add_list_command(subparsers)
-    delete.add_delete_command(subparsers)
-    snapshot.add_snapshot_command(subparsers)  # Add this line
-    config.add_config_command(subparsers)
+    command = next((arg for arg in argv if not arg.startswith('-')), None)
+    for name, (module, add_command, help_text) in COMMANDS.items():
+        if name == command:
+            getattr(importlib.import_module(module), add_command)(subparsers)
+        else:
+            subparsers.add_parser(name, help=help_text)
+
+    try:
+        args = parser.parse_args(argv)
+        from scon.utils import tracing
+        trace_path = tracing.trace_path_from_env()
+        if args.trace or trace_path:
+            tracing.enable(trace_path)
+        with tracing.span(f"command.{args.command}"):
+            args.func(args)
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            print(e.code, file=sys.stderr)
+            return 1
+        return e.code or 0
+    return 0
 
-    args = parser.parse_args()
-    args.func(args)
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Hand the command to a running `scon serve`, if there is one
+    from scon.utils import daemon
+    exit_code = daemon.forward(argv)
+    if exit_code is None:
+        exit_code = run(argv)
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
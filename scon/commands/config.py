@@ -7,8 +7,8 @@ def add_config_command(subparsers):
     config_subparsers = parser.add_subparsers(dest='config_command', required=True)
 
     parser_config_set = config_subparsers.add_parser('set', help='Set a configuration value')
-    parser_config_set.add_argument('key', help='Configuration key (use_sudo or container_runtime)')
-    parser_config_set.add_argument('value', help='Value to set for the configuration key')
+    parser_config_set.add_argument('key', help=f'Configuration key ({config_manager.setting_keys()})')
+    parser_config_set.add_argument('value', help='Value to set for the configuration key (for endpoint: NAME=URL, or NAME= to remove it)')
     parser_config_set.set_defaults(func=handle_config_set)
 
     parser_config_show = config_subparsers.add_parser('show', help='Show the current configuration')
@@ -1,14 +1,28 @@
-from scon.utils import container_manager
+from scon.utils import container_manager, bulk, endpoints
 
 def add_create_command(subparsers):
     parser = subparsers.add_parser('create', help='Create a new stateful container')
     parser.add_argument('name', help='Name of the stateful container')
     parser.add_argument('image', help='Initial container image')
+    parser.add_argument('--label', dest='labels', action='append', default=[], metavar='KEY=VALUE',
+                        help='Attach a label used by --label selectors (repeatable)')
+    parser.add_argument('--endpoint', metavar='NAME',
+                        help="Runtime endpoint the SC lives on, or 'auto' for the least loaded one (default: local)")
     parser.set_defaults(func=handle_create)
 
 def handle_create(args):
+    try:
+        labels = bulk.parse_labels(args.labels)
+    except ValueError as e:
+        print(e)
+        return
+
+    endpoint = container_manager.resolve_endpoint(args.endpoint) if args.endpoint else endpoints.LOCAL
+    if endpoint is None:
+        return
+
     # Check if a Docker container with the same name already exists
-    if container_manager.docker_container_exists(args.name):
+    if container_manager.docker_container_exists(args.name, endpoint):
         print(f"Error: A Docker container with the name '{args.name}' already exists.")
         print(f"Please delete the existing container or choose a different name.")
         print(f"You can list your existing containers with `{container_manager.get_runtime_command()} ps -a`.")
@@ -16,4 +30,4 @@ def handle_create(args):
         return
 
     # Proceed with creating the SC if no conflicts
-    container_manager.handle_create(args.name, args.image)
+    container_manager.handle_create(args.name, args.image, labels, endpoint)
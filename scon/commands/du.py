@@ -0,0 +1,15 @@
+# scon/commands/du.py
+
+from scon.utils import container_manager
+
+def add_du_command(subparsers):
+    parser = subparsers.add_parser('du', help='Show how much disk the snapshots of each stateful container use')
+    parser.add_argument('patterns', nargs='*', metavar='NAME', help='Only show SCs whose name matches (globs allowed)')
+    parser.add_argument('--snapshots', action='store_true', help='Show every snapshot instead of a total per SC')
+    parser.add_argument('--refresh', action='store_true', help='Inspect every image again instead of using cached layer sizes')
+    parser.add_argument('--format', dest='output_format', choices=['table', 'jsonl'], default='table',
+                        help='Output a table or one JSON object per line')
+    parser.set_defaults(func=handle_du)
+
+def handle_du(args):
+    container_manager.handle_du(args.patterns, args.snapshots, args.output_format, args.refresh)
@@ -0,0 +1,14 @@
+# scon/commands/export_container.py
+
+from scon.utils import container_manager
+
+def add_export_command(subparsers):
+    parser = subparsers.add_parser('export', help='Export a stateful container and its snapshots into a deduplicated chunk store')
+    parser.add_argument('name', help='Name of the stateful container')
+    parser.add_argument('--to', dest='destination', help='Directory to copy the export into (resumes an interrupted copy)')
+    parser.add_argument('--all-snapshots', action='store_true', help='Export every recorded snapshot, not just the one the next start uses')
+    parser.add_argument('--workers', type=int, help='Number of chunks to compress or copy in parallel')
+    parser.set_defaults(func=handle_export)
+
+def handle_export(args):
+    container_manager.handle_export(args.name, args.destination, args.all_snapshots, args.workers)
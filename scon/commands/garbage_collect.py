@@ -0,0 +1,20 @@
+# scon/commands/garbage_collect.py
+
+from scon.utils import container_manager
+from scon.utils.config_manager import parse_size
+
+def add_gc_command(subparsers):
+    parser = subparsers.add_parser('gc', help='Remove snapshot images no stateful container still needs')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed and how much space it frees')
+    parser.add_argument('--workers', type=int, help='Number of removal batches to run in parallel')
+    parser.add_argument('--keep-stopped', action='store_true', help='Do not remove stopped containers whose state was already committed')
+    parser.add_argument('--free', metavar='SIZE',
+                        help='Only remove the snapshot images that free the most space, until SIZE is freed (e.g. 10G)')
+    parser.set_defaults(func=handle_gc)
+
+def handle_gc(args):
+    free = parse_size(args.free) if args.free else None
+    if args.free and free is None:
+        print(f"Invalid size '{args.free}'. Use a size such as 512M or 10G.")
+        return
+    container_manager.handle_gc(args.dry_run, args.workers, not args.keep_stopped, free)
@@ -0,0 +1,15 @@
+# scon/commands/import_container.py
+
+from scon.utils import container_manager
+
+def add_import_command(subparsers):
+    parser = subparsers.add_parser('import', help='Import a stateful container exported with `scon export`')
+    parser.add_argument('name', help='Name the stateful container was exported under')
+    parser.add_argument('--from', dest='source', help='Directory an export was copied to (default: the local chunk store)')
+    parser.add_argument('--as', dest='new_name', help='Import under a different stateful container name')
+    parser.add_argument('--workers', type=int, help='Number of chunks to copy or decompress in parallel')
+    parser.add_argument('--full', action='store_true', help='Send every layer to the runtime, even ones it already has')
+    parser.set_defaults(func=handle_import)
+
+def handle_import(args):
+    container_manager.handle_import(args.name, args.source, args.new_name, args.workers, not args.full)
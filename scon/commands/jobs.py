@@ -0,0 +1,44 @@
+# scon/commands/jobs.py
+
+from scon.utils import container_manager, json_storage
+
+def add_jobs_command(subparsers):
+    parser = subparsers.add_parser('jobs', help='Inspect and run queued background jobs (deferred snapshot commits)')
+    jobs_subparsers = parser.add_subparsers(dest='jobs_command', required=True)
+
+    parser_jobs_list = jobs_subparsers.add_parser('list', help='List queued jobs')
+    parser_jobs_list.add_argument('--status', choices=['pending', 'running', 'done', 'failed'], help='Only show jobs with this status')
+    parser_jobs_list.set_defaults(func=handle_jobs_list)
+
+    parser_jobs_run = jobs_subparsers.add_parser('run', help='Run queued jobs until the queue is empty')
+    parser_jobs_run.add_argument('--sc', dest='sc_name', help='Only run jobs for this stateful container')
+    parser_jobs_run.set_defaults(func=handle_jobs_run)
+
+    parser_jobs_retry = jobs_subparsers.add_parser('retry', help='Re-queue failed jobs')
+    parser_jobs_retry.add_argument('ids', nargs='*', type=int, help='Job IDs to retry (default: all failed jobs)')
+    parser_jobs_retry.set_defaults(func=handle_jobs_retry)
+
+    parser_jobs_purge = jobs_subparsers.add_parser('purge', help='Remove finished jobs from the queue')
+    parser_jobs_purge.set_defaults(func=handle_jobs_purge)
+
+def handle_jobs_list(args):
+    jobs = json_storage.get_job_queue().list_jobs(args.status)
+    if not jobs:
+        print("No jobs found.")
+        return
+    for job in jobs:
+        print(f"{job['id']:>6}  {job['status']:<8} {job['kind']:<8} {job['sc_name']}  {job['payload'].get('image', '')}"
+              f"  (attempts: {job['attempts']}){'  ' + job['error'] if job['error'] else ''}")
+
+def handle_jobs_run(args):
+    processed = container_manager.process_jobs(args.sc_name)
+    print(f"Processed {processed} job(s).")
+
+def handle_jobs_retry(args):
+    queue = json_storage.get_job_queue()
+    ids = args.ids or [job['id'] for job in queue.list_jobs('failed')]
+    retried = [job_id for job_id in ids if queue.retry(job_id)]
+    print(f"Re-queued {len(retried)} job(s).")
+
+def handle_jobs_purge(args):
+    print(f"Removed {json_storage.get_job_queue().purge_done()} finished job(s).")
@@ -1,10 +1,49 @@
 # scon/commands/list_containers.py
 
-from scon.utils import container_manager
+from scon.utils import container_manager, bulk, endpoints, listing
+from scon.utils.config_manager import load_config
 
 def add_list_command(subparsers):
     parser = subparsers.add_parser('list', help='List all stateful containers')
+    parser.add_argument('patterns', nargs='*', metavar='NAME', help='Only list SCs whose name matches (globs allowed)')
+    parser.add_argument('--status', help='Only list SCs whose current container has this status (e.g. running, stopped)')
+    parser.add_argument('--label', dest='labels', action='append', default=[], metavar='KEY=VALUE',
+                        help='Only list SCs with this label (repeatable)')
+    parser.add_argument('--tagged', action='store_true', default=None, help='Only list SCs that have tagged snapshots')
+    parser.add_argument('--untagged', dest='tagged', action='store_false', help='Only list SCs without tagged snapshots')
+    parser.add_argument('--older-than', metavar='AGE', help='Only list SCs whose newest snapshot is older than AGE (e.g. 7d, 12h)')
+    parser.add_argument('--newer-than', metavar='AGE', help='Only list SCs whose newest snapshot is newer than AGE')
+    parser.add_argument('--fields', help=f"Comma-separated fields to show ({', '.join(listing.FIELDS)})")
+    parser.add_argument('--sort', metavar='FIELD', help='Sort by a field (--sort=-FIELD or --desc for descending order)')
+    parser.add_argument('--desc', action='store_true', help='Sort in descending order')
+    parser.add_argument('--limit', type=int, help='Show at most this many SCs')
+    parser.add_argument('--offset', type=int, default=0, help='Skip this many SCs first (for paging with --limit)')
+    parser.add_argument('--endpoint', metavar='NAME', help='Only list SCs that live on this runtime endpoint')
+    parser.add_argument('--live', action='store_true',
+                        help="Ask every runtime endpoint for the SCs' current container state (adds the live column)")
+    parser.add_argument('--format', dest='output_format', choices=['table', 'jsonl'], default='table',
+                        help='Output a table or one JSON object per line')
+    parser.add_argument('--no-header', dest='header', action='store_false', help='Omit the table header')
     parser.set_defaults(func=handle_list)
 
 def handle_list(args):
-    container_manager.handle_list()
+    try:
+        labels = bulk.parse_labels(args.labels)
+        fields = listing.parse_fields(args.fields, listing.default_fields(endpoints.is_multi_host(load_config()),
+                                                                          args.live))
+        live = args.live or 'live' in fields
+        older_than = listing.parse_duration(args.older_than) if args.older_than else None
+        newer_than = listing.parse_duration(args.newer_than) if args.newer_than else None
+        sort = args.sort
+        if sort and (sort.lstrip('-') not in listing.FIELDS or sort.lstrip('-') == 'labels'):
+            raise ValueError(f"Cannot sort by '{sort}'.")
+        if sort and args.desc and not sort.startswith('-'):
+            sort = f"-{sort}"
+    except ValueError as e:
+        print(e)
+        return
+
+    container_manager.handle_list(args.output_format, args.header, patterns=args.patterns, status=args.status,
+                                  tagged=args.tagged, older_than=older_than, newer_than=newer_than, labels=labels,
+                                  fields=fields, sort=sort, limit=args.limit, offset=args.offset,
+                                  endpoint=args.endpoint, live=live)
@@ -0,0 +1,11 @@
+# scon/commands/reconcile.py
+
+from scon.utils import container_manager
+
+def add_reconcile_command(subparsers):
+    parser = subparsers.add_parser('reconcile', help='Compare recorded state against the containers and images the runtime actually has')
+    parser.add_argument('--repair', action='store_true', help='Fix stale statuses, bad container IDs and references to missing images')
+    parser.set_defaults(func=handle_reconcile)
+
+def handle_reconcile(args):
+    container_manager.handle_reconcile(args.repair)
@@ -0,0 +1,50 @@
+# scon/commands/schedule.py
+
+from scon.utils import bulk, listing, scheduler
+
+def add_schedule_command(subparsers):
+    parser = subparsers.add_parser('schedule', help='Snapshot running stateful containers periodically')
+    schedule_subparsers = parser.add_subparsers(dest='schedule_command', required=True)
+
+    parser_schedule_set = schedule_subparsers.add_parser('set', help='Snapshot the selected containers at an interval while they run')
+    bulk.add_selector_arguments(parser_schedule_set, workers=False)
+    parser_schedule_set.add_argument('--every', required=True, metavar='DURATION', help='Interval between snapshots (e.g. 30m, 6h, 1d)')
+    parser_schedule_set.set_defaults(func=handle_schedule_set)
+
+    parser_schedule_clear = schedule_subparsers.add_parser('clear', help='Stop the scheduled snapshots of the selected containers')
+    bulk.add_selector_arguments(parser_schedule_clear, workers=False)
+    parser_schedule_clear.set_defaults(func=handle_schedule_clear)
+
+    parser_schedule_list = schedule_subparsers.add_parser('list', help='List scheduled snapshots and when they are next due')
+    parser_schedule_list.set_defaults(func=handle_schedule_list)
+
+    parser_schedule_run = schedule_subparsers.add_parser('run', help='Run in the foreground and take scheduled snapshots as they come due')
+    parser_schedule_run.add_argument('--once', action='store_true', help='Snapshot what is due now, wait for it and exit')
+    parser_schedule_run.add_argument('--max-commits', type=int, help='Maximum number of snapshot commits to run at once')
+    parser_schedule_run.set_defaults(func=handle_schedule_run)
+
+def handle_schedule_set(args):
+    labels = bulk.selection_from_args(args)
+    if labels is None:
+        return
+    try:
+        interval = int(listing.parse_duration(args.every).total_seconds())
+    except ValueError as e:
+        print(e)
+        return
+    if interval <= 0:
+        print("The interval must be longer than zero; use `scon schedule clear` to stop scheduled snapshots.")
+        return
+    scheduler.set_interval(args.names, interval, args.select_all, labels)
+
+def handle_schedule_clear(args):
+    labels = bulk.selection_from_args(args)
+    if labels is None:
+        return
+    scheduler.set_interval(args.names, None, args.select_all, labels)
+
+def handle_schedule_list(args):
+    scheduler.list_schedules()
+
+def handle_schedule_run(args):
+    scheduler.run_schedule(args.once, args.max_commits)
@@ -0,0 +1,12 @@
+# scon/commands/serve.py
+
+from scon.utils import server
+
+def add_serve_command(subparsers):
+    parser = subparsers.add_parser('serve', help='Run the scon daemon that other scon invocations hand their commands to')
+    parser.add_argument('--socket', help='Unix socket to listen on (clients find it through $SCON_SOCKET; default: $XDG_RUNTIME_DIR/scon, else the data directory)')
+    parser.add_argument('--schedule', action='store_true', help='Also take the scheduled snapshots of running containers (see `scon schedule`)')
+    parser.set_defaults(func=handle_serve)
+
+def handle_serve(args):
+    server.serve(args.socket, args.schedule)
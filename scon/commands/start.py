@@ -1,11 +1,17 @@
 # scon/commands/start.py
 
-from scon.utils import container_manager
+from scon.utils import container_manager, bulk
 
 def add_start_command(subparsers):
-    parser = subparsers.add_parser('start', help='Start a stateful container')
-    parser.add_argument('name', help='Name of the stateful container')
+    parser = subparsers.add_parser('start', help='Start one or more stateful containers')
+    bulk.add_selector_arguments(parser)
+    parser.add_argument('--endpoint', metavar='NAME',
+                        help="Start on this runtime endpoint, or 'auto' for the least loaded one; an SC that "
+                             "lives elsewhere has its latest snapshot copied over and moves there")
     parser.set_defaults(func=handle_start)
 
 def handle_start(args):
-    container_manager.handle_start(args.name)
+    labels = bulk.selection_from_args(args)
+    if labels is None:
+        return
+    container_manager.handle_start_many(args.names, args.select_all, labels, args.workers, args.endpoint)
@@ -0,0 +1,46 @@
+# scon/commands/stats.py
+
+import json
+from scon.utils import tracing
+
+def add_stats_command(subparsers):
+    parser = subparsers.add_parser('stats', help='Show p50/p95/p99 timings of runtime calls, state operations and commands')
+    parser.add_argument('--by-sc', action='store_true', help='Break timings down per stateful container')
+    parser.add_argument('--sc', dest='sc_name', help='Only show timings recorded for this stateful container')
+    parser.add_argument('--format', dest='output_format', choices=['table', 'jsonl'], default='table',
+                        help='Output format (default: table)')
+    parser.add_argument('--reset', action='store_true', help='Discard the recorded timings')
+    parser.set_defaults(func=handle_stats)
+
+def stats_rows(stats, by_sc=False, sc_name=None):
+    if sc_name:
+        per_sc = stats['scs'].get(sc_name, {'ops': {}})
+        return [{'sc': sc_name, 'op': op, **tracing.summarize(entry)} for op, entry in sorted(per_sc['ops'].items())]
+    if by_sc:
+        return [{'sc': name, 'op': op, **tracing.summarize(entry)}
+                for name, per_sc in sorted(stats['scs'].items()) for op, entry in sorted(per_sc['ops'].items())]
+    return [{'op': op, **tracing.summarize(entry)} for op, entry in sorted(stats['ops'].items())]
+
+def format_ms(value):
+    return '-' if value is None else f"{value:.1f}"
+
+def handle_stats(args):
+    if args.reset:
+        tracing.reset_stats()
+        print("Discarded recorded timings.")
+        return
+    rows = stats_rows(tracing.load_stats(), args.by_sc, args.sc_name)
+    if args.output_format == 'jsonl':
+        for row in rows:
+            print(json.dumps(row))
+        return
+    if not rows:
+        print("No timings recorded yet." if not args.sc_name else f"No timings recorded for '{args.sc_name}'.")
+        return
+    with_sc = bool(args.by_sc or args.sc_name)
+    header = f"{'SC':<24} " if with_sc else ''
+    print(header + f"{'OPERATION':<36} {'COUNT':>7} {'ERRORS':>6} {'P50 MS':>9} {'P95 MS':>9} {'P99 MS':>9}")
+    for row in rows:
+        sc_column = f"{row['sc']:<24} " if with_sc else ''
+        print(sc_column + f"{row['op']:<36} {row['count']:>7} {row['errors']:>6} "
+              f"{format_ms(row['p50']):>9} {format_ms(row['p95']):>9} {format_ms(row['p99']):>9}")
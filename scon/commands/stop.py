@@ -1,11 +1,19 @@
-from scon.utils import container_manager
+from scon.utils import container_manager, bulk
 
 def add_stop_command(subparsers):
-    parser = subparsers.add_parser('stop', help='Stop a stateful container and save its state')
-    parser.add_argument('name', help='Name of the stateful container')
+    parser = subparsers.add_parser('stop', help='Stop one or more stateful containers and save their state')
+    bulk.add_selector_arguments(parser)
     parser.add_argument('--force', action='store_true', help='Force action without confirmation')
+    parser.add_argument('--async', dest='defer_commit', action='store_const', const=True, default=None,
+                        help='Return after stop and rename; commit the snapshot in the background job queue')
+    parser.add_argument('--sync', dest='defer_commit', action='store_const', const=False,
+                        help='Commit the snapshot before returning (overrides async_commit)')
     parser.set_defaults(func=handle_stop)
 
 def handle_stop(args):
-    # Call container_manager.handle_stop with force option
-    container_manager.handle_stop(args.name, args.force)
+    labels = bulk.selection_from_args(args)
+    if labels is None:
+        return
+    # Call container_manager.handle_stop_many with force option
+    container_manager.handle_stop_many(args.names, args.force, args.select_all, labels, args.workers,
+                                       args.defer_commit)
@@ -0,0 +1,13 @@
+# scon/commands/watch.py
+
+from scon.utils import watcher
+
+def add_watch_command(subparsers):
+    parser = subparsers.add_parser('watch', help='Run in the foreground and snapshot stateful containers as soon as they exit')
+    parser.add_argument('--max-commits', type=int, help='Maximum number of snapshot commits to run at once')
+    parser.add_argument('--debounce', type=float, help='Seconds to wait after the last exit event before committing')
+    parser.add_argument('--schedule', action='store_true', help='Also take the scheduled snapshots of running containers (see `scon schedule`)')
+    parser.set_defaults(func=handle_watch)
+
+def handle_watch(args):
+    watcher.run_watch(args.max_commits, args.debounce, args.schedule)
@@ -0,0 +1,169 @@
+# scon/utils/bulk.py
+
+import contextvars
+import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scon.utils import endpoints, json_storage, locks, tracing
+from scon.utils.state_store import StaleRecordError
+
+DEFAULT_MAX_WORKERS = 4
+
+def add_selector_arguments(parser, workers=True):
+    parser.add_argument('names', nargs='*', help='Names or glob patterns of stateful containers')
+    parser.add_argument('--all', dest='select_all', action='store_true', help='Select every stateful container')
+    parser.add_argument('--label', dest='labels', action='append', default=[], metavar='KEY=VALUE',
+                        help='Select stateful containers carrying this label (repeatable)')
+    if workers:
+        parser.add_argument('--workers', type=int, help='Number of containers to process in parallel')
+
+def selection_from_args(args):
+    # Returns the parsed --label selectors, or None after explaining why the selection is invalid
+    if not (args.names or args.select_all or args.labels):
+        print("Specify at least one stateful container name, --all or --label.")
+        return None
+    try:
+        return parse_labels(args.labels)
+    except ValueError as e:
+        print(e)
+        return None
+
+def parse_labels(values):
+    labels = {}
+    for value in values or []:
+        key, sep, label_value = value.partition('=')
+        if not sep or not key:
+            raise ValueError(f"Invalid label '{value}'. Use KEY=VALUE.")
+        labels[key] = label_value
+    return labels
+
+def is_glob(name):
+    return any(ch in name for ch in '*?[')
+
+def matches(container, patterns, labels):
+    if labels and any(container.get('labels', {}).get(k) != v for k, v in labels.items()):
+        return False
+    if patterns and not any(fnmatch.fnmatchcase(container['name'], p) for p in patterns):
+        return False
+    return True
+
+def select_containers(names=(), select_all=False, labels=None):
+    # Returns (records, names that matched nothing)
+    if not select_all and not labels and not any(is_glob(n) for n in names):
+        found, missing = [], []
+        for name in dict.fromkeys(names):
+            container = json_storage.get_stateful_container(name)
+            if container is None:
+                missing.append(name)
+            else:
+                found.append(container)
+        return found, missing
+
+    containers = json_storage.load_stateful_containers()
+    patterns = [] if select_all else list(names)
+    selected = [c for c in containers if matches(c, patterns, labels)]
+    missing = [n for n in names if not select_all and not any(fnmatch.fnmatchcase(c['name'], n) for c in containers)]
+    return selected, missing
+
+class BatchCommitter:
+    # Saves records for the workers of run_parallel(). A worker's record waits for the
+    # batch being written to land and then goes out with everything that queued up
+    # meanwhile, so each SC stays locked until its own record is stored while the
+    # store still sees a few batched writes rather than one per SC.
+
+    def __init__(self, save_batch):
+        self._save_batch = save_batch
+        self._cond = threading.Condition(threading.Lock())
+        self._queued = []
+        self._writing = False
+
+    def _write(self, batch):
+        records = [entry['record'] for entry in batch]
+        errors = {}
+        while records:
+            try:
+                self._save_batch(records)
+                break
+            except StaleRecordError as e:
+                # Save the rest; these were changed by a writer that did not take the SC lock
+                errors.update((name, f"'{name}' was changed by another scon process meanwhile; "
+                                     "this change was not saved.") for name in e.names)
+                records = [record for record in records if record['name'] not in errors]
+        return errors
+
+    def save(self, record):
+        # Returns None once record is stored, or why it was not
+        entry = {'record': record, 'done': False, 'error': None}
+        with self._cond:
+            self._queued.append(entry)
+            while not entry['done']:
+                if self._writing:
+                    self._cond.wait()
+                    continue
+                batch, self._queued = self._queued, []
+                self._writing = True
+                self._cond.release()
+                try:
+                    errors = self._write(batch)
+                except Exception as e:
+                    errors = {item['record']['name']: f"Failed to save '{item['record']['name']}': {e}"
+                              for item in batch}
+                finally:
+                    self._cond.acquire()
+                    self._writing = False
+                for item in batch:
+                    item['error'] = errors.get(item['record']['name'])
+                    item['done'] = True
+                self._cond.notify_all()
+        return entry['error']
+
+
+def run_parallel(containers, work, max_workers=DEFAULT_MAX_WORKERS, operation='sc.work', commit=None):
+    # work(container) -> (ok, message); an exception counts as a failure of that SC only.
+    # Each SC's work runs under its lock, on the record as stored once the lock is held,
+    # and commit(container) -> error or None persists it before the lock is released.
+    # The work is timed as one `operation` span, attributed to that SC, and its
+    # runtime calls go to the endpoint the SC lives on.
+    def locked(container):
+        name = container['name']
+        # Another scon process may have saved this SC while we waited for its lock
+        current = json_storage.get_stateful_container(name)
+        if current is None:
+            return False, f"Stateful container '{name}' was deleted meanwhile."
+        container.clear()
+        container.update(current)
+        with endpoints.scope(endpoints.endpoint_of(container)), tracing.span(operation) as span:
+            try:
+                ok, message = work(container)
+            except Exception as e:
+                ok, message = False, f"Error processing '{name}': {e}"
+            span['exit_code'] = 0 if ok else 1
+        error = commit(container) if commit else None
+        return (False, error) if error else (ok, message)
+
+    def guarded(container):
+        with tracing.sc_scope(container['name']):
+            try:
+                with locks.sc_lock(container['name']):
+                    return locked(container)
+            except TimeoutError as e:
+                return False, str(e)
+
+    if max_workers <= 1 or len(containers) <= 1:
+        outcomes = [guarded(c) for c in containers]
+    else:
+        # Workers run in a copy of the caller's context so per-request state (e.g. where
+        # `scon serve` sends a client's output) follows the work onto the pool
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(containers))) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, guarded, c) for c in containers]
+            outcomes = [future.result() for future in futures]
+    return [(c, ok, message) for c, (ok, message) in zip(containers, outcomes)]
+
+def print_summary(verb, results):
+    for _, _, message in results:
+        print(message)
+    if len(results) > 1:
+        failed = [c['name'] for c, ok, _ in results if not ok]
+        print(f"{verb} {len(results) - len(failed)} of {len(results)} stateful containers.")
+        if failed:
+            print(f"Failed: {', '.join(failed)}")
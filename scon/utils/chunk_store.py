@@ -0,0 +1,212 @@
+# scon/utils/chunk_store.py
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+from collections import deque
+from scon.utils import json_storage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# File suffixes of the codecs chunks can be stored with, preferred first
+CODECS = ('zst', 'gz')
+TAR_FIELDS = ('name', 'mode', 'uid', 'gid', 'uname', 'gname', 'mtime', 'linkname')
+
+def preferred_codec():
+    # Chunks are compressed in-process; forking a zstd per 4 MiB chunk costs more than
+    # it saves over gzip, so zst is only written with the zstandard module
+    return 'zst' if zstandard else 'gz'
+
+def compress(data, codec):
+    if codec == 'zst':
+        if zstandard:
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return subprocess.run(['zstd', '-q', '-c', '-3'], input=data, stdout=subprocess.PIPE, check=True).stdout
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def decompress(blob, codec):
+    if codec == 'zst':
+        if zstandard:
+            # Frames written by the zstd CLI do not record their size, so read them as a stream
+            return zstandard.ZstdDecompressor().decompressobj().decompress(blob)
+        if not shutil.which('zstd'):
+            raise RuntimeError("Reading zstd-compressed chunks needs the zstandard module or the zstd command")
+        return subprocess.run(['zstd', '-q', '-d', '-c'], input=blob, stdout=subprocess.PIPE, check=True).stdout
+    return gzip.decompress(blob)
+
+def read_blocks(stream, size=CHUNK_SIZE):
+    while True:
+        block = stream.read(size)
+        if not block:
+            return
+        yield block
+
+def member_entry(info):
+    # Everything needed to write a tar member again, except its content
+    entry = {field: getattr(info, field) for field in TAR_FIELDS}
+    entry.update(type=info.type.decode(), size=info.size, chunks=[])
+    return entry
+
+def member_info(entry):
+    info = tarfile.TarInfo(entry['name'])
+    for field in TAR_FIELDS:
+        setattr(info, field, entry[field])
+    info.type = entry['type'].encode()
+    info.size = entry['size'] if info.isfile() else 0
+    return info
+
+def write_file_atomically(path, data):
+    # Whatever is interrupted leaves only a .partial file behind, never a truncated chunk
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.partial"
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class ChunkStore:
+    # Chunks are named by the sha256 of their uncompressed content, so data shared
+    # by several images, snapshots or SCs is stored (and transferred) once:
+    #   <root>/chunks/<2 hex>/<sha256>.<codec>
+    #   <root>/manifests/<sc name>.json
+
+    def __init__(self, root, codec=None):
+        self.root = root
+        self.codec = codec or preferred_codec()
+
+    def _base_path(self, digest):
+        return os.path.join(self.root, 'chunks', digest[:2], digest)
+
+    def chunk_path(self, digest):
+        base = self._base_path(digest)
+        for codec in CODECS:
+            if os.path.exists(f"{base}.{codec}"):
+                return f"{base}.{codec}"
+        return None
+
+    def has(self, digest):
+        return self.chunk_path(digest) is not None
+
+    def put(self, digest, data):
+        # Returns the number of compressed bytes written; 0 if the chunk was already stored
+        path = self.chunk_path(digest)
+        if path is not None:
+            try:
+                # Touched, so a `scon gc` running meanwhile sees it as just written
+                os.utime(path)
+                return 0
+            except FileNotFoundError:
+                pass
+        blob = compress(data, self.codec)
+        write_file_atomically(f"{self._base_path(digest)}.{self.codec}", blob)
+        return len(blob)
+
+    def get(self, digest):
+        path = self.chunk_path(digest)
+        if path is None:
+            raise FileNotFoundError(f"Chunk {digest} is missing from {self.root}")
+        with open(path, 'rb') as file:
+            data = decompress(file.read(), path.rsplit('.', 1)[1])
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} in {self.root} is corrupt")
+        return data
+
+    def copy_to(self, other, digest):
+        # Copies a chunk as stored, without recompressing. Returns the bytes copied,
+        # 0 if the other store already had it, which is what makes a rerun resume.
+        if other.has(digest):
+            return 0
+        path = self.chunk_path(digest)
+        if path is None:
+            raise FileNotFoundError(f"Chunk {digest} is missing from {self.root}")
+        with open(path, 'rb') as file:
+            blob = file.read()
+        write_file_atomically(os.path.join(other.root, os.path.relpath(path, self.root)), blob)
+        return len(blob)
+
+    def chunk_files(self):
+        # (digest, path) of every stored chunk, and (None, path) of leftover .partial files
+        chunks_dir = os.path.join(self.root, 'chunks')
+        if not os.path.isdir(chunks_dir):
+            return
+        for prefix in sorted(os.listdir(chunks_dir)):
+            directory = os.path.join(chunks_dir, prefix)
+            for filename in sorted(os.listdir(directory)):
+                digest, _, suffix = filename.partition('.')
+                yield (digest if suffix in CODECS else None), os.path.join(directory, filename)
+
+    def manifest_names(self):
+        directory = os.path.join(self.root, 'manifests')
+        if not os.path.isdir(directory):
+            return []
+        return sorted(filename[:-len('.json')] for filename in os.listdir(directory) if filename.endswith('.json'))
+
+    def manifest_path(self, name):
+        return os.path.join(self.root, 'manifests', f"{name}.json")
+
+    def save_manifest(self, name, manifest):
+        write_file_atomically(self.manifest_path(name), json.dumps(manifest, indent=2).encode())
+
+    def load_manifest(self, name):
+        path = self.manifest_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            return json.load(file)
+
+
+class ChunkReader:
+    # Read-only file over a member's chunks. With a pool, the next few chunks are
+    # fetched and decompressed ahead of the reader.
+
+    def __init__(self, store, digests, pool=None, lookahead=1):
+        self._store = store
+        self._digests = iter(digests)
+        self._pool = pool
+        self._lookahead = lookahead
+        self._pending = deque()
+        self._buffer = b''
+        self._offset = 0
+
+    def _next_chunk(self):
+        if self._pool is None:
+            digest = next(self._digests, None)
+            if digest is None:
+                return False
+            self._buffer, self._offset = self._store.get(digest), 0
+            return True
+        while len(self._pending) < self._lookahead:
+            digest = next(self._digests, None)
+            if digest is None:
+                break
+            self._pending.append(self._pool.submit(self._store.get, digest))
+        if not self._pending:
+            return False
+        self._buffer, self._offset = self._pending.popleft().result(), 0
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._buffer) and not self._next_chunk():
+                break
+            end = len(self._buffer) if size < 0 else min(len(self._buffer), self._offset + size)
+            parts.append(self._buffer[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+        return b''.join(parts)
+
+
+def local_store():
+    return ChunkStore(json_storage.data_path("chunk_store"))
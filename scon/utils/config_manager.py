@@ -2,46 +2,178 @@
 
 import json
 import os
+import re
+import sys
+from types import SimpleNamespace
 
-CONFIG_PATH = "scon_config.json"
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_MAX_SNAPSHOTS = 5
+DEFAULT_STATE_BACKEND = "sqlite"
+ENDPOINT_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+ENDPOINT_SCHEMES = ('unix://', 'tcp://', 'ssh://')
+# Reserved: the runtime of the top-level settings, and `--endpoint auto` placement
+RESERVED_ENDPOINT_NAMES = ('local', 'auto')
+SIZE = re.compile(r'^(\d+)([KMGT]?)B?$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+DEFAULT_CONFIG = {
+    "use_sudo": False,
+    "container_runtime": "docker",
+    "max_snapshots": DEFAULT_MAX_SNAPSHOTS,
+    "retention_days": DEFAULT_RETENTION_DAYS,
+    "state_backend": DEFAULT_STATE_BACKEND
+}
+
+_dirs = None
+_config = None
+_config_stamp = None
+
+def xdg_dir(variable, default):
+    # Same rule as platformdirs on Linux: the variable if it is not blank, else the default
+    base = os.environ.get(variable, '')
+    return os.path.join(base if base.strip() else os.path.expanduser(default), "scon")
+
+def app_dirs():
+    # platformdirs is only imported once a path is actually needed, and not at all on
+    # Linux, where importing it takes longer than the rest of `scon config show`
+    global _dirs
+    if _dirs is None:
+        if sys.platform.startswith('linux'):
+            _dirs = SimpleNamespace(user_data_dir=xdg_dir('XDG_DATA_HOME', '~/.local/share'),
+                                    user_config_dir=xdg_dir('XDG_CONFIG_HOME', '~/.config'))
+        else:
+            from platformdirs import PlatformDirs
+            _dirs = PlatformDirs("scon", "YourCompanyName")
+    return _dirs
+
+def config_path():
+    return os.path.join(app_dirs().user_config_dir, "scon_config.json")
+
+def config_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
 def load_config():
-    return load_json_file(CONFIG_PATH, {
-        "use_sudo": False,
-        "container_runtime": "docker"
-    })
+    # Shared by every caller; treat it as read-only. Read again once the file changes,
+    # so a long-running daemon sees a `scon config set` made by another process.
+    global _config, _config_stamp
+    path = config_path()
+    stamp = config_stamp(path)
+    if _config is None or stamp != _config_stamp:
+        config = dict(DEFAULT_CONFIG)
+        if stamp is not None:
+            with open(path, 'r') as file:
+                config.update(json.load(file))
+        _config, _config_stamp = config, stamp
+    return _config
 
 def save_config(config):
-    save_json_file(CONFIG_PATH, config)
+    global _config, _config_stamp
+    path = config_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(config, file, indent=4)
+    _config, _config_stamp = config, config_stamp(path)
 
-def load_json_file(path, default_data):
-    if os.path.exists(path):
-        with open(path, 'r') as file:
-            return json.load(file)
-    else:
-        with open(path, 'w') as file:
-            json.dump(default_data, file, indent=4)
-        return default_data
+def parse_size(value):
+    # Bytes in '512M', '10G', '1048576' and the like, or None
+    match = SIZE.match(value.strip())
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()] if match else None
 
-def save_json_file(path, data):
-    with open(path, 'w') as file:
-        json.dump(data, file, indent=4)
+def flag(value):
+    return value.lower() == 'true'
+
+def positive(value):
+    return int(value) if value.isdigit() and int(value) > 0 else None
+
+def count(value):
+    return int(value) if value.isdigit() else None
+
+def text(value):
+    return value
+
+def choice(*options):
+    return lambda value: value if value in options else None
+
+# Keys `scon config set` takes: key -> (parse, default, what a valid value looks like).
+# parse returns the value to store, or None if the value is invalid. The defaults are
+# the ones each setting's module falls back to when the key is not in the file.
+SETTINGS = {
+    "use_sudo": (flag, False, None),
+    "container_runtime": (choice("docker", "podman"), "docker", "Use 'docker' or 'podman'."),
+    "runtime_api": (choice("auto", "api", "cli"), "auto", "Use 'auto', 'api' or 'cli'."),
+    "runtime_socket": (text, None, None),
+    "max_workers": (positive, 4, "Use a positive integer."),
+    "max_snapshots": (positive, DEFAULT_MAX_SNAPSHOTS, "Use a positive integer."),
+    "retention_days": (positive, DEFAULT_RETENTION_DAYS, "Use a positive number of days."),
+    "async_commit": (flag, False, None),
+    "commit_worker": (flag, True, None),
+    "warm_pool": (flag, False, None),
+    "inventory_cache": (flag, False, None),
+    "capture_volumes": (flag, False, None),
+    "incremental_snapshots": (flag, False, None),
+    "checkpoint_interval": (positive, 10, "Use a positive integer (1 makes every snapshot a full commit)."),
+    "flatten_threshold": (count, 40, "Use a layer count, or 0 to disable flattening."),
+    "watch_max_commits": (positive, 2, "Use a positive integer."),
+    "watch_debounce": (count, 5, "Use a number of seconds."),
+    "schedule_max_commits": (positive, 2, "Use a positive integer."),
+    "schedule_byte_budget": (parse_size, 0, "Use a size such as 512M or 10G, or 0 for no limit."),
+    "schedule_window": (positive, 3600, "Use a positive number of seconds."),
+    "endpoint_timeout": (positive, 10, "Use a positive number of seconds."),
+    "state_backend": (choice("sqlite", "journal", "json"), DEFAULT_STATE_BACKEND,
+                      "Use 'sqlite', 'journal' or 'json'."),
+}
+# What show_config prints for a setting that is left empty
+EMPTY_LABELS = {"runtime_socket": "(default)", "schedule_byte_budget": "(no limit)"}
+
+def setting_keys(quote=''):
+    # Every settable key as prose: "a, b or c"; 'endpoint' adds and removes endpoints
+    keys = [f"{quote}{key}{quote}" for key in [*SETTINGS, "endpoint"]]
+    return f"{', '.join(keys[:-1])} or {keys[-1]}"
+
+def set_endpoint(config, value):
+    # NAME=URL adds or changes an endpoint, NAME= removes it. Returns True if config changed.
+    name, sep, url = value.partition('=')
+    if url.startswith('/'):
+        url = f"unix://{url}"
+    if not sep or not ENDPOINT_NAME.match(name) or name in RESERVED_ENDPOINT_NAMES:
+        print("Invalid value for endpoint. Use NAME=URL to add or change an endpoint and NAME= to remove it "
+              "('local' and 'auto' are reserved names).")
+        return False
+    endpoints = dict(config.get('endpoints') or {})
+    if not url:
+        if endpoints.pop(name, None) is None:
+            print(f"No runtime endpoint named '{name}'.")
+            return False
+        print(f"Removed runtime endpoint '{name}'")
+    elif url.startswith(ENDPOINT_SCHEMES):
+        endpoints[name] = url
+        print(f"Set runtime endpoint '{name}' to {url}")
+    else:
+        print("Invalid endpoint URL. Use unix:///path/to/socket, tcp://HOST:PORT, ssh://USER@HOST or a socket path.")
+        return False
+    config['endpoints'] = endpoints
+    return True
 
 def set_config(key, value):
-    config = load_config()
+    config = dict(load_config())
 
-    if key == "use_sudo":
-        config['use_sudo'] = value.lower() == 'true'
-        print(f"Set use_sudo to {config['use_sudo']}")
-    elif key == "container_runtime":
-        if value in ["docker", "podman"]:
-            config['container_runtime'] = value
-            print(f"Set container_runtime to {config['container_runtime']}")
-        else:
-            print("Invalid value for container_runtime. Use 'docker' or 'podman'.")
+    if key == "endpoint":
+        if not set_endpoint(config, value):
+            return
+    elif key in SETTINGS:
+        parse, _, valid = SETTINGS[key]
+        parsed = parse(value)
+        if parsed is None:
+            print(f"Invalid value for {key}. {valid}")
             return
+        config[key] = parsed
+        print(f"Set {key} to {parsed}")
     else:
-        print("Invalid configuration key. Use 'use_sudo' or 'container_runtime'.")
+        print("Invalid configuration key. Use " + setting_keys(quote="'") + ".")
         return
 
     save_config(config)
@@ -49,5 +181,10 @@ def set_config(key, value):
 def show_config():
     config = load_config()
     print("Current configuration:")
-    print(f"  use_sudo: {config['use_sudo']}")
-    print(f"  container_runtime: {config['container_runtime']}")
+    for key, (_, default, _) in SETTINGS.items():
+        value = config.get(key, default)
+        print(f"  {key}: {EMPTY_LABELS[key] if key in EMPTY_LABELS and not value else value}")
+    endpoints = config.get('endpoints') or {}
+    print(f"  endpoints:{'' if endpoints else ' (local only)'}")
+    for name, url in sorted(endpoints.items()):
+        print(f"    {name}: {url}")
@@ -1,82 +1,194 @@
+import atexit
+import os
+import shutil
 import subprocess
-from scon.utils import json_storage
-from datetime import datetime, timedelta
-from scon.utils.json_storage import load_config, load_stateful_containers, save_stateful_containers
+import sys
+import tarfile
+import threading
+import time
+from scon.utils import json_storage, runtime_client, bulk, warm_pool, garbage_collector, reconcile, inventory, listing, transfer, volumes, incremental, tracing, endpoints, locks, usage
+from datetime import datetime
+from scon.utils.config_manager import load_config
+from scon.utils.json_storage import (get_stateful_container, save_stateful_container,
+                                     delete_stateful_container, create_container_entry, create_snapshot_entry,
+                                     snapshot_image)
 
 DEFAULT_MAX_SNAPSHOTS = 5
 DEFAULT_RETENTION_DAYS = 30
-
-def handle_snapshot(name):
+COMMIT_WAIT_TIMEOUT = 3600
+DEFAULT_FLATTEN_THRESHOLD = 40
+COPY_CHUNK_SIZE = 1024 * 1024
+# How often a job worker comes back for the jobs of SCs another process holds
+JOB_RETRY_INTERVAL = 0.5
+
+_runtimes = {}
+_runtimes_lock = threading.Lock()
+_save_registered = False
+
+def inventory_path(endpoint):
+    return json_storage.data_path("runtime_inventory.json" if endpoint == endpoints.LOCAL
+                                  else f"runtime_inventory.{endpoint}.json")
+
+def get_runtime(endpoint=None):
+    # One client per endpoint and process so API connections are reused across calls,
+    # wrapped so container/image lookups are answered from a shared runtime inventory.
+    # Without an endpoint, the one of the surrounding endpoints.scope() (or local).
+    global _save_registered
+    endpoint = endpoint or endpoints.current()
+    runtime = _runtimes.get(endpoint)
+    if runtime is not None:
+        return runtime
+
+    # Built outside the lock: loading a cached inventory talks to the endpoint, and one
+    # that hangs must not hold up the others
     config = load_config()
-    containers = load_stateful_containers()
+    client = endpoints.create_runtime(config, endpoint)
+    runtime_inventory = inventory.RuntimeInventory(client)
+    if config.get('inventory_cache', False):
+        runtime_inventory.load(inventory_path(endpoint))
+    with _runtimes_lock:
+        runtime = _runtimes.setdefault(endpoint, inventory.TrackedRuntime(client, runtime_inventory))
+        if config.get('inventory_cache', False) and not _save_registered:
+            atexit.register(save_inventory)
+            _save_registered = True
+    if runtime.inventory is not runtime_inventory:
+        # Another thread got there first
+        client.close()
+    return runtime
+
+def reset_runtime():
+    # Drops the clients so the next call picks up changed runtime settings
+    with _runtimes_lock:
+        runtimes = list(_runtimes.values())
+        _runtimes.clear()
+    for runtime in runtimes:
+        runtime.close()
+
+def get_inventory():
+    return get_runtime().inventory
+
+def save_inventory():
+    with _runtimes_lock:
+        runtimes = dict(_runtimes)
+    for endpoint, runtime in runtimes.items():
+        try:
+            runtime.inventory.save(inventory_path(endpoint))
+        except OSError as e:
+            print(f"Could not save the runtime inventory cache of endpoint '{endpoint}': {e}")
+
+def capture_snapshot_volumes(container_data, container_ref, config=None):
+    # Volume state for a new snapshot when capture_volumes is on, matched against what
+    # the next start would restore so unchanged files are not stored again
+    config = config or load_config()
+    if not config.get('capture_volumes', False):
+        return None
+    previous = (container_data.get('next_snapshot_to_start') or {}).get('volumes')
+    try:
+        return volumes.capture_volumes(get_runtime(), container_ref, previous,
+                                       config.get('max_workers', bulk.DEFAULT_MAX_WORKERS))
+    except (OSError, ValueError, tarfile.TarError, runtime_client.ApiError) as e:
+        print(f"Warning: could not capture the volumes of '{container_data['name']}': {e}")
+        return None
+
+def snapshot_stateful_container(container_data, tagged=False, config=None, **fields):
+    # Runtime half of `scon snapshot`; mutates the record, the caller persists it.
+    # fields go into the new snapshot entry.
+    config = config or load_config()
+    runtime = get_runtime()
+    name = container_data['name']
+    snapshot_name = f"{name}_snapshot_{int(time.time())}"
 
-    container = next((c for c in containers if c['name'] == name), None)
-    if container is None:
+    if not runtime.commit(name, snapshot_name):
+        return False, f"Failed to create snapshot for container '{name}'"
+
+    snapshot_entry = create_snapshot_entry(snapshot_name, snapshot_name)
+    snapshot_entry['container_id'] = runtime.container_id(name, running_only=True)
+    snapshot_entry['tagged'] = tagged
+    snapshot_entry.update(fields)
+    volume_state = capture_snapshot_volumes(container_data, name, config)
+    if volume_state:
+        snapshot_entry['volumes'] = volume_state
+    container_data.setdefault('snapshots', []).append(snapshot_entry)
+
+    # Clean up old untagged snapshots
+    prune_snapshots(container_data, config.get('max_snapshots', DEFAULT_MAX_SNAPSHOTS),
+                    config.get('retention_days', DEFAULT_RETENTION_DAYS))
+    return True, f"Snapshot created successfully as '{snapshot_name}'{' (Tagged)' if tagged else ''}"
+
+def handle_snapshot(name, tagged=False):
+    if get_stateful_container(name) is None:
         print(f"Stateful container '{name}' not found.")
         return
 
-    snapshot_name = f"{name}_snapshot_{int(time.time())}"
-    commit_command = f"{'sudo ' if config['use_sudo'] else ''}{config['container_runtime']} commit {name} {snapshot_name}"
-    
-    print(f"Creating snapshot for container '{name}' as '{snapshot_name}'...")
-    result = subprocess.run(commit_command, shell=True)
-    
-    if result.returncode == 0:
-        tag_choice = input("Do you want to tag this snapshot as important? (y/n): ").strip().lower()
-        tagged = tag_choice == 'y'
-
-        container['history'].append({
-            "container_id": subprocess.getoutput(f"{config['container_runtime']} ps -q -f name={name}").strip(),
-            "timestamp": datetime.utcnow().isoformat(),
-            "image": snapshot_name,
-            "tagged": tagged
-        })
-
-        save_stateful_containers(containers)
-        print(f"Snapshot created successfully as '{snapshot_name}'{' (Tagged)' if tagged else ''}")
-
-        # Clean up old untagged snapshots
-        cleanup_old_snapshots(name, config.get('max_snapshots', DEFAULT_MAX_SNAPSHOTS))
-    else:
-        print(f"Failed to create snapshot for container '{name}'")
+    print(f"Creating snapshot for container '{name}'...")
+    try:
+        with locks.sc_lock(name):
+            # Read again under the lock, with whatever another process saved meanwhile
+            container = get_stateful_container(name)
+            if container is None:
+                print(f"Stateful container '{name}' was deleted meanwhile.")
+                return
+            with endpoints.scope(endpoints.endpoint_of(container)):
+                ok, message = snapshot_stateful_container(container, tagged)
+            if ok:
+                save_stateful_container(container)
+    except TimeoutError as e:
+        message = str(e)
+    print(message)
+
+def usage_retention(container):
+    # A retention choose that surveys layer usage the first time there is a choice to make;
+    # container may hold a snapshot not saved yet, so it stands in for its stored record
+    picker = []
+
+    def choose(container_data, untagged, count):
+        if not picker:
+            records = [record for record in json_storage.load_stateful_containers() if record['name'] != container['name']]
+            picker.append(usage.retention_picker(usage.collect(get_runtime, load_config(), records + [container])))
+        return picker[0](container_data, untagged, count)
+    return choose
+
+def prune_snapshots(container, max_snapshots=DEFAULT_MAX_SNAPSHOTS, retention_days=DEFAULT_RETENTION_DAYS, choose=None):
+    # Removes expired and excess untagged snapshots from the record, and their images from
+    # the runtime unless a kept snapshot still needs them (a delta on a checkpoint). Of the
+    # excess, the ones that free the most bytes go first.
+    choose = choose or usage_retention(container)
+    kept = garbage_collector.kept_snapshots(container, max_snapshots, retention_days, choose=choose)
+    expired = [entry for entry in container.get('snapshots', []) if entry['image_id'] not in kept]
+    if not expired:
+        return 0
+    reachable = garbage_collector.reachable_images(container, max_snapshots, retention_days, choose=choose)
+
+    # Snapshots left behind by a move to another endpoint are removed where they live
+    by_endpoint = {}
+    for entry in expired:
+        if snapshot_image(entry) not in reachable:
+            by_endpoint.setdefault(endpoints.snapshot_endpoint(container, entry), set()).add(snapshot_image(entry))
+    removed = set()
+    for endpoint, images in by_endpoint.items():
+        removed |= {(endpoint, image) for image in get_runtime(endpoint).remove_images(sorted(images))}
+    # An entry whose image is still in the runtime stays for the next run to retry
+    dropped = {id(entry) for entry in expired if snapshot_image(entry) in reachable
+               or (endpoints.snapshot_endpoint(container, entry), snapshot_image(entry)) in removed}
+    container['snapshots'] = [entry for entry in container['snapshots'] if id(entry) not in dropped]
+    print(f"Deleted {len(dropped)} old untagged snapshots for container '{container['name']}' "
+          f"(keeping {max_snapshots} within {retention_days} days).")
+    return len(dropped)
 
 def cleanup_old_snapshots(container_name, max_snapshots=DEFAULT_MAX_SNAPSHOTS, retention_days=DEFAULT_RETENTION_DAYS):
-    containers = load_stateful_containers()
-    cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
-
-    container = next((c for c in containers if c['name'] == container_name), None)
+    container = get_stateful_container(container_name)
     if not container:
         return
 
-    untagged_snapshots = [entry for entry in container['history'] if not entry.get('tagged', False) and entry['image'] != container.get('original_image')]
-    old_snapshots = [entry for entry in untagged_snapshots if datetime.fromisoformat(entry['timestamp']) < cutoff_date]
-
-    if len(old_snapshots) > 0:
-        for entry in old_snapshots:
-            delete_command = f"docker rmi {entry['image']}"
-            subprocess.run(delete_command, shell=True)
-            container['history'].remove(entry)
-
-        save_stateful_containers(containers)
-        print(f"Deleted {len(old_snapshots)} old snapshots for container '{container_name}' that were older than {retention_days} days.")
+    before = {entry['image_id'] for entry in container.get('snapshots', [])}
+    if prune_snapshots(container, max_snapshots, retention_days):
+        # Drop only what was pruned, so entries added meanwhile by another writer survive
+        removed = before - {entry['image_id'] for entry in container['snapshots']}
+        json_storage.update_stateful_container(container_name, lambda c: c.update(
+            snapshots=[entry for entry in c.get('snapshots', []) if entry['image_id'] not in removed]))
 
-    if len(untagged_snapshots) > max_snapshots:
-        sorted_untagged = sorted(untagged_snapshots, key=lambda x: x['timestamp'])
-        to_delete = sorted_untagged[:-max_snapshots]
-
-        for entry in to_delete:
-            delete_command = f"docker rmi {entry['image']}"
-            subprocess.run(delete_command, shell=True)
-            container['history'].remove(entry)
-
-        save_stateful_containers(containers)
-        print(f"Deleted {len(to_delete)} old untagged snapshots for container '{container_name}'.")
-
-def docker_container_exists(name):
-    config = load_config()
-    check_command = f"{config['container_runtime']} ps -a -q -f name={name}"
-    container_id = subprocess.getoutput(check_command).strip()
-    return bool(container_id)
+def docker_container_exists(name, endpoint=None):
+    return bool(get_runtime(endpoint).container_id(name))
 
 def get_runtime_command():
     config = load_config()
@@ -89,143 +201,555 @@ def check_docker():
     except subprocess.CalledProcessError:
         return False
 
-def handle_create(name, image):
-    containers = load_stateful_containers()
+def handle_create(name, image, labels=None, endpoint=endpoints.LOCAL):
+    try:
+        with locks.sc_lock(name):
+            create_stateful_container(name, image, labels, endpoint)
+    except TimeoutError as e:
+        print(e)
+
+def create_stateful_container(name, image, labels, endpoint):
+    if get_stateful_container(name) is not None:
+        print(f"Stateful container '{name}' already exists.")
+        return
 
-    if docker_container_exists(name):
+    if docker_container_exists(name, endpoint):
         print(f"A Docker container with the name '{name}' already exists. Please choose a different name.")
         return
 
     container_entry = create_container_entry(name, image, None)
-    containers.append({
+    save_stateful_container({
         "name": name,
+        "endpoint": endpoint,
+        "labels": labels or {},
         "containers": [container_entry],
         "snapshots": [],
         "next_snapshot_to_start": None,
         "deleted": []
     })
 
-    save_stateful_containers(containers)
-    print(f"Stateful container '{name}' created with base image '{image}'.")
+    on_endpoint = f" on endpoint '{endpoint}'" if endpoint != endpoints.LOCAL else ''
+    print(f"Stateful container '{name}' created with base image '{image}'{on_endpoint}.")
 
-def handle_start(name):
-    config = load_config()
-    containers = load_stateful_containers()
+def endpoint_loads(config=None):
+    # {endpoint: running containers} for every endpoint that answers in time
+    config = config or load_config()
 
-    container_data = next((c for c in containers if c['name'] == name), None)
-    if not container_data:
-        print(f"Stateful container '{name}' not found.")
-        return
+    def running():
+        listed = get_runtime().list_containers()
+        return None if listed is None else sum(1 for c in listed if c['state'] == 'running')
+    loads, failures = endpoints.fan_out(running, endpoints.endpoint_names(config), endpoints.endpoint_timeout(config))
+    endpoints.report_unreachable(failures)
+    return loads
+
+def placement(endpoint):
+    # record -> endpoint to start it on for `--endpoint NAME|auto`, or None after explaining why not
+    config = load_config()
+    if endpoint == endpoints.AUTO:
+        loads = endpoint_loads(config)
+        if not loads:
+            print("No runtime endpoint is reachable.")
+            return None
+        lock = threading.Lock()
+
+        def least_loaded(record):
+            with lock:
+                return endpoints.least_loaded(loads, endpoints.endpoint_of(record))
+        return least_loaded
+    if endpoint not in endpoints.endpoint_names(config):
+        print(f"Unknown runtime endpoint '{endpoint}'. Configured: {', '.join(endpoints.endpoint_names(config))}.")
+        return None
+    return lambda record: endpoint
+
+def resolve_endpoint(endpoint):
+    # The endpoint `--endpoint NAME|auto` stands for, or None after explaining why there is none
+    place = placement(endpoint)
+    return place({}) if place else None
+
+def move_stateful_container(container_data, next_snapshot, source, target):
+    # Copies the image the next start needs from the SC's endpoint to target. The older
+    # snapshots stay where they are, marked with their endpoint for retention and gc.
+    name = container_data['name']
+    if (container_data.get('containers') or [{}])[-1].get('status') == 'running':
+        return False, f"'{name}' is running on endpoint '{source}'; stop it before starting it on '{target}'."
+    source_runtime, target_runtime = get_runtime(source), get_runtime(target)
+    image = snapshot_image(next_snapshot)
+    if not target_runtime.inventory.has_image(image):
+        try:
+            with source_runtime.save_image(image) as stream, target_runtime.load_image() as writer:
+                shutil.copyfileobj(stream, writer, COPY_CHUNK_SIZE)
+        except (OSError, runtime_client.ApiError) as e:
+            return False, f"Failed to copy snapshot '{image}' of '{name}' from endpoint '{source}' to '{target}': {e}"
+
+    warm_pool.discard_warm_container(container_data, source_runtime)
+    for key in ('snapshots', 'history'):
+        for entry in container_data.get(key, []):
+            entry.setdefault('endpoint', source)
+    # The copy on target is a snapshot of its own, so retention can release it there later
+    copied = {key: value for key, value in next_snapshot.items() if key not in ('endpoint', 'source_container')}
+    copied['copied_from'] = source
+    container_data['snapshots'].append(copied)
+    container_data['next_snapshot_to_start'] = dict(copied)
+    container_data['endpoint'] = target
+    return True, None
+
+def start_stateful_container(container_data, endpoint=None):
+    # Runtime half of `scon start`; mutates the record, the caller persists it. Given
+    # an endpoint other than the SC's own, the SC moves there.
+    with endpoints.scope(endpoint or endpoints.endpoint_of(container_data)):
+        return start_on_current_endpoint(container_data)
+
+def start_on_current_endpoint(container_data):
+    name = container_data['name']
 
     # Check if a container with this name is already running
-    running_container_id = docker_container_exists(name)
-    if running_container_id:
-        print(f"Error: A Docker container with the name '{name}' already exists.")
-        print("Please delete the existing container or choose a different name.")
-        return
+    if docker_container_exists(name):
+        return False, (f"Error: A Docker container with the name '{name}' already exists. "
+                       "Please delete the existing container or choose a different name.")
+
+    # A deferred commit from `scon stop --async` must land before we pick the snapshot
+    if container_data.get('pending_commit'):
+        if not wait_for_pending_commit(name):
+            return False, f"Snapshot commit for '{name}' is still pending; try again later."
+        container_data.clear()
+        container_data.update(get_stateful_container(name))
+        pending = container_data.get('pending_commit')
+        if pending:
+            return False, (f"Snapshot commit for '{name}' failed: {pending.get('error', 'unknown error')}. "
+                           "Retry it with `scon jobs retry` before starting.")
 
     # Get the next snapshot to start from
     next_snapshot = container_data['next_snapshot_to_start']
     if not next_snapshot:
-        print(f"No snapshot found to start container '{name}'.")
-        return
-
-    # Start the new container from the snapshot
-    start_command = f"{config['container_runtime']} run -d --name {name} {next_snapshot['image_id']} sleep infinity"
-    subprocess.run(start_command, shell=True)
+        return False, f"No snapshot found to start container '{name}'."
+    source = endpoints.endpoint_of(container_data)
+    if source != endpoints.current():
+        moved, message = move_stateful_container(container_data, next_snapshot, source, endpoints.current())
+        if not moved:
+            return False, message
+        next_snapshot = container_data['next_snapshot_to_start']
+
+    # Start the new container from the snapshot, preferring a pre-created warm container
+    started_at = time.monotonic()
+    runtime = get_runtime()
+    volume_state = next_snapshot.get('volumes')
+    delta = next_snapshot.get('delta')
+    # Captured volumes go back into the same mounts, not the container's own filesystem
+    mounts = volumes.snapshot_mounts(next_snapshot)
+    unsupported = volumes.unsupported_mount(mounts)
+    if unsupported:
+        return False, (f"Cannot restore the volumes of '{name}': its {unsupported['type']} mount at "
+                       f"'{unsupported['destination']}' cannot be recreated.")
+    workers = load_config().get('max_workers', bulk.DEFAULT_MAX_WORKERS)
+    restore_errors = []
+
+    def restore(container_id):
+        # Captured volume contents and a delta's changed paths go in before the container runs
+        try:
+            if volume_state:
+                volumes.restore_volumes(runtime, container_id, volume_state, workers)
+            if delta:
+                incremental.restore_delta(runtime, container_id, delta, workers)
+            return True
+        except (OSError, ValueError, tarfile.TarError, runtime_client.ApiError) as e:
+            restore_errors.append(str(e))
+            return False
+
+    needs_restore = bool(volume_state or delta)
+    image = snapshot_image(next_snapshot)
+    container_id = warm_pool.claim_warm_container(container_data, image, runtime,
+                                                  restore if needs_restore else None, mounts)
+    warm = container_id is not None
+    if not warm and needs_restore:
+        container_id = runtime.create_container(name, image, ['sleep', 'infinity'], mounts)
+        if container_id and not (restore(container_id) and runtime.start_container(container_id)):
+            runtime.remove_container(container_id)
+            if restore_errors:
+                return False, f"Failed to restore the saved state of '{name}': {restore_errors[-1]}"
+            container_id = None
+    elif not warm:
+        container_id = runtime.run_container(name, image, ['sleep', 'infinity'])
+    if container_id is None:
+        return False, f"Failed to start container '{name}' from snapshot '{next_snapshot['image_id']}'"
+    if delta and not incremental.apply_deletions(runtime, container_id, delta):
+        runtime.remove_container(container_id)
+        return False, f"Failed to replay the deleted paths of '{name}' from snapshot '{next_snapshot['name']}'"
+    elapsed = time.monotonic() - started_at
 
     # Log the new container entry
-    container_entry = create_container_entry(name, next_snapshot['image_id'], None)
+    container_entry = create_container_entry(name, image, container_id)
     container_data['containers'].append(container_entry)
     container_entry['status'] = "running"
+    container_data['endpoint'] = endpoints.current()
+    on_endpoint = f" on endpoint '{endpoints.current()}'" if endpoints.current() != endpoints.LOCAL else ''
+    return True, (f"Started container '{name}' from snapshot '{next_snapshot['image_id']}'{on_endpoint} "
+                  f"({'warm' if warm else 'cold'} start, {elapsed:.2f}s)")
+
+def commit_snapshot(container_data, container_ref, snapshot_name, config=None):
+    # Saves container_ref's state for a new snapshot. With incremental_snapshots that is a
+    # delta of the changed paths on top of the checkpoint next start uses, except at every
+    # checkpoint_interval-th snapshot, which is a full commit. Returns the fields of the
+    # snapshot entry, or None if the commit failed.
+    config = config or load_config()
+    runtime = get_runtime()
+    if config.get('incremental_snapshots', False):
+        try:
+            delta = incremental.capture_delta(
+                runtime, container_data, container_ref,
+                config.get('checkpoint_interval', incremental.DEFAULT_CHECKPOINT_INTERVAL),
+                config.get('max_workers', bulk.DEFAULT_MAX_WORKERS))
+        except (OSError, ValueError, tarfile.TarError, runtime_client.ApiError) as e:
+            print(f"Warning: incremental snapshot of '{container_data['name']}' failed; committing in full: {e}")
+            delta = None
+        if delta:
+            return {'base_image_id': delta['checkpoint'],
+                    'layer_depth': container_data['next_snapshot_to_start'].get('layer_depth'),
+                    'delta': delta}
+
+    started_at = time.monotonic()
+    if not runtime.commit(container_ref, snapshot_name):
+        return None
+    return {'image_id': snapshot_name, 'layer_depth': runtime.layer_count(snapshot_name),
+            'commit_seconds': round(time.monotonic() - started_at, 3)}
+
+def record_committed_snapshot(container_data, snapshot_name, layer_depth=None, source_container=None,
+                              volume_state=None, image_id=None, **fields):
+    # A delta snapshot has no image of its own; it is named by snapshot_name all the same,
+    # and fields carry the checkpoint it applies to as base_image_id
+    snapshot_entry = create_snapshot_entry(snapshot_name, image_id or snapshot_name)
+    snapshot_entry['layer_depth'] = layer_depth
+    snapshot_entry['source_container'] = source_container
+    snapshot_entry.update(fields)
+    if volume_state:
+        snapshot_entry['volumes'] = volume_state
+    container_data.setdefault('snapshots', []).append(snapshot_entry)
+    container_data['next_snapshot_to_start'] = snapshot_entry
+    container_data.pop('pending_commit', None)
+    return snapshot_entry
 
-    save_stateful_containers(containers)
-    print(f"Started container '{name}' from snapshot '{next_snapshot['image_id']}'")
-
-def handle_stop(name):
-    config = load_config()
-    containers = load_stateful_containers()
-
-    container_data = next((c for c in containers if c['name'] == name), None)
-    if not container_data:
-        print(f"Stateful container '{name}' not found.")
-        return
-
+def stop_stateful_container(container_data, defer_commit=False):
+    # Runtime half of `scon stop`: stop -> rename -> commit. Mutates the record,
+    # the caller persists it. With defer_commit the commit is left to the job queue.
+    name = container_data['name']
     container = container_data['containers'][-1]  # Get the latest container
 
     if container['status'] == "stopped":
-        print(f"Container '{name}' is already stopped.")
-        return
+        return False, f"Container '{name}' is already stopped."
+
+    runtime = get_runtime()
+    container_ref = container['container_id'] or name
 
     # Stop and rename the container
-    stop_command = f"{config['container_runtime']} stop {container['container_id']}"
-    subprocess.run(stop_command, shell=True)
+    if not runtime.stop(container_ref):
+        return False, f"Failed to stop container '{name}'"
     container['status'] = "stopped"
 
     new_name = f"{name}_stopped_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-    rename_command = f"{config['container_runtime']} rename {container['container_id']} {new_name}"
-    subprocess.run(rename_command, shell=True)
+    if not runtime.rename(container_ref, new_name):
+        return False, f"Failed to rename container '{name}' to '{new_name}'"
 
     # Create a snapshot
     snapshot_name = f"{name}_snapshot_{int(time.time())}"
-    commit_command = f"{config['container_runtime']} commit {new_name} {snapshot_name}"
-    subprocess.run(commit_command, shell=True)
+    if defer_commit:
+        container_data['pending_commit'] = {
+            "container": new_name,
+            "image": snapshot_name,
+            "queued_at": datetime.utcnow().isoformat()
+        }
+        return True, f"Stopped '{name}', renamed to '{new_name}'; snapshot commit queued as '{snapshot_name}'"
+
+    saved = commit_snapshot(container_data, new_name, snapshot_name)
+    if saved is None:
+        return False, f"Failed to commit snapshot for container '{name}'"
+
+    volume_state = capture_snapshot_volumes(container_data, new_name)
+    record_committed_snapshot(container_data, snapshot_name, source_container=new_name, volume_state=volume_state,
+                              **saved)
+    if load_config().get('warm_pool', False):
+        warm_pool.refresh_warm_container(container_data, runtime)
+    if saved.get('delta'):
+        return True, (f"Stopped '{name}', renamed to '{new_name}'; saved "
+                      f"{incremental.describe_delta(saved['delta'])}")
+    return True, f"Stopped and saved state of '{name}', renamed to '{new_name}'"
+
+def run_bulk(verb, names, work, select_all=False, labels=None, workers=None):
+    # Selects SCs and fans the runtime work out over a worker pool; each touched record
+    # is saved, batched with those of the other workers, before its SC is unlocked.
+    containers, missing = bulk.select_containers(names, select_all, labels)
+    for name in missing:
+        print(f"Stateful container '{name}' not found.")
+    if not containers:
+        if not missing:
+            print("No stateful containers matched.")
+        return []
 
-    snapshot_entry = create_snapshot_entry(snapshot_name, snapshot_name)
-    container_data['snapshots'].append(snapshot_entry)
-    container_data['next_snapshot_to_start'] = snapshot_entry
+    workers = workers or load_config().get('max_workers', bulk.DEFAULT_MAX_WORKERS)
+    committer = bulk.BatchCommitter(json_storage.save_stateful_container_batch)
+    results = bulk.run_parallel(containers, work, workers, f"sc.{verb.lower()}", committer.save)
+    bulk.print_summary(verb, results)
+    return results
 
-    save_stateful_containers(containers)
-    print(f"Stopped and saved state of '{name}', renamed to '{new_name}'")
+def handle_start(name):
+    run_bulk("Started", [name], start_stateful_container)
 
+def handle_stop(name, force=False):
+    handle_stop_many([name], force)
 
-def handle_list():
-    containers = json_storage.load_stateful_containers()
-    if not containers:
-        print("No stateful containers found.")
+def handle_start_many(names, select_all=False, labels=None, workers=None, endpoint=None):
+    place = placement(endpoint) if endpoint else None
+    if endpoint and place is None:
+        return []
+    return run_bulk("Started", names, lambda c: start_stateful_container(c, place(c) if place else None),
+                    select_all, labels, workers)
+
+def handle_stop_many(names, force=False, select_all=False, labels=None, workers=None, defer_commit=None):
+    config = load_config()
+    if defer_commit is None:
+        defer_commit = config.get('async_commit', False)
+    results = run_bulk("Stopped", names, lambda c: stop_stateful_container(c, defer_commit),
+                       select_all, labels, workers)
+
+    # Jobs are queued only after the records are saved so a worker never sees stale state;
+    # a commit a crash keeps from being queued here is queued by the next process_jobs()
+    queued = False
+    queue = json_storage.get_job_queue()
+    for container_data, ok, _ in results:
+        if not ok:
+            continue
+        if container_data.get('pending_commit'):
+            queue.enqueue(container_data['name'], 'commit', container_data['pending_commit'])
+            queued = True
+        elif queue_flatten_if_needed(container_data, config):
+            queued = True
+    if queued and config.get('commit_worker', True):
+        spawn_job_worker()
+    return results
+
+def spawn_job_worker():
+    # Detached `scon jobs run`; it exits once the queue is empty. SCON_NO_DAEMON keeps
+    # it in its own process instead of handing the work to `scon serve`.
+    subprocess.Popen([sys.executable, '-m', 'scon.cli', 'jobs', 'run'], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+                     env=dict(os.environ, SCON_NO_DAEMON='1'))
+
+def run_commit_job(job):
+    name = job['sc_name']
+    payload = job['payload']
+    current = get_stateful_container(name) or {'name': name}
+    # A commit queued again by requeue_unqueued_commits() while its first job was on the way
+    waiting = (current.get('pending_commit') or {}).get('image') == payload['image']
+    if not waiting and any(entry['image_id'] == payload['image'] for entry in current.get('snapshots', [])):
+        return True, f"Snapshot '{payload['image']}' of container '{name}' is already committed"
+    saved = commit_snapshot(current, payload['container'], payload['image'])
+    if saved is None:
+        return False, f"Failed to commit snapshot for container '{name}'"
+
+    volume_state = capture_snapshot_volumes(current, payload['container'])
+
+    def mutate(container_data):
+        # Only move next_snapshot_to_start if this is still the commit the record waits for
+        if (container_data.get('pending_commit') or {}).get('image') == payload['image']:
+            record_committed_snapshot(container_data, payload['image'], source_container=payload['container'],
+                                      volume_state=volume_state, **saved)
+    container_data = json_storage.update_stateful_container(name, mutate)
+    if container_data:
+        refresh_warm_pool(container_data)
+        queue_flatten_if_needed(container_data, load_config())
+    if saved.get('delta'):
+        return True, f"Saved {incremental.describe_delta(saved['delta'])} for container '{name}'"
+    return True, f"Committed snapshot for container '{name}' as '{payload['image']}'"
+
+def refresh_warm_pool(container_data):
+    # Pre-create outside the state transaction, then store only the warm entry
+    if not load_config().get('warm_pool', False):
         return
+    if warm_pool.refresh_warm_container(container_data, get_runtime()):
+        def store_warm(record):
+            record.pop('warm_container', None)
+            if 'warm_container' in container_data:
+                record['warm_container'] = container_data['warm_container']
+        json_storage.update_stateful_container(container_data['name'], store_warm)
+
+def needs_flatten(container_data, threshold):
+    next_snapshot = container_data.get('next_snapshot_to_start') or {}
+    return bool(threshold) and (next_snapshot.get('layer_depth') or 0) >= threshold
+
+def queue_flatten_if_needed(container_data, config):
+    if not needs_flatten(container_data, config.get('flatten_threshold', DEFAULT_FLATTEN_THRESHOLD)):
+        return False
+    queue = json_storage.get_job_queue()
+    if queue.active_jobs(container_data['name'], 'flatten'):
+        return False
+    next_snapshot = container_data['next_snapshot_to_start']
+    queue.enqueue(container_data['name'], 'flatten',
+                  {"image": snapshot_image(next_snapshot), "layer_depth": next_snapshot['layer_depth']})
+    return True
+
+def run_flatten_job(job):
+    # Squashes next_snapshot_to_start into a single layer and rebases the SC onto it
+    name = job['sc_name']
+    container_data = get_stateful_container(name)
+    if not container_data or not needs_flatten(container_data, 1):
+        return True, f"Nothing to flatten for container '{name}'"
+
+    # Flatten whatever is latest now; more commits may have landed since the job was queued
+    key = container_data['next_snapshot_to_start']['image_id']
+    image = snapshot_image(container_data['next_snapshot_to_start'])
+    original_depth = container_data['next_snapshot_to_start']['layer_depth']
+    flat_image = f"{image}_flat"
+    runtime = get_runtime()
+    if not runtime.flatten_image(image, flat_image):
+        return False, f"Failed to flatten snapshot '{image}' of container '{name}'"
+    layer_depth = runtime.layer_count(flat_image)
+
+    def rebase(container_data):
+        # A newer commit may have landed on the old chain while we were flattening
+        if (container_data.get('next_snapshot_to_start') or {}).get('image_id') != key:
+            return
+        snapshot_entry = create_snapshot_entry(flat_image, flat_image)
+        snapshot_entry['layer_depth'] = layer_depth
+        snapshot_entry['flattened_from'] = image
+        # Flattening only rewrites the image; captured volumes and a delta on top stay the same
+        for key in ('volumes', 'delta'):
+            if container_data['next_snapshot_to_start'].get(key):
+                snapshot_entry[key] = container_data['next_snapshot_to_start'][key]
+        container_data['snapshots'].append(snapshot_entry)
+        container_data['next_snapshot_to_start'] = snapshot_entry
+    container_data = json_storage.update_stateful_container(name, rebase)
+    if not container_data or container_data['next_snapshot_to_start']['image_id'] != flat_image:
+        runtime.remove_image(flat_image)
+        return True, f"Discarded flattened image for '{name}'; '{image}' is no longer its latest snapshot"
+
+    refresh_warm_pool(container_data)
+    # The old chain is no longer what start uses, so retention can release it
+    config = load_config()
+    cleanup_old_snapshots(name, config.get('max_snapshots', DEFAULT_MAX_SNAPSHOTS),
+                          config.get('retention_days', DEFAULT_RETENTION_DAYS))
+    return True, f"Flattened '{image}' ({original_depth} layers) into '{flat_image}' for container '{name}'"
+
+JOB_HANDLERS = {
+    'commit': run_commit_job,
+    'flatten': run_flatten_job,
+}
+
+def requeue_unqueued_commits(queue, sc_name=None):
+    # pending_commit entries that a crash kept from being queued are queued now
+    queued_commits = queue.queued_commits(sc_name)
+    records = [get_stateful_container(sc_name)] if sc_name else json_storage.scan_stateful_containers()
+    for record in records:
+        pending = record and reconcile.unqueued_commit(record, queued_commits)
+        if pending:
+            queue.enqueue(record['name'], 'commit', pending)
+
+def process_jobs(sc_name=None, kind=None):
+    queue = json_storage.get_job_queue()
+    queue.requeue_abandoned()
+    if kind in (None, 'commit'):
+        requeue_unqueued_commits(queue, sc_name)
+    processed = 0
+    # SCs whose lock another process holds; their jobs go back to the queue for now
+    busy = set()
+    while True:
+        job = queue.claim_next(sc_name, kind, exclude=busy)
+        if job is None:
+            if not busy or sc_name is not None:
+                return processed
+            time.sleep(JOB_RETRY_INTERVAL)
+            busy.clear()
+            continue
+        try:
+            with locks.sc_lock(job['sc_name'], timeout=0):
+                run_job(queue, job)
+        except TimeoutError:
+            # The holder may be a start waiting for this very commit, which then runs it itself
+            queue.release(job['id'])
+            busy.add(job['sc_name'])
+            continue
+        processed += 1
+
+def run_job(queue, job):
+    # Caller holds the SC's lock
+    record = get_stateful_container(job['sc_name']) or {}
+    with tracing.sc_scope(job['sc_name']), endpoints.scope(endpoints.endpoint_of(record)), \
+            tracing.span(f"job.{job['kind']}") as span:
+        try:
+            ok, message = JOB_HANDLERS[job['kind']](job)
+        except Exception as e:
+            ok, message = False, f"Job {job['id']} for '{job['sc_name']}' failed: {e}"
+        span['exit_code'] = 0 if ok else 1
+    if ok:
+        queue.complete(job['id'])
+    elif queue.fail(job['id'], message) == 'failed':
+        def mark_failed(container_data):
+            if container_data.get('pending_commit'):
+                container_data['pending_commit']['error'] = message
+        json_storage.update_stateful_container(job['sc_name'], mark_failed)
+    print(message)
+
+def wait_for_pending_commit(name, timeout=COMMIT_WAIT_TIMEOUT):
+    # Runs this SC's queued commits inline; if a worker already claimed one, waits for it
+    queue = json_storage.get_job_queue()
+    deadline = time.time() + timeout
+    while True:
+        process_jobs(name, 'commit')
+        if not queue.active_jobs(name, 'commit'):
+            return True
+        if time.time() > deadline:
+            return False
+        time.sleep(0.5)
+
+def handle_snapshot_many(names, tagged=False, select_all=False, labels=None, workers=None):
+    config = load_config()
+    return run_bulk("Snapshotted", names, lambda c: snapshot_stateful_container(c, tagged, config),
+                    select_all, labels, workers)
 
-    for container in containers:
-        print(f"Stateful Container: {container['name']}")
-        print(f"  Current Image: {container['image']}")
-        print(f"  History: {container['history']}")
 
-def stop_and_commit_container(name):
-    config = load_config()
-    containers = load_stateful_containers()
+def live_container_states(config=None):
+    # {endpoint: {container name: state}} from every endpoint that answers in time
+    config = config or load_config()
+
+    def states():
+        listed = get_runtime().list_containers()
+        return None if listed is None else {name: c['state'] for c in listed for name in c['names']}
+    live_states, failures = endpoints.fan_out(states, endpoints.endpoint_names(config),
+                                              endpoints.endpoint_timeout(config))
+    endpoints.report_unreachable(failures)
+    return live_states
 
-    container = next((c for c in containers if c['name'] == name), None)
+def handle_list(output_format='table', header=True, live=False, **options):
+    if live:
+        options['live_states'] = live_container_states()
+    listing.run_list(output_format, header, **options)
+
+def stop_and_commit_container(name):
+    container = get_stateful_container(name)
     if container is None:
         print(f"Stateful container '{name}' not found.")
         return False
 
-    check_command = f"{config['container_runtime']} ps -q -f name={name}"
-    container_id = subprocess.getoutput(check_command).strip()
+    runtime = get_runtime()
+    container_id = runtime.container_id(name, running_only=True)
 
     if not container_id:
         print(f"No such container: {name}")
         return False
 
     # Stop the Docker container
-    stop_command = f"{'sudo ' if config['use_sudo'] else ''}{config['container_runtime']} stop {name}"
-    if subprocess.run(stop_command, shell=True).returncode != 0:
+    if not runtime.stop(name):
         print(f"Failed to stop container '{name}'")
         return False
 
     # Rename the stopped container to free up the name
-    rename_command = f"{'sudo ' if config['use_sudo'] else ''}{config['container_runtime']} rename {name} {name}_stopped"
-    subprocess.run(rename_command, shell=True)
+    runtime.rename(name, f"{name}_stopped")
 
     # Commit the current state of the container before deleting
     new_image_tag = f"{name}_snapshot_{int(time.time())}"
-    commit_command = f"{'sudo ' if config['use_sudo'] else ''}{config['container_runtime']} commit {name}_stopped {new_image_tag}"
-    if subprocess.run(commit_command, shell=True).returncode == 0:
-        container['history'].append({
-            "container_id": container_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "image": new_image_tag
-        })
-        save_stateful_containers(containers)
+    if runtime.commit(f"{name}_stopped", new_image_tag):
+        snapshot_entry = record_committed_snapshot(container, new_image_tag, runtime.layer_count(new_image_tag),
+                                                   f"{name}_stopped",
+                                                   capture_snapshot_volumes(container, f"{name}_stopped"))
+        snapshot_entry['container_id'] = container_id
+        save_stateful_container(container)
         print(f"Committed snapshot for container '{name}' as '{new_image_tag}'")
         return True
     else:
@@ -233,45 +757,81 @@ def stop_and_commit_container(name):
         return False
 
 def handle_delete(name, option, force=False):
-    config = load_config()
-    containers = load_stateful_containers()
-
-    container_data = next((c for c in containers if c['name'] == name), None)
-    if not container_data:
+    try:
+        with tracing.sc_scope(name), locks.sc_lock(name), \
+                endpoints.scope(endpoints.endpoint_of(get_stateful_container(name) or {})):
+            delete_stateful_container_entry(name, option)
+    except TimeoutError as e:
+        print(e)
+
+def delete_stateful_container_entry(name, option):
+    if get_stateful_container(name) is None:
         print(f"Stateful container '{name}' not found.")
         return
 
+    wait_for_pending_commit(name)
+
     # First, stop and commit the container as per the stop logic
     stop_and_commit_container(name)
+    container_data = get_stateful_container(name)
+    warm_pool.discard_warm_container(container_data, get_runtime())
 
     # Then, delete the container or snapshot based on the selected option
     if option == "entry-only":
         print(f"Deleting stateful container entry '{name}' but retaining local Docker containers and images.")
         container_data['deleted'].append(container_data['containers'][-1])  # Archive the latest container entry
-        containers.remove(container_data)
+        delete_stateful_container(name)
 
     elif option == "all-snapshots":
         print(f"Deleting all snapshots and the SC entry '{name}'.")
         container_data['deleted'].extend(container_data['snapshots'])  # Archive all snapshots
-        containers.remove(container_data)
+        delete_stateful_container(name)
 
     elif option == "keep-latest-snapshot":
         print(f"Deleting all but the latest snapshot for stateful container '{name}'.")
         container_data['deleted'].extend(container_data['snapshots'][:-1])  # Archive old snapshots
         container_data['snapshots'] = [container_data['snapshots'][-1]]
+        save_stateful_container(container_data)
 
-    save_stateful_containers(containers)
     print(f"Deleted stateful container '{name}' with option '{option}'.")
 
-def delete_container_images(container):
+def handle_gc(dry_run=False, workers=None, include_stopped=True, free=None):
     config = load_config()
+    workers = workers or config.get('max_workers', bulk.DEFAULT_MAX_WORKERS)
+    garbage_collector.run_gc(get_runtime, config, dry_run, workers, include_stopped, free)
+
+def handle_du(patterns=None, by_snapshot=False, output_format='table', refresh=False):
+    usage.run_du(get_runtime, load_config(), patterns, by_snapshot, output_format, refresh)
+
+def handle_reconcile(repair=False):
+    reconcile.run_reconcile(get_runtime, load_config(), repair)
+
+def handle_export(name, destination=None, all_snapshots=False, workers=None):
+    container = get_stateful_container(name)
+    if container is None:
+        print(f"Stateful container '{name}' not found.")
+        return
+    if container.get('pending_commit') and not wait_for_pending_commit(name):
+        print(f"Snapshot commit for '{name}' is still pending; try again later.")
+        return
+    workers = workers or load_config().get('max_workers', bulk.DEFAULT_MAX_WORKERS)
+    with tracing.sc_scope(name), endpoints.scope(endpoints.endpoint_of(container)):
+        transfer.export_container(get_runtime(), get_stateful_container(name), destination, all_snapshots, workers)
+
+def handle_import(name, source=None, new_name=None, workers=None, skip_present=True):
+    workers = workers or load_config().get('max_workers', bulk.DEFAULT_MAX_WORKERS)
+    try:
+        # Held from the check that the name is free until the record is saved
+        with tracing.sc_scope(new_name or name), locks.sc_lock(new_name or name):
+            transfer.import_container(get_runtime(), name, source, new_name, workers, skip_present)
+    except TimeoutError as e:
+        print(e)
+
+def delete_container_images(container):
     for entry in container['history']:
-        delete_command = f"{'sudo ' if config['use_sudo'] else ''}{config['container_runtime']} rmi {entry['image']}"
-        subprocess.run(delete_command, shell=True)
+        get_runtime().remove_image(entry['image'])
 
 def delete_all_but_latest_image(container):
-    config = load_config()
     if len(container['history']) > 1:
         for entry in container['history'][:-1]:
-            delete_command = f"{'sudo ' if config['use_sudo'] else ''}{config['container_runtime']} rmi {entry['image']}"
-            subprocess.run(delete_command, shell=True)
+            get_runtime().remove_image(entry['image'])
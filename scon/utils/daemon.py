@@ -0,0 +1,64 @@
+# scon/utils/daemon.py
+
+import os
+import sys
+
+SOCKET_NAME = "scon.sock"
+# Commands that stay in the calling process: long-running ones, ones that prompt
+# and ones that take paths relative to the caller's working directory
+LOCAL_COMMANDS = {'serve', 'watch', 'export', 'import'}
+
+def socket_path():
+    if os.environ.get('SCON_SOCKET'):
+        return os.environ['SCON_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'scon', SOCKET_NAME)
+    # Without a runtime directory the socket lives next to the state
+    from scon.utils import config_manager
+    return os.path.join(config_manager.app_dirs().user_data_dir, SOCKET_NAME)
+
+def runs_locally(argv):
+    positional = [arg for arg in argv if not arg.startswith('-')]
+    if not positional or positional[0] in LOCAL_COMMANDS:
+        return True
+    if positional[:2] == ['schedule', 'run']:
+        return True
+    # `scon delete NAME` without an option asks interactively
+    return positional[0] == 'delete' and len(positional) < 3
+
+def forward(argv):
+    # Runs argv in the daemon, streaming its output here. Returns the exit code,
+    # or None when no daemon is reachable and the caller should run it in-process.
+    if os.environ.get('SCON_NO_DAEMON') or runs_locally(argv):
+        return None
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    # Only now: most invocations find no daemon, and these imports are most of their startup
+    import json
+    import socket
+    from scon.utils import tracing
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        # Stale socket from a daemon that is gone
+        sock.close()
+        return None
+
+    with sock, sock.makefile('rwb') as stream:
+        # The daemon writes the trace where this process would have
+        stream.write(json.dumps({'argv': argv, 'trace': tracing.trace_path_from_env()}).encode() + b'\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'exit' in message:
+                return message['exit']
+    print("Lost the connection to the scon daemon.", file=sys.stderr)
+    return 1
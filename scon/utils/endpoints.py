@@ -0,0 +1,100 @@
+# scon/utils/endpoints.py
+#
+# Named runtime endpoints (config: endpoints). 'local' is the runtime the top-level
+# settings describe; every other endpoint is a DOCKER_HOST-style URL. Each SC record
+# names the endpoint it lives on, and the runtime work for it runs in that endpoint's scope.
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from scon.utils import runtime_client, tracing
+
+LOCAL = "local"
+AUTO = "auto"
+DEFAULT_ENDPOINT_TIMEOUT = 10
+
+_current = contextvars.ContextVar('current_endpoint', default=None)
+
+def endpoint_names(config):
+    return [LOCAL] + sorted(config.get('endpoints') or {})
+
+def is_multi_host(config):
+    return bool(config.get('endpoints'))
+
+def endpoint_of(record):
+    return record.get('endpoint') or LOCAL
+
+def snapshot_endpoint(record, entry):
+    # Snapshots taken before the SC moved to another endpoint stay behind on the old one
+    return entry.get('endpoint') or endpoint_of(record)
+
+def least_loaded(loads, preferred=None):
+    # Picks the endpoint with the fewest running containers, staying on preferred on a
+    # tie, and counts the container about to start there
+    name = min(loads, key=lambda n: (loads[n], n != preferred, n))
+    loads[name] += 1
+    return name
+
+def endpoint_timeout(config):
+    return config.get('endpoint_timeout', DEFAULT_ENDPOINT_TIMEOUT)
+
+def create_runtime(config, name):
+    if name == LOCAL:
+        return runtime_client.create_runtime(config)
+    url = (config.get('endpoints') or {}).get(name)
+    if url is None:
+        raise ValueError(f"Unknown runtime endpoint '{name}'. Add it with `scon config set endpoint {name}=URL`.")
+    return runtime_client.create_runtime(config, url)
+
+@contextmanager
+def scope(name):
+    # Runtime calls inside go to this endpoint unless they name another one
+    token = _current.set(name)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def current():
+    return _current.get() or LOCAL
+
+def fan_out(work, names, timeout):
+    # Runs work() once per endpoint, all at once, each inside that endpoint's scope.
+    # Returns ({name: result}, {name: reason}); an endpoint that raises, returns None
+    # or has not answered within timeout seconds is reported instead of holding up the others.
+    lock = threading.Lock()
+    results, failures = {}, {}
+
+    def call(name):
+        try:
+            with scope(name), tracing.span('endpoint.query', endpoint=name):
+                result = work()
+        except Exception as e:
+            with lock:
+                failures[name] = str(e) or type(e).__name__
+            return
+        with lock:
+            if result is None:
+                failures[name] = "the runtime did not answer"
+            elif name not in failures:
+                results[name] = result
+
+    threads = {}
+    for name in names:
+        # Daemon threads in a copy of the caller's context, so one that hangs is
+        # abandoned at exit and its output still reaches a `scon serve` client
+        threads[name] = threading.Thread(target=contextvars.copy_context().run, args=(call, name), daemon=True)
+        threads[name].start()
+    deadline = time.monotonic() + timeout
+    for name, thread in threads.items():
+        thread.join(max(0, deadline - time.monotonic()))
+        with lock:
+            if thread.is_alive() and name not in results:
+                failures[name] = f"no answer within {timeout}s"
+    with lock:
+        return dict(results), dict(failures)
+
+def report_unreachable(failures):
+    for name, reason in sorted(failures.items()):
+        print(f"Runtime endpoint '{name}' is unreachable: {reason}")
@@ -0,0 +1,259 @@
+# scon/utils/garbage_collector.py
+
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from scon.utils import chunk_store, endpoints, json_storage, locks, runtime_client
+
+# Unreferenced chunks younger than this are kept: a capture or export writes its chunks
+# before the record or manifest that references them
+CHUNK_GRACE_SECONDS = 3600
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+def snapshot_entries(container):
+    # (list key, entry, image, created_at) for the current layout and the legacy 'history'
+    # one; image is what the entry needs in the runtime, a delta's checkpoint for a delta
+    for entry in container.get('snapshots', []):
+        yield 'snapshots', entry, json_storage.snapshot_image(entry), entry.get('created_at') or ''
+    for entry in container.get('history', []):
+        yield 'history', entry, entry['image'], entry.get('timestamp') or ''
+
+def snapshot_key(entry):
+    return entry.get('image_id') or entry['image']
+
+def oldest_first(container, untagged, count):
+    # Which count of untagged ([(created_at, entry)]) retention drops when there are too many
+    return [snapshot_key(entry) for _, entry in sorted(untagged, key=lambda item: item[0])[:count]]
+
+def kept_snapshots(container, max_snapshots, retention_days, now=None, choose=oldest_first):
+    # Retention for one SC: the keys of the entries to keep, which are the one next start
+    # uses, the tagged ones and max_snapshots untagged within retention_days, the rest
+    # picked by choose. Entries are counted, not images, so each delta on a checkpoint
+    # counts once, and the one next start uses counts too.
+    cutoff = ((now or datetime.utcnow()) - timedelta(days=retention_days)).isoformat()
+    next_key = (container.get('next_snapshot_to_start') or {}).get('image_id')
+    kept = {next_key} if next_key else set()
+    untagged = []
+    for _, entry, _, created_at in snapshot_entries(container):
+        if entry.get('tagged', False):
+            kept.add(snapshot_key(entry))
+        elif created_at >= cutoff:
+            untagged.append((created_at, entry))
+    count = len(untagged) - max(max_snapshots, 0)
+    candidates = [(created_at, entry) for created_at, entry in untagged if snapshot_key(entry) != next_key]
+    dropped = set(choose(container, candidates, count)) if count > 0 and candidates else set()
+    kept.update(snapshot_key(entry) for _, entry in candidates if snapshot_key(entry) not in dropped)
+    return kept
+
+def reachable_images(container, max_snapshots, retention_days, now=None, choose=oldest_first):
+    # Mark phase for one SC: everything start, warm start, a pending commit or a kept
+    # snapshot needs. A checkpoint stays while any kept delta goes on top of it.
+    kept = kept_snapshots(container, max_snapshots, retention_days, now, choose)
+    reachable = {image for _, entry, image, _ in snapshot_entries(container) if snapshot_key(entry) in kept}
+    for key in ('next_snapshot_to_start', 'warm_container'):
+        if container.get(key):
+            reachable.add(json_storage.snapshot_image(container[key]))
+    if container.get('pending_commit'):
+        reachable.add(container['pending_commit']['image'])
+
+    # Base images are not scon's to remove
+    for key in ('image', 'original_image'):
+        if container.get(key):
+            reachable.add(container[key])
+    if container.get('containers'):
+        reachable.add(container['containers'][0]['image'])
+    return reachable
+
+def plan(containers, runtime_containers, max_snapshots, retention_days, include_stopped=True, endpoint=None,
+         choose=oldest_first):
+    # Mark across every SC first, so an image reachable from any SC is never swept.
+    # With an endpoint, only what lives on that endpoint is a candidate.
+    now = datetime.utcnow()
+    reachable = set()
+    candidates = {}
+    committed = {}
+    for container in containers:
+        reachable |= reachable_images(container, max_snapshots, retention_days, now, choose)
+        for _, entry, image, _ in snapshot_entries(container):
+            if endpoint and endpoints.snapshot_endpoint(container, entry) != endpoint:
+                continue
+            candidates.setdefault(image, container['name'])
+            # A stopped container is only garbage once its state has been committed
+            if entry.get('source_container'):
+                committed[entry['source_container']] = container['name']
+
+    images = {image: sc_name for image, sc_name in candidates.items() if image not in reachable}
+
+    stopped = {}
+    if include_stopped:
+        for runtime_container in runtime_containers or []:
+            if runtime_container['state'] == 'running':
+                continue
+            for container_name in runtime_container['names']:
+                if container_name in committed:
+                    stopped[runtime_container['id']] = committed[container_name]
+                    break
+    return {'images': images, 'containers': stopped}
+
+def sweep(remove, refs, workers):
+    # Hands out CLI-sized batches to a small pool; returns every ref that is gone
+    chunks = list(runtime_client.batches(sorted(refs)))
+    if workers <= 1 or len(chunks) <= 1:
+        results = [remove(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, remove, chunk) for chunk in chunks]
+            results = [future.result() for future in futures]
+    return set().union(*results)
+
+def image_sizes(runtime, images):
+    # {ref: (image id, bytes)} from batched inspects
+    return {ref: (info['Id'], info.get('Size') or 0) for ref, info in runtime.inspect_images(list(images)).items()}
+
+def total_bytes(sizes, refs):
+    # Several tags can point at one image; count each image once
+    return sum(dict(sizes[ref] for ref in refs if ref in sizes).values())
+
+def marked_chunks(containers, store, dropping=()):
+    # Mark phase for the chunk store: the captured volumes and deltas of every snapshot
+    # entry (except those of the (endpoint, image) pairs in dropping) and every export
+    from scon.utils import transfer, volumes
+    marked = set()
+    for container in containers:
+        entries = [entry for _, entry, image, _ in snapshot_entries(container)
+                   if (endpoints.snapshot_endpoint(container, entry), image) not in dropping]
+        entries += [container[key] for key in ('next_snapshot_to_start', 'warm_container') if container.get(key)]
+        for entry in entries:
+            for key in ('volumes', 'delta'):
+                if not entry.get(key):
+                    continue
+                try:
+                    marked.update(volumes.captured_chunks(store, entry[key]))
+                except (FileNotFoundError, ValueError):
+                    # Without its manifest nothing else of the capture can be found
+                    marked.add(entry[key]['manifest'])
+    for name in store.manifest_names():
+        marked.update(transfer.manifest_chunks(store.load_manifest(name)))
+    return marked
+
+def sweep_chunks(store, marked, dry_run=False):
+    # Removes unmarked chunks and leftover .partial files past the grace period; returns (count, bytes)
+    cutoff = time.time() - CHUNK_GRACE_SECONDS
+    count = size = 0
+    for digest, path in store.chunk_files():
+        if digest in marked:
+            continue
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+        count += 1
+        size += stat.st_size
+    return count, size
+
+def collect_chunks(dry_run=False, dropping=()):
+    store = chunk_store.local_store()
+    if not os.path.isdir(store.root):
+        return
+    count, size = sweep_chunks(store, marked_chunks(json_storage.load_stateful_containers(), store, dropping),
+                               dry_run)
+    if count:
+        print(f"{'Would remove' if dry_run else 'Removed'} {count} unreferenced volume and delta chunks "
+              f"({format_bytes(size)}).")
+
+def run_gc(get_runtime, config, dry_run=False, workers=1, include_stopped=True, free=None):
+    # get_runtime() returns the runtime of the current endpoint scope. Every endpoint
+    # is surveyed at once; one that does not answer in time is left alone this run.
+    # With free (bytes), only the snapshot images that free the most go, until that much is freed.
+    containers = json_storage.load_stateful_containers()
+    max_snapshots = config.get('max_snapshots', json_storage.DEFAULT_MAX_SNAPSHOTS)
+    retention_days = config.get('retention_days', json_storage.DEFAULT_RETENTION_DAYS)
+    # Layer usage decides which snapshots over max_snapshots go, and what --free picks
+    accounts, choose = None, oldest_first
+    if free is not None or any(len(container.get('snapshots', [])) > max_snapshots for container in containers):
+        from scon.utils import usage
+        accounts = usage.collect(get_runtime, config, containers)
+        choose = usage.retention_picker(accounts)
+
+    def survey():
+        runtime = get_runtime()
+        runtime_containers = runtime.list_containers() if include_stopped else []
+        if runtime_containers is None:
+            return None
+        sweep_plan = plan(containers, runtime_containers, max_snapshots, retention_days, include_stopped,
+                          endpoints.current(), choose)
+        sweep_plan['sizes'] = image_sizes(runtime, sweep_plan['images']) if sweep_plan['images'] else {}
+        return sweep_plan
+    plans, failures = endpoints.fan_out(survey, endpoints.endpoint_names(config), endpoints.endpoint_timeout(config))
+    endpoints.report_unreachable(failures)
+    if free is not None:
+        picked, freed = usage.pick_reclaimable(accounts, {endpoint: p['images'] for endpoint, p in plans.items()}, free)
+        for endpoint, sweep_plan in plans.items():
+            sweep_plan['images'] = {image: sc_name for image, sc_name in sweep_plan['images'].items()
+                                    if image in picked.get(endpoint, ())}
+        print(f"Picked {sum(len(images) for images in picked.values())} snapshot images that free "
+              f"{format_bytes(freed)}" + (f", short of the {format_bytes(free)} asked for." if freed < free else "."))
+
+    multi_host = endpoints.is_multi_host(config)
+    per_sc = {}
+    for endpoint, sweep_plan in plans.items():
+        for sc_name in sweep_plan['images'].values():
+            per_sc[sc_name, endpoint] = per_sc.get((sc_name, endpoint), 0) + 1
+    for (sc_name, endpoint), count in sorted(per_sc.items()):
+        print(f"  {sc_name}: {count} snapshot(s)" + (f" on '{endpoint}'" if multi_host else ''))
+    image_count = sum(len(p['images']) for p in plans.values())
+    stopped_count = sum(len(p['containers']) for p in plans.values())
+    sc_count = len({sc_name for sc_name, _ in per_sc})
+
+    if dry_run:
+        size = sum(total_bytes(p['sizes'], p['images']) for p in plans.values())
+        print(f"Would remove {image_count} snapshot images across {sc_count} stateful containers "
+              f"(up to {format_bytes(size)}) and {stopped_count} stopped containers.")
+        collect_chunks(dry_run, {(endpoint, image) for endpoint, p in plans.items() for image in p['images']})
+        return plans
+
+    def remove(endpoint):
+        sweep_plan = plans[endpoint]
+        with endpoints.scope(endpoint):
+            runtime = get_runtime()
+            # Stopped containers pin the images they were created from, so they go first
+            removed_containers = sweep(runtime.remove_containers, sweep_plan['containers'], workers) \
+                if sweep_plan['containers'] else set()
+            removed_images = sweep(runtime.remove_images, sweep_plan['images'], workers) \
+                if sweep_plan['images'] else set()
+        return removed_containers, removed_images
+    with ThreadPoolExecutor(max_workers=max(1, len(plans))) as pool:
+        futures = {endpoint: pool.submit(contextvars.copy_context().run, remove, endpoint) for endpoint in plans}
+        removed = {endpoint: future.result() for endpoint, future in futures.items()}
+
+    touched = {plans[endpoint]['images'][image] for endpoint, (_, images) in removed.items() for image in images}
+    if touched:
+        def drop_removed(container):
+            # Delta snapshots go with their checkpoint
+            kept = [(key, entry) for key, entry, image, _ in snapshot_entries(container)
+                    if image not in removed.get(endpoints.snapshot_endpoint(container, entry), ((), ()))[1]]
+            for key in ('snapshots', 'history'):
+                if key in container:
+                    container[key] = [entry for list_key, entry in kept if list_key == key]
+        # Under the SC locks, so a stop or commit in flight does not find its record changed under it
+        locks.update_many(touched, drop_removed)
+
+    removed_images = sum(len(images) for _, images in removed.values())
+    removed_containers = sum(len(containers) for containers, _ in removed.values())
+    size = sum(total_bytes(plans[endpoint]['sizes'], images) for endpoint, (_, images) in removed.items())
+    print(f"Removed {removed_images} of {image_count} snapshot images (up to {format_bytes(size)}) "
+          f"and {removed_containers} of {stopped_count} stopped containers.")
+    # After the records dropped the removed snapshots, so their chunks go too
+    collect_chunks()
+    return plans
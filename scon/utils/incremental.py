@@ -0,0 +1,84 @@
+# scon/utils/incremental.py
+
+import posixpath
+import time
+from scon.utils import volumes
+from scon.utils.json_storage import snapshot_image
+from scon.utils.chunk_store import local_store
+from scon.utils.garbage_collector import format_bytes
+
+DEFAULT_CHECKPOINT_INTERVAL = 10
+# A delta holds everything changed since its checkpoint; past this much writable
+# layer a full commit is the cheaper thing to start from
+DELTA_MAX_BYTES = 512 * 1024 * 1024
+
+def leaf_changes(changes):
+    # `diff` also lists every directory above a change. Only the deepest paths are
+    # copied, so each changed file is read once and unchanged siblings not at all.
+    ancestors = set()
+    for _, path in changes:
+        parent = posixpath.dirname(path)
+        while parent != '/' and parent not in ancestors:
+            ancestors.add(parent)
+            parent = posixpath.dirname(parent)
+    copied = sorted(path for kind, path in changes if kind != 'D' and path not in ancestors)
+    deleted = sorted(path for kind, path in changes if kind == 'D')
+    return copied, deleted
+
+def checkpoint_due(container_data, interval):
+    # Deltas are taken against the image the container runs on, which has to be
+    # the one next start uses; every interval-th snapshot is a full commit
+    next_snapshot = container_data.get('next_snapshot_to_start')
+    containers = container_data.get('containers') or []
+    if not next_snapshot or interval <= 1 or not containers:
+        return True
+    if containers[-1].get('image') != snapshot_image(next_snapshot):
+        return True
+    return (next_snapshot.get('delta') or {}).get('number', 0) + 1 >= interval
+
+def capture_delta(runtime, container_data, container_ref, interval=DEFAULT_CHECKPOINT_INTERVAL, workers=4):
+    # The 'delta' value for a snapshot entry, or None when a full commit should be made instead
+    if checkpoint_due(container_data, interval):
+        return None
+    started_at = time.monotonic()
+    layer_bytes = runtime.container_size(container_ref)
+    if layer_bytes is None or layer_bytes > DELTA_MAX_BYTES:
+        return None
+    changes = runtime.container_changes(container_ref)
+    if changes is None:
+        return None
+
+    next_snapshot = container_data['next_snapshot_to_start']
+    previous = next_snapshot.get('delta')
+    store = local_store()
+    previous_trees = volumes.previous_members(volumes.load_manifest(store, previous)) if previous else None
+    copied, deleted = leaf_changes(changes)
+    trees, stats = volumes.capture_paths(runtime, container_ref, copied, store, previous_trees, workers)
+    return {
+        'manifest': volumes.save_manifest(store, {'paths': trees, 'deleted': deleted}),
+        'checkpoint': snapshot_image(next_snapshot),
+        'number': (previous or {}).get('number', 0) + 1,
+        'changes': len(copied) + len(deleted),
+        'bytes': stats['bytes'],
+        'stored_bytes': stats['stored'],
+        'layer_bytes': layer_bytes,
+        'seconds': round(time.monotonic() - started_at, 3),
+        # What the checkpoint's full commit took, to report the time saved against
+        'commit_seconds': (previous or {}).get('commit_seconds') or next_snapshot.get('commit_seconds'),
+    }
+
+def restore_delta(runtime, container_ref, delta, workers=4):
+    # Writes the changed paths into a created, not yet started container
+    volumes.restore_paths(runtime, container_ref, volumes.load_manifest(local_store(), delta)['paths'], workers)
+
+def apply_deletions(runtime, container_ref, delta):
+    # The archive API can only add files, so deletions are replayed inside the running container
+    deleted = volumes.load_manifest(local_store(), delta).get('deleted') or []
+    return not deleted or runtime.exec_in(container_ref, ['rm', '-rf', '--'] + deleted)
+
+def describe_delta(delta):
+    saved = f"{format_bytes(delta['stored_bytes'])} stored for a {format_bytes(delta['layer_bytes'])} writable layer"
+    timing = f"{delta['seconds']:.2f}s"
+    if delta.get('commit_seconds'):
+        timing += f" vs {delta['commit_seconds']:.2f}s for the last full commit"
+    return f"incremental snapshot {delta['number']} since checkpoint: {delta['changes']} changed paths, {saved}, {timing}"
@@ -0,0 +1,300 @@
+# scon/utils/inventory.py
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from scon.utils import runtime_client
+
+# Docker only replays its last 256 events; a replay that long may have lost some
+EVENT_REPLAY_LIMIT = 256
+INVENTORY_MAX_AGE = 3600
+RUNNING_ACTIONS = {'start', 'restart', 'unpause'}
+STOPPED_ACTIONS = {'die', 'stop', 'died', 'cleanup'}
+REMOVED_ACTIONS = {'destroy', 'remove'}
+
+def build_inventory(runtime_containers, runtime_images):
+    # In-memory indexes over one bulk `ps -a` and one bulk `images` result
+    by_name, by_id = {}, {}
+    for container in runtime_containers:
+        by_id[container['id']] = container
+        by_id[container['id'][:12]] = container
+        for name in container['names']:
+            by_name[name] = container
+    images = set()
+    for image in runtime_images:
+        images.add(image['id'])
+        images.add(image['id'].split(':')[-1][:12])
+        for tag in image['tags']:
+            images |= runtime_client.tag_aliases(tag)
+    return {'containers_by_name': by_name, 'containers_by_id': by_id, 'images': images}
+
+def has_image(inventory, image):
+    return image in inventory['images'] or image.split(':')[-1][:12] in inventory['images']
+
+
+class RuntimeInventory:
+    # Answers "does this container/image exist" from one bulk container list and
+    # one bulk image list, each fetched on first use. scon's own runtime calls
+    # update it through TrackedRuntime; anything it cannot follow drops the index.
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self._lock = threading.RLock()
+        self._containers = None
+        self._images = None
+        self.synced_at = None
+
+    def _container_index(self):
+        with self._lock:
+            if self._containers is None:
+                self.synced_at = self.synced_at or time.time()
+                listed = self.runtime.list_containers()
+                if listed is None:
+                    return None
+                self._containers = build_inventory(listed, [])
+            return self._containers
+
+    def _image_index(self):
+        with self._lock:
+            if self._images is None:
+                self.synced_at = self.synced_at or time.time()
+                listed = self.runtime.list_images()
+                if listed is None:
+                    return None
+                self._images = build_inventory([], listed)['images']
+            return self._images
+
+    def container(self, ref):
+        index = self._container_index()
+        if index is None:
+            return None
+        return index['containers_by_name'].get(ref) or index['containers_by_id'].get(ref)
+
+    def container_id(self, name, running_only=False):
+        index = self._container_index()
+        if index is None:
+            # Inventory unavailable; ask the runtime directly
+            return self.runtime.container_id(name, running_only)
+        container = index['containers_by_name'].get(name)
+        if container is None or (running_only and container['state'] != 'running'):
+            return None
+        return container['id']
+
+    def has_image(self, image):
+        images = self._image_index()
+        if images is None:
+            return self.runtime.inspect_image(image) is not None
+        return has_image({'images': images}, image)
+
+    def invalidate(self):
+        with self._lock:
+            self._containers = None
+            self._images = None
+            self.synced_at = None
+
+    # Bookkeeping for mutations scon made itself
+
+    def add_container(self, container_id, name, image, state):
+        with self._lock:
+            if self._containers is None or not container_id:
+                return
+            self.remove_container(container_id)
+            container = {'id': container_id, 'names': [name] if name else [], 'image': image, 'state': state}
+            self._containers['containers_by_id'][container_id] = container
+            self._containers['containers_by_id'][container_id[:12]] = container
+            if name:
+                self._containers['containers_by_name'][name] = container
+
+    def set_state(self, ref, state):
+        with self._lock:
+            container = self.container(ref) if self._containers is not None else None
+            if container:
+                container['state'] = state
+
+    def rename_container(self, ref, new_name):
+        with self._lock:
+            container = self.container(ref) if self._containers is not None else None
+            if container is None:
+                return
+            for name in container['names']:
+                self._containers['containers_by_name'].pop(name, None)
+            container['names'] = [new_name]
+            self._containers['containers_by_name'][new_name] = container
+
+    def remove_container(self, ref):
+        with self._lock:
+            container = self.container(ref) if self._containers is not None else None
+            if container is None:
+                return
+            for name in container['names']:
+                self._containers['containers_by_name'].pop(name, None)
+            self._containers['containers_by_id'].pop(container['id'], None)
+            self._containers['containers_by_id'].pop(container['id'][:12], None)
+
+    def add_image(self, image):
+        with self._lock:
+            if self._images is not None:
+                self._images |= runtime_client.tag_aliases(image)
+
+    def remove_image(self, image):
+        with self._lock:
+            if self._images is not None:
+                self._images -= runtime_client.tag_aliases(image)
+
+    def apply_event(self, event):
+        # Follows container lifecycle events; image events just drop the image index
+        if event['type'] == 'image':
+            with self._lock:
+                self._images = None
+            return
+        if event['type'] != 'container' or not event['id']:
+            return
+        action = event['action']
+        if action == 'create':
+            self.add_container(event['id'], event['name'], event['image'], 'created')
+        elif action in RUNNING_ACTIONS:
+            if self.container(event['id']) is None:
+                self.add_container(event['id'], event['name'], event['image'], 'running')
+            self.set_state(event['id'], 'running')
+        elif action in STOPPED_ACTIONS:
+            self.set_state(event['id'], 'exited')
+        elif action in REMOVED_ACTIONS:
+            self.remove_container(event['id'])
+        elif action == 'rename' and event['name']:
+            self.rename_container(event['id'], event['name'])
+
+    # Persistence across invocations (config: inventory_cache)
+
+    def save(self, path):
+        with self._lock:
+            if self._containers is None and self._images is None:
+                return
+            containers = {c['id']: c for c in self._containers['containers_by_id'].values()} \
+                if self._containers is not None else None
+            data = {
+                'synced_at': self.synced_at,
+                'containers': list(containers.values()) if containers is not None else None,
+                'images': sorted(self._images) if self._images is not None else None,
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        # Restores a saved inventory and replays the runtime's events since it was
+        # taken. Any doubt (too old, replay failed or may be truncated) means a fresh fetch.
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        synced_at = data.get('synced_at')
+        if not synced_at or time.time() - synced_at > INVENTORY_MAX_AGE:
+            return False
+
+        now = time.time()
+        try:
+            events = list(self.runtime.events(since=f"{synced_at:.6f}", until=f"{now:.6f}"))
+        except (OSError, ValueError, runtime_client.ApiError):
+            return False
+        if len(events) >= EVENT_REPLAY_LIMIT:
+            return False
+
+        with self._lock:
+            if data.get('containers') is not None:
+                self._containers = build_inventory(data['containers'], [])
+            if data.get('images') is not None:
+                self._images = set(data['images'])
+            for event in events:
+                self.apply_event(event)
+            self.synced_at = now
+        return True
+
+
+class TrackedRuntime:
+    # Forwards every call to the runtime client and keeps the inventory in step
+    # with the mutations scon makes, so later lookups in this process stay accurate
+
+    def __init__(self, runtime, inventory):
+        self._runtime = runtime
+        self.inventory = inventory
+
+    def __getattr__(self, attribute):
+        return getattr(self._runtime, attribute)
+
+    def container_id(self, name, running_only=False):
+        return self.inventory.container_id(name, running_only)
+
+    def run_container(self, name, image, command):
+        container_id = self._runtime.run_container(name, image, command)
+        self.inventory.add_container(container_id, name, image, 'running')
+        return container_id
+
+    def create_container(self, name, image, command, mounts=None):
+        container_id = self._runtime.create_container(name, image, command, mounts)
+        self.inventory.add_container(container_id, name, image, 'created')
+        return container_id
+
+    def start_container(self, ref):
+        ok = self._runtime.start_container(ref)
+        if ok:
+            self.inventory.set_state(ref, 'running')
+        return ok
+
+    def stop(self, ref):
+        ok = self._runtime.stop(ref)
+        if ok:
+            self.inventory.set_state(ref, 'exited')
+        return ok
+
+    def rename(self, ref, new_name):
+        ok = self._runtime.rename(ref, new_name)
+        if ok:
+            self.inventory.rename_container(ref, new_name)
+        return ok
+
+    def remove_container(self, ref):
+        ok = self._runtime.remove_container(ref)
+        if ok:
+            self.inventory.remove_container(ref)
+        return ok
+
+    def remove_containers(self, refs):
+        removed = self._runtime.remove_containers(refs)
+        for ref in removed:
+            self.inventory.remove_container(ref)
+        return removed
+
+    def commit(self, ref, image):
+        ok = self._runtime.commit(ref, image)
+        if ok:
+            self.inventory.add_image(image)
+        return ok
+
+    def flatten_image(self, image, target):
+        ok = self._runtime.flatten_image(image, target)
+        if ok:
+            self.inventory.add_image(target)
+        return ok
+
+    def remove_image(self, image):
+        ok = self._runtime.remove_image(image)
+        if ok:
+            self.inventory.remove_image(image)
+        return ok
+
+    def remove_images(self, refs):
+        removed = self._runtime.remove_images(refs)
+        for ref in removed:
+            self.inventory.remove_image(ref)
+        return removed
+
+    @contextmanager
+    def load_image(self):
+        with self._runtime.load_image() as writer:
+            yield writer
+        # A load does not report which tags it created; list again on the next lookup
+        self.inventory.invalidate()
@@ -0,0 +1,174 @@
+# scon/utils/job_queue.py
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sc_name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker_pid INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_sc_name ON jobs(sc_name, status);
+"""
+
+COLUMNS = "id, sc_name, kind, payload, status, attempts, error, worker_pid, created_at, updated_at"
+
+
+def _row_to_job(row):
+    job = dict(zip([c.strip() for c in COLUMNS.split(',')], row))
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    # Durable FIFO of deferred runtime work (snapshot commits, flattening), kept in
+    # its own SQLite file next to the state store so any backend can use it.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, sc_name, kind, payload):
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (sc_name, kind, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (sc_name, kind, json.dumps(payload), now, now))
+        return cursor.lastrowid
+
+    def claim_next(self, sc_name=None, kind=None, exclude=()):
+        # Atomically moves the oldest pending job (of an SC not in exclude) to 'running' for this process
+        def work():
+            query = f"SELECT {COLUMNS} FROM jobs WHERE status = 'pending'"
+            params = []
+            if sc_name is not None:
+                query += " AND sc_name = ?"
+                params.append(sc_name)
+            if kind is not None:
+                query += " AND kind = ?"
+                params.append(kind)
+            if exclude:
+                query += f" AND sc_name NOT IN ({', '.join('?' for _ in exclude)})"
+                params.extend(exclude)
+            row = self._conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            job = _row_to_job(row)
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_pid = ?, updated_at = ? "
+                "WHERE id = ?", (os.getpid(), datetime.utcnow().isoformat(), job['id']))
+            job['status'] = 'running'
+            job['attempts'] += 1
+            return job
+        return self._transaction(work)
+
+    def release(self, job_id):
+        # Hands a claimed job back untried, without using up one of its attempts
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'pending', attempts = attempts - 1, worker_pid = NULL, "
+                               "updated_at = ? WHERE id = ? AND status = 'running'",
+                               (datetime.utcnow().isoformat(), job_id))
+
+    def complete(self, job_id):
+        self._set_status(job_id, 'done', None)
+
+    def fail(self, job_id, error):
+        # Failed jobs go back to the queue until they run out of attempts
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        status = 'pending' if row and row[0] < MAX_ATTEMPTS else 'failed'
+        self._set_status(job_id, status, error)
+        return status
+
+    def retry(self, job_id):
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, error = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'failed'", (datetime.utcnow().isoformat(), job_id)).rowcount > 0
+
+    def _set_status(self, job_id, status, error):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                               (status, error, datetime.utcnow().isoformat(), job_id))
+
+    def requeue_abandoned(self):
+        # Jobs left 'running' by a worker that no longer exists are made pending again
+        def work():
+            rows = self._conn.execute("SELECT id, worker_pid FROM jobs WHERE status = 'running'").fetchall()
+            abandoned = [job_id for job_id, pid in rows if not pid or not _pid_alive(pid)]
+            self._conn.executemany("UPDATE jobs SET status = 'pending' WHERE id = ?", [(i,) for i in abandoned])
+            return len(abandoned)
+        return self._transaction(work)
+
+    def queued_commits(self, sc_name=None):
+        # (SC name, image) of every commit job still pending or running
+        query = "SELECT sc_name, payload FROM jobs WHERE kind = 'commit' AND status IN ('pending', 'running')"
+        params = ()
+        if sc_name is not None:
+            query += " AND sc_name = ?"
+            params = (sc_name,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return {(name, json.loads(payload).get('image')) for name, payload in rows}
+
+    def active_jobs(self, sc_name, kind=None):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {COLUMNS} FROM jobs WHERE sc_name = ? AND status IN ('pending', 'running') ORDER BY id",
+                (sc_name,)).fetchall()
+        return [job for job in map(_row_to_job, rows) if kind is None or job['kind'] == kind]
+
+    def list_jobs(self, status=None):
+        with self._lock:
+            if status:
+                rows = self._conn.execute(f"SELECT {COLUMNS} FROM jobs WHERE status = ? ORDER BY id",
+                                          (status,)).fetchall()
+            else:
+                rows = self._conn.execute(f"SELECT {COLUMNS} FROM jobs ORDER BY id").fetchall()
+        return [_row_to_job(r) for r in rows]
+
+    def purge_done(self):
+        with self._lock:
+            return self._conn.execute("DELETE FROM jobs WHERE status = 'done'").rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,49 +1,96 @@
-import json
 import os
-from platformdirs import PlatformDirs
+from datetime import datetime
+from scon.utils import tracing
+from scon.utils.config_manager import (DEFAULT_RETENTION_DAYS, DEFAULT_MAX_SNAPSHOTS, DEFAULT_STATE_BACKEND,
+                                       app_dirs, load_config, save_config)
 
-DEFAULT_RETENTION_DAYS = 30
-DEFAULT_MAX_SNAPSHOTS = 5
+def data_path(filename):
+    # The data directory is created the first time state is actually touched
+    data_dir = app_dirs().user_data_dir
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, filename)
 
-# Get the appropriate directory for configuration and data files
-dirs = PlatformDirs("scon", "YourCompanyName")
+_state_store = None
 
-CONFIG_PATH = os.path.join(dirs.user_config_dir, "scon_config.json")
-CONTAINERS_PATH = os.path.join(dirs.user_data_dir, "stateful_containers.json")
+def get_state_store():
+    global _state_store
+    if _state_store is None:
+        from scon.utils import state_store
+        backend = load_config().get('state_backend', DEFAULT_STATE_BACKEND)
+        # Opening replays the journal backend's checkpoint and journal
+        with tracing.span('state.open'):
+            if backend == "json":
+                _state_store = state_store.JsonStateStore(data_path("stateful_containers.json"))
+            elif backend == "journal":
+                _state_store = state_store.JournalStateStore(data_path("stateful_containers.journal"))
+                _state_store.migrate_from_json(data_path("stateful_containers.json"))
+            else:
+                _state_store = state_store.SqliteStateStore(data_path("stateful_containers.db"))
+                _state_store.migrate_from_json(data_path("stateful_containers.json"))
+    return _state_store
 
-# Ensure directories exist
-os.makedirs(dirs.user_config_dir, exist_ok=True)
-os.makedirs(dirs.user_data_dir, exist_ok=True)
+_job_queue = None
 
-def load_json_file(path, default_data):
-    if os.path.exists(path):
-        with open(path, 'r') as file:
-            return json.load(file)
-    else:
-        with open(path, 'w') as file:
-            json.dump(default_data, file, indent=4)
-        return default_data
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        from scon.utils import job_queue
+        _job_queue = job_queue.JobQueue(data_path("jobs.db"))
+    return _job_queue
 
-def save_json_file(path, data):
-    with open(path, 'w') as file:
-        json.dump(data, file, indent=4)
+def reset_stores():
+    # Closes the cached stores so the next call reopens them with the current config
+    global _state_store, _job_queue
+    for store in (_state_store, _job_queue):
+        if store is not None:
+            store.close()
+    _state_store = _job_queue = None
 
 def load_stateful_containers():
-    return load_json_file(CONTAINERS_PATH, [])
+    with tracing.span('state.load_all'):
+        return get_state_store().load_all()
+
+def scan_stateful_containers(**filters):
+    # Streams matching records; see the state stores' scan() for the filters
+    return get_state_store().scan(**filters)
 
 def save_stateful_containers(containers):
-    save_json_file(CONTAINERS_PATH, containers)
+    with tracing.span('state.replace_all'):
+        get_state_store().replace_all(containers)
+
+# Single-record access; prefer these over load/save of the whole list
+def get_stateful_container(name):
+    with tracing.span('state.get'):
+        return get_state_store().get(name)
+
+def save_stateful_container(container):
+    with tracing.span('state.put'):
+        get_state_store().put(container)
+
+def save_stateful_container_batch(containers):
+    with tracing.span('state.put_many'):
+        get_state_store().put_many(containers)
 
-def load_config():
-    return load_json_file(CONFIG_PATH, {
-        "use_sudo": False,
-        "container_runtime": "docker",
-        "max_snapshots": DEFAULT_MAX_SNAPSHOTS,
-        "retention_days": DEFAULT_RETENTION_DAYS
-    })
+def update_stateful_container(name, mutate):
+    with tracing.span('state.update'):
+        return get_state_store().update(name, mutate)
 
-def save_config(config):
-    save_json_file(CONFIG_PATH, config)
+def update_stateful_container_batch(names, mutate):
+    with tracing.span('state.update_many'):
+        return get_state_store().update_many(names, mutate)
+
+def delete_stateful_container(name):
+    with tracing.span('state.delete'):
+        return get_state_store().delete(name)
+
+# Layer lists and sizes of images, by image ID; see usage.py
+def load_image_usage():
+    with tracing.span('state.load_image_usage'):
+        return get_state_store().load_image_usage()
+
+def save_image_usage(usage, removed=()):
+    with tracing.span('state.save_image_usage'):
+        get_state_store().save_image_usage(usage, removed)
 
 # Container and Snapshot structures
 def create_container_entry(name, image, container_id):
@@ -61,3 +108,8 @@ def create_snapshot_entry(name, image_id):
         "image_id": image_id,
         "created_at": datetime.utcnow().isoformat()
     }
+
+def snapshot_image(entry):
+    # The image a snapshot starts from. A delta snapshot has none of its own: its
+    # image_id only names it, and base_image_id is the checkpoint its changes go on.
+    return entry.get('base_image_id') or entry['image_id']
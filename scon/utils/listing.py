@@ -0,0 +1,146 @@
+# scon/utils/listing.py
+
+import heapq
+import json
+import re
+import sys
+from datetime import datetime, timedelta
+from itertools import islice
+from scon.utils import endpoints, json_storage
+from scon.utils.state_store import record_status, snapshot_rows, newest_snapshot_at
+
+DURATION = re.compile(r'^(\d+)([smhdw])$')
+DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+def base_image(record):
+    containers = record.get('containers') or []
+    return containers[0].get('image') if containers else record.get('image')
+
+def current_container(record):
+    containers = record.get('containers') or []
+    return containers[-1] if containers else {}
+
+# Every field `scon list --fields` can project
+FIELDS = {
+    'name': lambda r: r['name'],
+    'status': record_status,
+    'image': base_image,
+    'container_id': lambda r: current_container(r).get('container_id'),
+    'created': lambda r: (r.get('containers') or [{}])[0].get('created_at'),
+    'next_snapshot': lambda r: (r.get('next_snapshot_to_start') or {}).get('image_id'),
+    'layer_depth': lambda r: (r.get('next_snapshot_to_start') or {}).get('layer_depth'),
+    'snapshots': lambda r: len(snapshot_rows(r)),
+    'tagged': lambda r: sum(row[3] for row in snapshot_rows(r)),
+    'last_snapshot': newest_snapshot_at,
+    'pending_commit': lambda r: bool(r.get('pending_commit')),
+    'warm': lambda r: bool(r.get('warm_container')),
+    'labels': lambda r: r.get('labels') or {},
+    'endpoint': endpoints.endpoint_of,
+    # What the SC's endpoint reports right now; only filled in by `scon list --live`
+    'live': lambda r: None,
+}
+DEFAULT_FIELDS = ['name', 'status', 'snapshots', 'last_snapshot', 'next_snapshot']
+# `live` value of SCs whose endpoint did not answer in time
+UNREACHABLE = 'unreachable'
+# Table column widths, fixed so rows can be printed as they arrive
+WIDTHS = {'name': 24, 'status': 9, 'image': 24, 'container_id': 14, 'created': 27, 'next_snapshot': 32,
+          'layer_depth': 6, 'snapshots': 9, 'tagged': 6, 'last_snapshot': 27, 'pending_commit': 8,
+          'warm': 5, 'labels': 24, 'endpoint': 12, 'live': 11}
+
+def parse_duration(value):
+    match = DURATION.match(value)
+    if not match:
+        raise ValueError(f"Invalid duration '{value}'. Use a number followed by s, m, h, d or w (e.g. 7d).")
+    return timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
+
+def default_fields(multi_host=False, live=False):
+    return DEFAULT_FIELDS + (['endpoint'] if multi_host or live else []) + (['live'] if live else [])
+
+def parse_fields(value, default=DEFAULT_FIELDS):
+    fields = [f.strip() for f in value.split(',') if f.strip()] if value else default
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(FIELDS)}.")
+    return fields
+
+def live_state(record, live_states):
+    # live_states: {endpoint: {container name: state}} of the endpoints that answered
+    states = live_states.get(endpoints.endpoint_of(record))
+    return UNREACHABLE if states is None else states.get(record['name'])
+
+def project(record, fields, live_states=None):
+    return {field: live_state(record, live_states) if field == 'live' and live_states is not None
+            else FIELDS[field](record) for field in fields}
+
+def sort_key(field, descending=False):
+    # Missing values sort last in either direction
+    def key(row):
+        value = row[field]
+        return ((value is None) != descending, value if value is not None else 0)
+    return key
+
+def format_cell(field, value):
+    if value is None:
+        return '-'
+    if isinstance(value, dict):
+        return ','.join(f"{k}={v}" for k, v in value.items()) or '-'
+    return str(value)
+
+def print_table(rows, fields, header=True):
+    last = fields[-1]
+    def line(cells):
+        return ' '.join(cell if f == last else cell[:WIDTHS[f]].ljust(WIDTHS[f]) for f, cell in zip(fields, cells))
+    if header:
+        print(line([f.upper() for f in fields]))
+    count = 0
+    for row in rows:
+        print(line([format_cell(f, row[f]) for f in fields]))
+        count += 1
+    return count
+
+def print_json_lines(rows):
+    count = 0
+    for row in rows:
+        sys.stdout.write(json.dumps(row) + '\n')
+        count += 1
+    return count
+
+def list_rows(patterns=None, status=None, tagged=None, older_than=None, newer_than=None, labels=None,
+              fields=None, sort=None, limit=None, offset=0, endpoint=None, live_states=None):
+    # Streams projected rows. Filters the store can evaluate are pushed into its scan;
+    # without --sort, reading stops as soon as offset + limit rows have been produced.
+    now = datetime.utcnow()
+    records = json_storage.scan_stateful_containers(
+        status=status, name_globs=patterns or None, tagged=tagged,
+        newest_before=(now - older_than).isoformat() if older_than else None,
+        newest_after=(now - newer_than).isoformat() if newer_than else None)
+    if labels:
+        records = (r for r in records if all((r.get('labels') or {}).get(k) == v for k, v in labels.items()))
+    if endpoint:
+        records = (r for r in records if endpoints.endpoint_of(r) == endpoint)
+
+    fields = fields or DEFAULT_FIELDS
+    if not sort:
+        rows = (project(r, fields, live_states) for r in records)
+        return islice(rows, offset, offset + limit if limit is not None else None)
+
+    descending = sort.startswith('-')
+    sort_field = sort.lstrip('-')
+    rows = (project(r, list(dict.fromkeys(fields + [sort_field])), live_states) for r in records)
+    key = sort_key(sort_field, descending)
+    if limit is not None:
+        # Only the top offset + limit rows are kept in memory
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        ordered = pick(offset + limit, rows, key=key)
+    else:
+        ordered = sorted(rows, key=key, reverse=descending)
+    return ({f: row[f] for f in fields} for row in ordered[offset:])
+
+def run_list(output_format='table', header=True, **options):
+    rows = list_rows(**options)
+    if output_format == 'jsonl':
+        return print_json_lines(rows)
+    count = print_table(rows, options.get('fields') or DEFAULT_FIELDS, header)
+    if count == 0 and header:
+        print("No stateful containers found.")
+    return count
@@ -0,0 +1,80 @@
+# scon/utils/locks.py
+#
+# Per-SC locks shared by every scon process on the host. The runtime work on an SC
+# (start, stop, commit, delete, ...) and the commit of its record run under the SC's
+# lock, so invocations on the same SC take turns while ones on different SCs run side
+# by side; the state store only takes its own short lock for the commit itself.
+
+import contextvars
+import fcntl
+import os
+import time
+from contextlib import ExitStack, contextmanager
+from scon.utils import json_storage, tracing
+
+LOCK_DIR = "locks"
+# Like COMMIT_WAIT_TIMEOUT: the holder may be in the middle of a multi-minute commit
+DEFAULT_LOCK_TIMEOUT = 3600
+POLL_INTERVAL = 0.1
+# SC locks held at once by update_many()
+LOCK_BATCH_SIZE = 64
+
+# Names of the SCs whose locks this context holds, so nested calls do not wait on themselves
+_held = contextvars.ContextVar('held_sc_locks', default=frozenset())
+
+def lock_path(name):
+    directory = json_storage.data_path(LOCK_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{name}.lock")
+
+def held(name):
+    return name in _held.get()
+
+def acquire(lock_file, name, timeout):
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+    except BlockingIOError:
+        if not timeout:
+            raise TimeoutError(f"Stateful container '{name}' is busy in another scon process.")
+    print(f"Waiting for another scon process working on '{name}'...")
+    deadline = time.monotonic() + timeout
+    with tracing.span('lock.wait', name=name):
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Gave up waiting for '{name}' after {timeout}s; "
+                                       "another scon process is still working on it.")
+                time.sleep(POLL_INTERVAL)
+
+@contextmanager
+def sc_lock(name, timeout=DEFAULT_LOCK_TIMEOUT):
+    # Holds the SC's lock for the block, waiting up to timeout seconds for it (0: not at
+    # all); raises TimeoutError if it stays busy. Reentrant within a context.
+    if held(name):
+        yield
+        return
+    with open(lock_path(name), 'a') as lock_file:
+        acquire(lock_file, name, timeout)
+        token = _held.set(_held.get() | {name})
+        try:
+            yield
+        finally:
+            _held.reset(token)
+        # Closing the file releases the lock
+
+def update_many(names, mutate):
+    # update_stateful_container_batch() under each SC's lock, a batch of SCs at a time
+    # and in name order, so two callers never wait on each other's half
+    names = sorted(set(names))
+    updated = []
+    for start in range(0, len(names), LOCK_BATCH_SIZE):
+        batch = names[start:start + LOCK_BATCH_SIZE]
+        with ExitStack() as stack:
+            for name in batch:
+                stack.enter_context(sc_lock(name))
+            updated += json_storage.update_stateful_container_batch(batch, mutate)
+    return updated
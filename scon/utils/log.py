@@ -0,0 +1,8 @@
+# scon/utils/log.py
+#
+# Timestamped lines for the long-running commands (watch, schedule run, serve)
+
+from datetime import datetime
+
+def log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
@@ -0,0 +1,165 @@
+# scon/utils/reconcile.py
+
+import re
+from scon.utils import endpoints, json_storage, locks
+from scon.utils.inventory import build_inventory, has_image
+from scon.utils.json_storage import snapshot_image
+
+CONTAINER_ID = re.compile(r'^[0-9a-f]{12,64}$')
+# Containers left behind by `scon stop` ('<sc>_stopped_<ts>') and delete ('<sc>_stopped')
+STOPPED_NAME = re.compile(r'^(?P<sc>.+)_stopped(?:_\d{14})?$')
+
+def unqueued_commit(record, queued_commits):
+    # The record's pending_commit if no queued or running job will commit it: a crash
+    # between saving a stop's record and queueing its commit leaves one behind
+    pending = record.get('pending_commit')
+    if pending and 'error' not in pending and (record['name'], pending['image']) not in queued_commits:
+        return pending
+    return None
+
+def check_container(record, inventories, queued_commits=frozenset(), repair=False, queue=None):
+    # Diffs one SC record against the inventory of its endpoint ({endpoint: inventory});
+    # with repair=True the record is fixed in place and unqueued commits are queued on
+    # queue. Returns a list of human-readable issues.
+    issues = []
+    name = record['name']
+    inventory = inventories[endpoints.endpoint_of(record)]
+    by_name, by_id = inventory['containers_by_name'], inventory['containers_by_id']
+    live = by_name.get(name)
+
+    # Bad or stale container IDs and statuses on the current container entry
+    for entry in record.get('containers', [])[-1:] + record.get('history', []):
+        container_id = entry.get('container_id')
+        if container_id and not CONTAINER_ID.match(container_id):
+            issues.append(f"bad container_id recorded: {container_id[:60]!r}")
+            if repair:
+                entry['container_id'] = None
+    current = (record.get('containers') or [None])[-1]
+    if current is not None:
+        recorded = by_id.get(current.get('container_id') or '') or (live if current.get('status') == 'running' else None)
+        actual = 'running' if recorded and recorded['state'] == 'running' else 'stopped'
+        if current.get('status') == 'running' and actual != 'running':
+            issues.append("recorded as running but no running container exists")
+            if repair:
+                current['status'] = 'stopped'
+        elif current.get('status') in ('stopped', 'created') and live and live['state'] == 'running':
+            issues.append(f"recorded as {current['status']} but container '{name}' is running")
+            if repair:
+                current['status'] = 'running'
+                current['container_id'] = live['id']
+
+    # Snapshot images that no longer exist; ones left on an endpoint that did not answer are not checked
+    def is_missing(entry, image):
+        entry_inventory = inventories.get(endpoints.snapshot_endpoint(record, entry))
+        return entry_inventory is not None and not has_image(entry_inventory, image)
+    missing = [snapshot_image(entry) for entry in record.get('snapshots', []) if is_missing(entry, snapshot_image(entry))]
+    missing += [entry['image'] for entry in record.get('history', []) if is_missing(entry, entry['image'])]
+    for image in missing:
+        issues.append(f"snapshot image missing: {image}")
+    next_snapshot = record.get('next_snapshot_to_start')
+    if next_snapshot and not has_image(inventory, snapshot_image(next_snapshot)) and snapshot_image(next_snapshot) not in missing:
+        issues.append(f"next_snapshot_to_start image missing: {snapshot_image(next_snapshot)}")
+    warm = record.get('warm_container')
+    if warm and warm['container_id'] not in by_id:
+        issues.append(f"warm container missing: {warm['name']}")
+    pending = record.get('pending_commit')
+    stranded = pending and pending['container'] not in by_name and (name, pending['image']) not in queued_commits
+    if stranded:
+        issues.append(f"pending commit's stopped container is gone: {pending['container']}")
+    elif unqueued_commit(record, queued_commits):
+        issues.append(f"pending commit was never queued: {pending['image']}")
+
+    if repair:
+        if missing:
+            record['snapshots'] = [e for e in record.get('snapshots', []) if not is_missing(e, snapshot_image(e))]
+            if 'history' in record:
+                record['history'] = [e for e in record['history'] if not is_missing(e, e['image'])]
+        if next_snapshot and not has_image(inventory, snapshot_image(next_snapshot)):
+            # Fall back to the newest snapshot that still exists
+            remaining = sorted(record.get('snapshots', []), key=lambda e: e.get('created_at') or '')
+            record['next_snapshot_to_start'] = remaining[-1] if remaining else None
+        if warm and warm['container_id'] not in by_id:
+            del record['warm_container']
+        if stranded:
+            del record['pending_commit']
+        elif unqueued_commit(record, queued_commits):
+            queue.enqueue(name, 'commit', pending)
+    return issues
+
+def orphaned_stopped_containers(containers, inventory):
+    # '<sc>_stopped*' containers that no snapshot or pending commit accounts for,
+    # i.e. state that was stopped but never committed
+    accounted = set()
+    for record in containers:
+        for entry in record.get('snapshots', []):
+            if entry.get('source_container'):
+                accounted.add(entry['source_container'])
+        if record.get('pending_commit'):
+            accounted.add(record['pending_commit']['container'])
+    known = {record['name'] for record in containers}
+    orphans = []
+    for container_name, container in inventory['containers_by_name'].items():
+        match = STOPPED_NAME.match(container_name)
+        if match and match.group('sc') in known and container_name not in accounted:
+            orphans.append((match.group('sc'), container_name, container['id']))
+    return sorted(orphans)
+
+def run_reconcile(get_runtime, config, repair=False):
+    # get_runtime() returns the runtime of the current endpoint scope. Every endpoint
+    # is read at once; SCs on one that does not answer in time are skipped this run.
+    def survey():
+        runtime = get_runtime()
+        runtime_containers = runtime.list_containers()
+        runtime_images = runtime.list_images()
+        if runtime_containers is None or runtime_images is None:
+            return None
+        return runtime_containers, runtime_images
+    surveyed, failures = endpoints.fan_out(survey, endpoints.endpoint_names(config), endpoints.endpoint_timeout(config))
+    endpoints.report_unreachable(failures)
+    if not surveyed:
+        print("Could not read the container and image inventory from the runtime.")
+        return None
+
+    inventories = {endpoint: build_inventory(*listed) for endpoint, listed in surveyed.items()}
+    all_containers = json_storage.load_stateful_containers()
+    containers = [record for record in all_containers if endpoints.endpoint_of(record) in inventories]
+    queue = json_storage.get_job_queue()
+    queued_commits = queue.queued_commits()
+
+    drifted = {}
+    for record in containers:
+        issues = check_container(record, inventories, queued_commits)
+        if issues:
+            drifted[record['name']] = issues
+    multi_host = endpoints.is_multi_host(config)
+    orphans = []
+    for endpoint, inventory in sorted(inventories.items()):
+        orphans += [(sc_name, container_name, container_id, endpoint) for sc_name, container_name, container_id
+                    in orphaned_stopped_containers(all_containers, inventory)]
+
+    for name, issues in drifted.items():
+        print(f"{name}:")
+        for issue in issues:
+            print(f"  - {issue}")
+    for sc_name, container_name, container_id, endpoint in orphans:
+        print(f"{sc_name}:")
+        print(f"  - orphaned stopped container with uncommitted state: {container_name} ({container_id[:12]})"
+              + (f" on '{endpoint}'" if multi_host else ''))
+
+    if repair and drifted:
+        locks.update_many(
+            set(drifted), lambda record: endpoints.endpoint_of(record) in inventories
+            and check_container(record, inventories, queued_commits, repair=True, queue=queue))
+    skipped = len(all_containers) - len(containers)
+    print(f"Checked {len(containers)} stateful containers against "
+          f"{sum(len(listed[0]) for listed in surveyed.values())} containers and "
+          f"{sum(len(listed[1]) for listed in surveyed.values())} images"
+          f"{f' on {len(surveyed)} endpoints' if multi_host else ''}: "
+          f"{len(drifted)} drifted{' (repaired)' if repair and drifted else ''}, "
+          f"{len(orphans)} orphaned stopped containers.")
+    if skipped:
+        print(f"Skipped {skipped} stateful containers on unreachable endpoints.")
+    if orphans:
+        print("Orphaned stopped containers are never removed automatically; "
+              "commit them or remove them with the runtime once you have checked them.")
+    return drifted, orphans
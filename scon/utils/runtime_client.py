@@ -0,0 +1,812 @@
+# scon/utils/runtime_client.py
+
+import contextvars
+import http.client
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote, urlencode
+from scon.utils import tracing
+
+DEFAULT_RUNTIME_API = "auto"
+API_TIMEOUT = 600
+MAX_IDLE_CONNECTIONS = 8
+CLI_BATCH_SIZE = 100
+# docker: "No such image: x:latest", podman: "Error: x: image not known"
+MISSING_IMAGE = re.compile(r'No such image: (\S+)|Error: (\S+): image not known')
+# Kind values of the changes endpoint, in `diff` notation
+CHANGE_KINDS = {0: 'C', 1: 'A', 2: 'D'}
+EXEC_POLL_INTERVAL = 0.1
+# How each CLI is pointed at a remote runtime
+HOST_FLAGS = {'docker': '-H', 'podman': '--url'}
+# Path segments after /containers/, /images/ or /exec/ that are endpoints, not IDs
+API_COLLECTION_ENDPOINTS = {'json', 'create', 'load', 'get', 'prune'}
+
+
+def split_image_reference(image):
+    # 'repo:tag' -> ('repo', 'tag'); a ':' inside a registry host:port is not a tag
+    repo, sep, tag = image.rpartition(':')
+    if sep and '/' not in tag:
+        return repo, tag
+    return image, 'latest'
+
+
+def tag_aliases(tag):
+    # The spellings a user may have used for one image tag ('x', 'x:latest', 'localhost/x:latest')
+    aliases = {tag}
+    for t in list(aliases):
+        if t.startswith('localhost/'):
+            aliases.add(t[len('localhost/'):])
+    for t in list(aliases):
+        if t.endswith(':latest'):
+            aliases.add(t[:-len(':latest')])
+    return aliases
+
+
+def batches(items, size=CLI_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def image_changes(config):
+    # Dockerfile instructions that carry an image's runtime config across export/import
+    config = config or {}
+    changes = []
+    if config.get('Entrypoint'):
+        changes.append(f"ENTRYPOINT {json.dumps(config['Entrypoint'])}")
+    if config.get('Cmd'):
+        changes.append(f"CMD {json.dumps(config['Cmd'])}")
+    for env in config.get('Env') or []:
+        changes.append(f"ENV {env.replace('=', ' ', 1)}")
+    if config.get('WorkingDir'):
+        changes.append(f"WORKDIR {config['WorkingDir']}")
+    if config.get('User'):
+        changes.append(f"USER {config['User']}")
+    return changes
+
+
+def mount_option(mount):
+    # `--mount` value for a volumes.mount_spec; a volume without a source is anonymous
+    fields = [f"type={mount['type']}"]
+    if mount.get('source'):
+        fields.append(f"source={mount['source']}")
+    fields.append(f"destination={mount['destination']}")
+    if mount.get('read_only'):
+        fields.append('readonly')
+    return ','.join(fields)
+
+
+def api_mount(mount):
+    # HostConfig.Mounts entry for a volumes.mount_spec
+    entry = {'Type': mount['type'], 'Target': mount['destination'], 'ReadOnly': bool(mount.get('read_only'))}
+    if mount.get('source'):
+        entry['Source'] = mount['source']
+    return entry
+
+
+def normalize_event(event):
+    # Docker ({Type, Action, Actor}) and Podman ({Type, Status, ID, Name}) event
+    # JSON reduced to the fields scon uses
+    actor = event.get('Actor') or {}
+    attributes = actor.get('Attributes') or event.get('Attributes') or {}
+    return {
+        'type': (event.get('Type') or event.get('type') or '').lower(),
+        'action': (event.get('Action') or event.get('Status') or event.get('status') or '').split(':')[0],
+        'id': actor.get('ID') or event.get('ID') or event.get('id') or '',
+        'name': (attributes.get('name') or event.get('Name') or '').lstrip('/'),
+        'old_name': (attributes.get('oldName') or '').lstrip('/'),
+        'image': attributes.get('image') or event.get('Image') or '',
+        'time': event.get('time') or event.get('Time'),
+    }
+
+
+def classic_image_store(info, version=None):
+    # Only docker's classic image store lets `load` leave out the layers it already has.
+    # The containerd image store reports its snapshotter as the driver type; Podman
+    # has no DriverStatus in its own `info` and names itself among the version's components.
+    if not info or 'DriverStatus' not in info:
+        return False
+    if any(key == 'driver-type' and 'containerd' in value for key, value in info['DriverStatus'] or []):
+        return False
+    return not any('podman' in (component.get('Name') or '').lower()
+                   for component in (version or {}).get('Components') or [])
+
+def cli_operation(args):
+    # Span name for a CLI call: the subcommand, plus the verb for `image`/`container` ones
+    words = args[:2] if args and args[0] in ('image', 'container') else args[:1]
+    return 'runtime.' + ' '.join(words)
+
+def api_operation(method, path):
+    # Span name for an API call, with container/image/exec IDs replaced by {id}
+    parts = path.split('?', 1)[0].split('/')
+    for i in range(1, len(parts)):
+        if parts[i - 1] in ('containers', 'images', 'exec') and parts[i] not in API_COLLECTION_ENDPOINTS:
+            parts[i] = '{id}'
+    return f"runtime.{method} {'/'.join(parts)}"
+
+def default_socket_path(runtime):
+    env_var = 'CONTAINER_HOST' if runtime == 'podman' else 'DOCKER_HOST'
+    host = os.environ.get(env_var, '')
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    if runtime == 'podman':
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        if runtime_dir and os.path.exists(os.path.join(runtime_dir, 'podman', 'podman.sock')):
+            return os.path.join(runtime_dir, 'podman', 'podman.sock')
+        return '/run/podman/podman.sock'
+    return '/var/run/docker.sock'
+
+
+class CliRuntime:
+    # Runs the docker/podman CLI directly (no shell) for every call
+
+    def __init__(self, runtime="docker", use_sudo=False, host=None):
+        self.runtime = runtime
+        self.use_sudo = use_sudo
+        # DOCKER_HOST-style URL of a runtime other than the local default
+        self.host = host
+
+    def _command(self, *args):
+        host = [HOST_FLAGS.get(self.runtime, '-H'), self.host] if self.host else []
+        return (['sudo'] if self.use_sudo else []) + [self.runtime] + host + list(args)
+
+    def _run(self, *args):
+        with tracing.span(cli_operation(args)) as span:
+            result = subprocess.run(self._command(*args), capture_output=True, text=True)
+            span['exit_code'] = result.returncode
+            span['bytes_read'] = len(result.stdout) + len(result.stderr)
+        return result
+
+    @contextmanager
+    def _stream(self, description, *args, write=False):
+        # Yields the stdout of a streaming command, or its stdin with write=True;
+        # raises OSError with the command's stderr if it fails
+        with tracing.span(cli_operation(args)) as span:
+            if write:
+                process = subprocess.Popen(self._command(*args), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                           stderr=subprocess.PIPE)
+                stream = process.stdin
+            else:
+                process = subprocess.Popen(self._command(*args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stream = process.stdout
+            try:
+                yield tracing.CountingStream(stream, span)
+            finally:
+                stream.close()
+                stderr = process.stderr.read().decode(errors='replace').strip()
+                process.wait()
+                span['exit_code'] = process.returncode
+        if process.returncode != 0:
+            raise OSError(f"{self.runtime} {description} failed: {stderr}")
+
+    def _check(self, *args):
+        # Output is captured so parallel callers can report a clean summary instead
+        result = self._run(*args)
+        if result.returncode != 0 and result.stderr.strip():
+            print(result.stderr.strip())
+        return result.returncode == 0
+
+    def container_id(self, name, running_only=False):
+        args = ['ps', '--no-trunc', '--filter', f'name=^{name}$', '--format', '{{.ID}} {{.Names}}']
+        if not running_only:
+            args.insert(1, '-a')
+        result = self._run(*args)
+        if result.returncode != 0:
+            return None
+        for line in result.stdout.splitlines():
+            container_id, _, names = line.partition(' ')
+            if name in names.split(','):
+                return container_id
+        return None
+
+    def stop(self, ref):
+        return self._check('stop', ref)
+
+    def rename(self, ref, new_name):
+        return self._check('rename', ref, new_name)
+
+    def commit(self, ref, image):
+        return self._check('commit', ref, image)
+
+    def remove_image(self, image):
+        return self._check('rmi', image)
+
+    def run_container(self, name, image, command):
+        result = self._run('run', '-d', '--name', name, image, *command)
+        if result.returncode != 0:
+            print(result.stderr.strip())
+            return None
+        return result.stdout.strip()
+
+    def create_container(self, name, image, command, mounts=None):
+        options = ['--name', name] if name else []
+        for mount in mounts or []:
+            options += ['--mount', mount_option(mount)]
+        result = self._run('create', *options, image, *command)
+        if result.returncode != 0:
+            print(result.stderr.strip())
+            return None
+        return result.stdout.strip()
+
+    def start_container(self, ref):
+        return self._check('start', ref)
+
+    def remove_container(self, ref):
+        return self._check('rm', '-f', ref)
+
+    def inspect_image(self, image):
+        result = self._run('image', 'inspect', image)
+        if result.returncode != 0:
+            return None
+        return json.loads(result.stdout)[0]
+
+    def layer_count(self, image):
+        info = self.inspect_image(image)
+        return len(info['RootFS']['Layers']) if info else None
+
+    def list_containers(self):
+        result = self._run('ps', '-a', '--no-trunc', '--format', '{{.ID}}\t{{.Names}}\t{{.Image}}\t{{.State}}')
+        if result.returncode != 0:
+            return None
+        containers = []
+        for line in result.stdout.splitlines():
+            container_id, names, image, state = (line.split('\t') + ['', '', ''])[:4]
+            containers.append({'id': container_id, 'names': names.split(','), 'image': image, 'state': state})
+        return containers
+
+    def list_images(self):
+        result = self._run('images', '--no-trunc', '--format', '{{.ID}}\t{{.Repository}}:{{.Tag}}')
+        if result.returncode != 0:
+            return None
+        images = {}
+        for line in result.stdout.splitlines():
+            image_id, tag = line.split('\t')
+            image = images.setdefault(image_id, {'id': image_id, 'tags': [], 'size': None})
+            if not tag.endswith('<none>'):
+                image['tags'].append(tag)
+        return list(images.values())
+
+    def inspect_images(self, refs):
+        # One `image inspect` per batch; returns {ref: info} for the refs that exist
+        found = {}
+        for batch in batches(refs):
+            result = self._run('image', 'inspect', *batch)
+            for info in json.loads(result.stdout or '[]'):
+                aliases = set().union(*[tag_aliases(t) for t in info.get('RepoTags') or []], {info['Id']})
+                for ref in batch:
+                    if ref in aliases:
+                        found[ref] = info
+        return found
+
+    def remove_images(self, refs):
+        # Returns the refs that are gone afterwards (removed now or already missing)
+        removed = set()
+        for batch in batches(refs):
+            result = self._run('rmi', *batch)
+            gone = set()
+            for line in result.stdout.splitlines():
+                if line.startswith('Untagged: '):
+                    gone |= tag_aliases(line[len('Untagged: '):].strip())
+            for line in result.stderr.splitlines():
+                missing = MISSING_IMAGE.search(line)
+                if missing:
+                    gone |= tag_aliases(missing.group(1) or missing.group(2))
+                elif line.strip():
+                    print(line.strip())
+            removed |= {ref for ref in batch if ref in gone or result.returncode == 0}
+        return removed
+
+    def remove_containers(self, refs):
+        removed = set()
+        for batch in batches(refs):
+            result = self._run('rm', '-f', *batch)
+            if result.returncode == 0:
+                removed.update(batch)
+                continue
+            # rm echoes each container it did remove
+            removed.update(set(result.stdout.split()) & set(batch))
+            if result.stderr.strip():
+                print(result.stderr.strip())
+        return removed
+
+    def flatten_image(self, image, target):
+        # export | import squashes the whole layer chain into a single layer
+        info = self.inspect_image(image)
+        container_id = self.create_container(None, image, []) if info else None
+        if not container_id:
+            return False
+        try:
+            changes = [arg for change in image_changes(info.get('Config')) for arg in ('--change', change)]
+            with tracing.span('runtime.export | import') as span:
+                export = subprocess.Popen(self._command('export', container_id), stdout=subprocess.PIPE)
+                result = subprocess.run(self._command('import', *changes, '-', target), stdin=export.stdout,
+                                        capture_output=True, text=True)
+                export.stdout.close()
+                export.wait()
+                span['exit_code'] = export.returncode or result.returncode
+        finally:
+            self._run('rm', '-f', container_id)
+        if result.returncode != 0 and result.stderr.strip():
+            print(result.stderr.strip())
+        return export.returncode == 0 and result.returncode == 0
+
+    def save_image(self, image):
+        # Yields the `save` tar stream as a readable file
+        return self._stream(f"save {image}", 'save', image)
+
+    def load_image(self):
+        # Yields a writable file whose contents are piped into `load`
+        return self._stream('load', 'load', write=True)
+
+    def load_skips_present_layers(self):
+        # Whether `load` accepts empty placeholders for layers the runtime already has
+        if self.runtime != 'docker':
+            return False
+        result = self._run('info', '--format', '{{json .}}')
+        if result.returncode != 0:
+            return False
+        return classic_image_store(json.loads(result.stdout or 'null'))
+
+    def list_mounts(self, ref):
+        result = self._run('container', 'inspect', '--format', '{{json .Mounts}}', ref)
+        if result.returncode != 0:
+            return None
+        return json.loads(result.stdout or 'null') or []
+
+    def container_changes(self, ref):
+        # [(kind, path)] from `diff`, kind being A(dded), C(hanged) or D(eleted)
+        result = self._run('diff', ref)
+        if result.returncode != 0:
+            return None
+        return [tuple(line.split(' ', 1)) for line in result.stdout.splitlines() if line.strip()]
+
+    def container_size(self, ref):
+        # Bytes in the container's writable layer
+        result = self._run('container', 'inspect', '--size', '--format', '{{.SizeRw}}', ref)
+        if result.returncode != 0 or not result.stdout.strip().isdigit():
+            return None
+        return int(result.stdout.strip())
+
+    def container_sizes(self, refs):
+        # {ref: bytes in its writable layer} from one `inspect --size` per batch; refs
+        # that no longer exist are left out
+        sizes = {}
+        for batch in batches(refs):
+            # A missing ref fails the command, but the others are still printed
+            result = self._run('container', 'inspect', '--size', '--format', '{{.Id}} {{.Name}} {{.SizeRw}}', *batch)
+            for line in result.stdout.splitlines():
+                parts = line.split()
+                if len(parts) != 3 or not parts[2].isdigit():
+                    continue
+                container_id, name, size = parts[0], parts[1].lstrip('/'), int(parts[2])
+                sizes.update((ref, size) for ref in batch if ref == name or container_id.startswith(ref))
+        return sizes
+
+    def exec_in(self, ref, command):
+        result = self._run('exec', ref, *command)
+        if result.returncode != 0:
+            print(result.stderr.strip())
+        return result.returncode == 0
+
+    def copy_from(self, ref, path):
+        # Tar stream of `path` inside the container, mounted volumes included
+        return self._stream(f"cp {ref}:{path}", 'cp', f"{ref}:{path}", '-')
+
+    def copy_to(self, ref, path):
+        # Yields a writable file for a tar stream that is extracted under `path`
+        return self._stream(f"cp to {ref}:{path}", 'cp', '-', f"{ref}:{path}", write=True)
+
+    def events(self, since=None, until=None):
+        # Yields normalized events; without `until` this follows the stream until closed
+        args = ['events', '--format', '{{json .}}']
+        if since is not None:
+            args += ['--since', str(since)]
+        if until is not None:
+            args += ['--until', str(until)]
+        process = subprocess.Popen(self._command(*args), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            for line in process.stdout:
+                if line.strip():
+                    yield normalize_event(json.loads(line))
+        finally:
+            process.kill()
+            process.wait()
+        if until is not None and process.returncode not in (0, -9):
+            raise OSError(f"{self.runtime} events exited with status {process.returncode}")
+
+    def close(self):
+        pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=API_TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class ApiRuntime:
+    # Talks to the Docker-compatible REST API (Docker and Podman both serve it)
+    # over the local unix socket, reusing keep-alive connections between calls.
+
+    def __init__(self, socket_path, runtime="docker"):
+        self.socket_path = socket_path
+        self.runtime = runtime
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return UnixHTTPConnection(self.socket_path)
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < MAX_IDLE_CONNECTIONS:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _send(self, conn, method, path, body):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+            tracing.add_bytes(written=len(body))
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def request(self, method, path, params=None, body=None):
+        with tracing.span(api_operation(method, path)) as span:
+            return self._request(span, method, path, params, body)
+
+    def _request(self, span, method, path, params, body):
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        conn = self._acquire()
+        try:
+            try:
+                response, data = self._send(conn, method, path, body)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The daemon closed an idle keep-alive connection; retry once on a fresh one
+                conn.close()
+                conn = UnixHTTPConnection(self.socket_path)
+                response, data = self._send(conn, method, path, body)
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        span['status'] = response.status
+        span['bytes_read'] = len(data)
+
+        payload = None
+        if data and 'json' in (response.getheader('Content-Type') or ''):
+            payload = json.loads(data)
+        if response.status >= 400:
+            message = payload.get('message', '') if isinstance(payload, dict) else data.decode(errors='replace')
+            raise ApiError(response.status, message.strip())
+        return response.status, payload
+
+    def _call(self, description, method, path, params=None, body=None, expected=(), quiet=False):
+        # request() with failures turned into a result, the way a CLI call fails:
+        # (error status, None) for an error reply and (None, None) if the runtime cannot be
+        # reached, printed unless quiet or the status is one of the expected ones
+        try:
+            return self.request(method, path, params, body)
+        except ApiError as e:
+            if not quiet and e.status not in expected:
+                print(f"Error from {self.runtime} ({description}): {e.message}")
+            return e.status, None
+        except (OSError, http.client.HTTPException) as e:
+            if not quiet:
+                print(f"Cannot connect to {self.runtime} at {self.socket_path} ({description}): {e}")
+            return None, None
+
+    def ping(self):
+        status, _ = self._call('ping', 'GET', '/_ping', quiet=True)
+        return status == 200
+
+    def container_id(self, name, running_only=False):
+        params = {'filters': json.dumps({'name': [f'^/?{name}$']})}
+        if not running_only:
+            params['all'] = '1'
+        _, containers = self._call('ps', 'GET', '/containers/json', params)
+        for container in containers or []:
+            if name in [n.lstrip('/') for n in container.get('Names', [])]:
+                return container['Id']
+        return None
+
+    def stop(self, ref):
+        status, _ = self._call('stop', 'POST', f'/containers/{quote(ref)}/stop')
+        # 304 means the container was already stopped
+        return status in (204, 304)
+
+    def rename(self, ref, new_name):
+        status, _ = self._call('rename', 'POST', f'/containers/{quote(ref)}/rename', {'name': new_name})
+        return status == 204
+
+    def commit(self, ref, image):
+        repo, tag = split_image_reference(image)
+        status, _ = self._call('commit', 'POST', '/commit', {'container': ref, 'repo': repo, 'tag': tag})
+        return status in (200, 201)
+
+    def remove_image(self, image):
+        status, _ = self._call('rmi', 'DELETE', f'/images/{quote(image)}')
+        return status == 200
+
+    def run_container(self, name, image, command):
+        container_id = self.create_container(name, image, command)
+        if container_id is None or not self.start_container(container_id):
+            return None
+        return container_id
+
+    def create_container(self, name, image, command, mounts=None):
+        body = {'Image': image}
+        if command:
+            body['Cmd'] = list(command)
+        if mounts:
+            body['HostConfig'] = {'Mounts': [api_mount(mount) for mount in mounts]}
+        status, created = self._call('create', 'POST', '/containers/create', {'name': name} if name else None, body)
+        if status != 201:
+            return None
+        return created['Id']
+
+    def start_container(self, ref):
+        status, _ = self._call('start', 'POST', f'/containers/{quote(ref)}/start')
+        return status in (204, 304)
+
+    def remove_container(self, ref):
+        status, _ = self._call('rm', 'DELETE', f'/containers/{quote(ref)}', {'force': '1'})
+        return status == 204
+
+    def inspect_image(self, image):
+        return self._call('inspect', 'GET', f'/images/{quote(image)}/json', quiet=True)[1]
+
+    def layer_count(self, image):
+        info = self.inspect_image(image)
+        return len(info['RootFS']['Layers']) if info else None
+
+    def list_containers(self):
+        _, containers = self._call('ps', 'GET', '/containers/json', {'all': '1'}, quiet=True)
+        if containers is None:
+            return None
+        return [{'id': c['Id'], 'names': [n.lstrip('/') for n in c.get('Names', [])],
+                 'image': c.get('Image'), 'state': c.get('State')} for c in containers]
+
+    def list_images(self):
+        _, images = self._call('images', 'GET', '/images/json', quiet=True)
+        if images is None:
+            return None
+        return [{'id': i['Id'], 'tags': [t for t in i.get('RepoTags') or [] if not t.endswith('<none>')],
+                 'size': i.get('Size')} for i in images]
+
+    def inspect_images(self, refs):
+        found = {}
+        for ref in refs:
+            info = self.inspect_image(ref)
+            if info:
+                found[ref] = info
+        return found
+
+    def remove_images(self, refs):
+        # One that is already gone counts as removed
+        return {ref for ref in refs
+                if self._call('rmi', 'DELETE', f'/images/{quote(ref)}', expected=(404,))[0] in (200, 404)}
+
+    def remove_containers(self, refs):
+        return {ref for ref in refs
+                if self._call('rm', 'DELETE', f'/containers/{quote(ref)}', {'force': '1'}, expected=(404,))[0]
+                in (204, 404)}
+
+    def flatten_image(self, image, target):
+        # Streams the container export straight into an image import without buffering
+        info = self.inspect_image(image)
+        container_id = self.create_container(None, image, []) if info else None
+        if not container_id:
+            return False
+        repo, tag = split_image_reference(target)
+        params = urlencode({'fromSrc': '-', 'repo': repo, 'tag': tag,
+                            'changes': image_changes(info.get('Config'))}, doseq=True)
+        export_conn = UnixHTTPConnection(self.socket_path)
+        import_conn = UnixHTTPConnection(self.socket_path)
+        try:
+            export_conn.request('GET', f'/containers/{container_id}/export')
+            export = export_conn.getresponse()
+            if export.status != 200:
+                print(f"Error from {self.runtime} (export): {export.read().decode(errors='replace').strip()}")
+                return False
+            import_conn.request('POST', f'/images/create?{params}', body=export,
+                                headers={'Content-Type': 'application/x-tar'}, encode_chunked=True)
+            response = import_conn.getresponse()
+            progress = response.read().decode(errors='replace')
+            # Import reports failures inside its JSON progress stream
+            errors = [json.loads(line).get('error') for line in progress.splitlines() if '"error"' in line]
+            if response.status != 200 or errors:
+                print(f"Error from {self.runtime} (import): {errors[0] if errors else progress.strip()}")
+                return False
+            return True
+        finally:
+            export_conn.close()
+            import_conn.close()
+            self.remove_container(container_id)
+
+    @contextmanager
+    def _download(self, path):
+        # Yields the response body of a streaming GET
+        conn = UnixHTTPConnection(self.socket_path)
+        with tracing.span(api_operation('GET', path)) as span:
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                span['status'] = response.status
+                if response.status != 200:
+                    raise ApiError(response.status, response.read().decode(errors='replace').strip())
+                yield tracing.CountingStream(response, span)
+            finally:
+                conn.close()
+
+    @contextmanager
+    def _upload(self, method, path):
+        # Yields (writer, result): what the caller writes goes through a pipe that a second
+        # thread streams as the request body; result holds the response once the block exits
+        read_fd, write_fd = os.pipe()
+        result = {}
+
+        def send():
+            conn = UnixHTTPConnection(self.socket_path)
+            try:
+                with os.fdopen(read_fd, 'rb') as body:
+                    conn.request(method, path, body=body, headers={'Content-Type': 'application/x-tar'},
+                                 encode_chunked=True)
+                response = conn.getresponse()
+                result['status'] = response.status
+                result['body'] = response.read().decode(errors='replace')
+            except (OSError, http.client.HTTPException) as e:
+                result['status'], result['body'] = None, str(e)
+            finally:
+                conn.close()
+
+        with tracing.span(api_operation(method, path)) as span:
+            sender = threading.Thread(target=send)
+            sender.start()
+            try:
+                with os.fdopen(write_fd, 'wb') as writer:
+                    yield tracing.CountingStream(writer, span), result
+            finally:
+                sender.join()
+                span['status'] = result.get('status')
+
+    def save_image(self, image):
+        return self._download(f"/images/get?{urlencode({'names': image})}")
+
+    @contextmanager
+    def load_image(self):
+        with self._upload('POST', '/images/load?quiet=1') as (writer, result):
+            yield writer
+        errors = [json.loads(line).get('error') for line in result['body'].splitlines() if '"error"' in line]
+        if result['status'] != 200 or errors:
+            raise ApiError(result['status'], errors[0] if errors else result['body'].strip())
+
+    def load_skips_present_layers(self):
+        # Whether `load` accepts empty placeholders for layers the runtime already has
+        if self.runtime != 'docker':
+            return False
+        _, info = self._call('info', 'GET', '/info', quiet=True)
+        _, version = self._call('version', 'GET', '/version', quiet=True)
+        return bool(info and version) and classic_image_store(info, version)
+
+    def list_mounts(self, ref):
+        _, info = self._call('inspect', 'GET', f'/containers/{quote(ref)}/json', quiet=True)
+        if info is None:
+            return None
+        return info.get('Mounts') or []
+
+    def container_changes(self, ref):
+        status, changes = self._call('diff', 'GET', f'/containers/{quote(ref)}/changes', quiet=True)
+        if status != 200:
+            return None
+        return [(CHANGE_KINDS[change['Kind']], change['Path']) for change in changes or []]
+
+    def container_size(self, ref):
+        _, info = self._call('inspect', 'GET', f'/containers/{quote(ref)}/json', {'size': '1'}, quiet=True)
+        if info is None:
+            return None
+        return info.get('SizeRw')
+
+    def container_sizes(self, refs):
+        # The API inspects one container at a time, so a few go at once over pooled connections
+        if not refs:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(refs), MAX_IDLE_CONNECTIONS)) as pool:
+            sizes = list(pool.map(lambda ref: contextvars.copy_context().run(self.container_size, ref), refs))
+        return {ref: size for ref, size in zip(refs, sizes) if size is not None}
+
+    def exec_in(self, ref, command):
+        status, created = self._call('exec', 'POST', f'/containers/{quote(ref)}/exec', body={'Cmd': list(command)})
+        if status != 201:
+            return False
+        status, _ = self._call('exec', 'POST', f"/exec/{created['Id']}/start", body={'Detach': True})
+        if status != 200:
+            return False
+        while True:
+            _, info = self._call('exec', 'GET', f"/exec/{created['Id']}/json")
+            if info is None:
+                return False
+            if not info.get('Running'):
+                return info.get('ExitCode') == 0
+            time.sleep(EXEC_POLL_INTERVAL)
+
+    def copy_from(self, ref, path):
+        # Tar stream of `path` inside the container, mounted volumes included
+        return self._download(f"/containers/{quote(ref)}/archive?{urlencode({'path': path})}")
+
+    @contextmanager
+    def copy_to(self, ref, path):
+        # Yields a writable file for a tar stream that is extracted under `path`
+        with self._upload('PUT', f"/containers/{quote(ref)}/archive?{urlencode({'path': path})}") as (writer, result):
+            yield writer
+        if result['status'] != 200:
+            raise ApiError(result['status'], result['body'].strip())
+
+    def events(self, since=None, until=None):
+        # The event stream holds its connection open, so it gets its own
+        params = {key: str(value) for key, value in (('since', since), ('until', until)) if value is not None}
+        conn = UnixHTTPConnection(self.socket_path, timeout=API_TIMEOUT if until is not None else None)
+        try:
+            conn.request('GET', f"/events?{urlencode(params)}" if params else '/events')
+            response = conn.getresponse()
+            if response.status != 200:
+                raise ApiError(response.status, response.read().decode(errors='replace').strip())
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield normalize_event(json.loads(line))
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def create_runtime(config, host=None):
+    # host is a DOCKER_HOST-style URL for a runtime other than the configured local one;
+    # only unix:// hosts can be reached over the API, the rest go through the CLI
+    runtime = config.get('container_runtime', 'docker')
+    mode = config.get('runtime_api', DEFAULT_RUNTIME_API)
+    socket_path = host[len('unix://'):] if host and host.startswith('unix://') else None
+    if mode != 'cli' and (socket_path or not host):
+        api = ApiRuntime(socket_path or config.get('runtime_socket') or default_socket_path(runtime), runtime)
+        if mode == 'api' or api.ping():
+            return api
+    return CliRuntime(runtime, config.get('use_sudo', False), host)
@@ -0,0 +1,301 @@
+# scon/utils/scheduler.py
+#
+# Periodic snapshots of running SCs, every snapshot_interval seconds of their record.
+# Each tick, the SCs that are due are ordered by how much their writable layer grew
+# since their last snapshot and committed a few at a time, within a budget of bytes
+# committed per window. Retention runs right after each commit, as for `scon snapshot`.
+# Writable layers are only measured when that decides anything: with a byte budget,
+# or with more SCs due than free commit slots.
+
+import contextvars
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from scon.utils import bulk, config_manager, container_manager, endpoints, json_storage, locks, tracing
+from scon.utils.garbage_collector import format_bytes
+from scon.utils.log import log
+
+DEFAULT_MAX_COMMITS = 2
+DEFAULT_WINDOW = 3600
+TICK_SECONDS = 5
+# A measured writable layer size is reused this long for an SC still waiting its turn
+SIZE_MAX_AGE = 60
+# An SC comes due up to this share of its interval late, depending on its name, so
+# SCs started together drift apart instead of all committing at once every interval
+STAGGER_FRACTION = 0.1
+INTERVAL_UNITS = (('w', 604800), ('d', 86400), ('h', 3600), ('m', 60), ('s', 1))
+
+def format_interval(seconds):
+    unit, size = next((unit, size) for unit, size in INTERVAL_UNITS if seconds % size == 0)
+    return f"{seconds // size}{unit}"
+
+def is_running(record):
+    return (record.get('containers') or [{}])[-1].get('status') == 'running'
+
+def last_snapshot_at(record):
+    # The newest snapshot, or the start of the current container if that came later
+    times = [entry['created_at'] for entry in record.get('snapshots', []) if entry.get('created_at')]
+    started_at = (record.get('containers') or [{}])[-1].get('created_at')
+    times += [started_at] if started_at else []
+    return datetime.fromisoformat(max(times)) if times else None
+
+def due_at(record):
+    # When the next scheduled snapshot of a running SC is due, or None
+    interval = record.get('snapshot_interval')
+    last = last_snapshot_at(record)
+    if not interval or not is_running(record) or last is None:
+        return None
+    stagger = zlib.crc32(record['name'].encode()) % 1000 / 1000 * interval * STAGGER_FRACTION
+    return last + timedelta(seconds=interval + stagger)
+
+def is_due(record, now):
+    due = due_at(record)
+    return due is not None and due <= now
+
+def size_ref(record):
+    return record['containers'][-1].get('container_id') or record['name']
+
+def layer_growth(record, size):
+    # Bytes the writable layer grew since the last snapshot taken of the same container
+    container_id = record['containers'][-1].get('container_id')
+    previous = next((entry.get('rw_bytes') for entry in reversed(record.get('snapshots', []))
+                     if entry.get('container_id') == container_id and entry.get('rw_bytes') is not None), 0)
+    return max(0, size - previous)
+
+
+class ByteBudget:
+    # Bytes committed over the last `window` seconds, capped at `limit` (0: no cap). One
+    # commit is always let through in an empty window, so a large SC is never starved.
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._spent = deque()
+
+    def used(self, now):
+        while self._spent and self._spent[0][0] <= now - self.window:
+            self._spent.popleft()
+        return sum(size for _, size in self._spent)
+
+    def allows(self, size, now):
+        used = self.used(now)
+        return not self.limit or not used or used + size <= self.limit
+
+    def charge(self, size, now):
+        self._spent.append((now, size))
+
+
+class Scheduler:
+
+    def __init__(self, max_commits=DEFAULT_MAX_COMMITS, byte_budget=0, window=DEFAULT_WINDOW,
+                 endpoint_timeout=endpoints.DEFAULT_ENDPOINT_TIMEOUT):
+        self.max_commits = max_commits
+        self.budget = ByteBudget(byte_budget, window)
+        self.endpoint_timeout = endpoint_timeout
+        # {container ref: (monotonic time, writable layer bytes)}
+        self._sizes = {}
+        self.pool = ThreadPoolExecutor(max_workers=max_commits)
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._deferred = 0
+        # Commits run in a copy of this context, so `scon --trace schedule run` traces them
+        self._context = contextvars.copy_context()
+
+    @classmethod
+    def from_config(cls, config, max_commits=None):
+        return cls(max_commits or config.get('schedule_max_commits', DEFAULT_MAX_COMMITS),
+                   config.get('schedule_byte_budget', 0), config.get('schedule_window', DEFAULT_WINDOW),
+                   endpoints.endpoint_timeout(config))
+
+    def measure(self, records):
+        # {container ref: writable layer bytes} of records, from the cache or one batched
+        # inspect per endpoint, all endpoints at once; ones that could not be measured are left out
+        now = time.monotonic()
+        self._sizes = {ref: cached for ref, cached in self._sizes.items() if now - cached[0] < SIZE_MAX_AGE}
+        sizes, wanted = {}, {}
+        for record in records:
+            ref = size_ref(record)
+            if ref in self._sizes:
+                sizes[ref] = self._sizes[ref][1]
+            else:
+                wanted.setdefault(endpoints.endpoint_of(record), []).append(ref)
+        if wanted:
+            def work():
+                return container_manager.get_runtime().container_sizes(wanted[endpoints.current()])
+            results, failures = endpoints.fan_out(work, list(wanted), self.endpoint_timeout)
+            for name, reason in failures.items():
+                log(f"Could not measure due SCs on endpoint '{name}': {reason}")
+            for measured in results.values():
+                sizes.update(measured)
+                self._sizes.update((ref, (now, size)) for ref, size in measured.items())
+        return sizes
+
+    def tick(self):
+        # Starts the commits of due SCs that fit the free slots and the budget; returns how many
+        with self._lock:
+            free = self.max_commits - len(self._in_flight)
+            in_flight = set(self._in_flight)
+        if free <= 0:
+            return 0
+        now = datetime.utcnow()
+        due = [record for record in json_storage.scan_stateful_containers(status='running')
+               if record['name'] not in in_flight and is_due(record, now)]
+        if not due:
+            return 0
+
+        if self.budget.limit or len(due) > free:
+            sizes = self.measure(due)
+            candidates = [(layer_growth(record, sizes[size_ref(record)]), sizes[size_ref(record)], record)
+                          for record in due if size_ref(record) in sizes]
+        else:
+            candidates = [(None, None, record) for record in due]
+        # Most grown first; among equals, the one that has waited longest
+        candidates.sort(key=lambda item: (-(item[0] or 0), due_at(item[2])))
+
+        started = 0
+        monotonic_now = time.monotonic()
+        for growth, size, record in candidates:
+            if started == free:
+                break
+            if size is not None:
+                if not self.budget.allows(size, monotonic_now):
+                    continue
+                self.budget.charge(size, monotonic_now)
+                self._sizes.pop(size_ref(record), None)
+            with self._lock:
+                self._in_flight.add(record['name'])
+            self.pool.submit(self._context.copy().run, self._commit, record['name'], size, growth)
+            started += 1
+        deferred = len(candidates) - started
+        if deferred and deferred != self._deferred:
+            log(f"{deferred} due snapshot(s) deferred (commit slots or byte budget of "
+                f"{format_bytes(self.budget.limit)} per {format_interval(self.budget.window)} in use)"
+                if self.budget.limit else f"{deferred} due snapshot(s) deferred (all commit slots in use)")
+        self._deferred = deferred
+        return started
+
+    def _commit(self, name, size, growth):
+        try:
+            with tracing.sc_scope(name), tracing.span('sc.scheduled-snapshot', bytes=size) as span:
+                outcome = snapshot_due(name, size)
+                span['exit_code'] = 1 if outcome and not outcome[0] else 0
+            if outcome:
+                log(outcome[1] + (f" ({format_bytes(growth)} written since the last snapshot)"
+                                  if growth is not None else ''))
+        except Exception as e:
+            log(f"Scheduled snapshot of '{name}' failed: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(name)
+        # A scheduler runs for days; `scon stats` should not have to wait for it to exit
+        tracing.flush()
+
+    def describe(self):
+        budget = f", {format_bytes(self.budget.limit)} per {format_interval(self.budget.window)}" \
+            if self.budget.limit else ''
+        return f"up to {self.max_commits} concurrent commits{budget}"
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+def snapshot_due(name, size):
+    # (ok, message), or None if the SC is no longer due or is busy in another scon
+    # process; it is looked at again next tick either way. size is None if not measured.
+    try:
+        with locks.sc_lock(name, timeout=0):
+            record = json_storage.get_stateful_container(name)
+            if record is None or not is_due(record, datetime.utcnow()):
+                return None
+            with endpoints.scope(endpoints.endpoint_of(record)):
+                ok, message = container_manager.snapshot_stateful_container(
+                    record, **({'rw_bytes': size} if size is not None else {}))
+            if ok:
+                json_storage.save_stateful_container(record)
+            return ok, message
+    except TimeoutError:
+        return None
+
+def run_loop(scheduler, stop=None):
+    # Ticks until stop (a threading.Event) is set
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            scheduler.tick()
+        except Exception as e:
+            log(f"Snapshot scheduling failed: {e}")
+        stop.wait(TICK_SECONDS)
+
+def start_background(config):
+    # For `scon watch --schedule` and `scon serve --schedule`; returns (scheduler, stop event)
+    scheduler = Scheduler.from_config(config)
+    stop = threading.Event()
+    threading.Thread(target=contextvars.copy_context().run, args=(run_loop, scheduler, stop), daemon=True).start()
+    log(f"Scheduling snapshots ({scheduler.describe()})")
+    return scheduler, stop
+
+def stop_background(scheduler, stop):
+    stop.set()
+    scheduler.close()
+
+def run_schedule(once=False, max_commits=None):
+    config = config_manager.load_config()
+    scheduler = Scheduler.from_config(config, max_commits)
+    if once:
+        # One pass, for cron and CI: commit what is due now and wait for it
+        started = scheduler.tick()
+        scheduler.close()
+        print(f"Started {started} scheduled snapshot(s).")
+        return
+    log(f"Scheduling snapshots ({scheduler.describe()})")
+    try:
+        run_loop(scheduler)
+    except KeyboardInterrupt:
+        log("Stopping; waiting for in-flight snapshot commits")
+    finally:
+        scheduler.close()
+
+def set_interval(names, interval, select_all=False, labels=None):
+    # interval in seconds, or None to stop scheduling snapshots
+    records, missing = bulk.select_containers(names, select_all, labels)
+    for name in missing:
+        print(f"Stateful container '{name}' not found.")
+    if not records:
+        if not missing:
+            print("No stateful containers matched.")
+        return []
+
+    def mutate(record):
+        if interval:
+            record['snapshot_interval'] = interval
+        else:
+            record.pop('snapshot_interval', None)
+    updated = locks.update_many([record['name'] for record in records], mutate)
+    if interval:
+        print(f"Scheduled a snapshot every {format_interval(interval)} for {len(updated)} stateful container(s).")
+    else:
+        print(f"Stopped scheduled snapshots of {len(updated)} stateful container(s).")
+    return updated
+
+def list_schedules():
+    now = datetime.utcnow()
+    rows = [record for record in json_storage.load_stateful_containers() if record.get('snapshot_interval')]
+    if not rows:
+        print("No stateful containers have scheduled snapshots.")
+        return
+    print(f"{'NAME':<24} {'EVERY':<7} {'LAST_SNAPSHOT':<27} NEXT")
+    for record in rows:
+        last = last_snapshot_at(record)
+        due = due_at(record)
+        if due is None:
+            next_snapshot = 'not running'
+        elif due <= now:
+            next_snapshot = 'due'
+        else:
+            seconds = int((due - now).total_seconds()) + 1
+            next_snapshot = f"in {seconds}s" if seconds < 60 else f"in {round(seconds / 60)}m"
+        print(f"{record['name']:<24} {format_interval(record['snapshot_interval']):<7} "
+              f"{last.isoformat() if last else '-':<27} {next_snapshot}")
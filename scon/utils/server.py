@@ -0,0 +1,222 @@
+# scon/utils/server.py
+
+import contextvars
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from scon import cli
+from scon.utils import config_manager, container_manager, daemon, endpoints, json_storage, runtime_client, tracing
+
+EVENT_RETRY_DELAY = 5
+
+# Where print() output of the request running in this context goes
+_client_output = contextvars.ContextVar('client_output', default=None)
+# Endpoints whose events a follow_events() thread is applying to the inventory
+_followed = set()
+_followed_lock = threading.Lock()
+
+
+class ContextStream:
+    # Stands in for sys.stdout/sys.stderr: writes from a request (and the worker
+    # threads it fans out to) go to that request's client, everything else to the log
+
+    def __init__(self, default, key):
+        self.default = default
+        self.key = key
+
+    def write(self, text):
+        client = _client_output.get()
+        if client is None:
+            return self.default.write(text)
+        client.send({self.key: text})
+        return len(text)
+
+    def flush(self):
+        if _client_output.get() is None:
+            self.default.flush()
+
+    def __getattr__(self, attribute):
+        return getattr(self.default, attribute)
+
+
+class ClientConnection:
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            try:
+                self.wfile.write(json.dumps(message).encode() + b'\n')
+                self.wfile.flush()
+            except OSError:
+                # The client went away; let the command finish regardless
+                pass
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        client = ClientConnection(self.wfile)
+        exit_code = contextvars.copy_context().run(self.server.run_command, request['argv'], client,
+                                                   request.get('trace'))
+        client.send({'exit': exit_code})
+        tracing.flush()
+
+
+class SettingsLock:
+    # Commands share it; a `scon config` change takes it alone, since it swaps the
+    # runtimes and state store every other command is using. Commands on SCs keep
+    # out of each other's way through the SC locks, as separate processes do.
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sharers = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            # A waiting config change goes first, so a stream of commands cannot starve it
+            self._condition.wait_for(lambda: not self._exclusive and not self._waiting)
+            self._sharers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._sharers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._waiting += 1
+            self._condition.wait_for(lambda: not self._exclusive and not self._sharers)
+            self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Keeps config, state store and runtime inventory loaded between commands and
+    # runs them side by side
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, RequestHandler)
+        self.settings_lock = SettingsLock()
+        self.config_stamp = config_manager.config_stamp(config_manager.config_path())
+
+    def settings_changed(self):
+        # Settings may pick a different runtime or state backend; called holding the lock exclusively
+        self.config_stamp = config_manager.config_stamp(config_manager.config_path())
+        container_manager.reset_runtime()
+        json_storage.reset_stores()
+        follow_endpoints()
+
+    def run_command(self, argv, client, trace_path=None):
+        _client_output.set(client)
+        if trace_path:
+            tracing.enable(trace_path)
+        positional = tuple(arg for arg in argv if not arg.startswith('-'))
+        try:
+            # The config file may also have been edited by hand or by scon running without the daemon
+            if config_manager.config_stamp(config_manager.config_path()) != self.config_stamp:
+                with self.settings_lock.exclusive():
+                    self.settings_changed()
+            if positional[:1] != ('config',) or positional[:2] == ('config', 'show'):
+                with self.settings_lock.shared():
+                    return cli.run(argv)
+            with self.settings_lock.exclusive():
+                exit_code = cli.run(argv)
+                self.settings_changed()
+                return exit_code
+        except Exception:
+            print(traceback.format_exc(), end='', file=sys.stderr)
+            return 1
+
+
+def follow_endpoints():
+    # One event follower per configured endpoint; called again after config changes
+    with _followed_lock:
+        for endpoint in endpoints.endpoint_names(config_manager.load_config()):
+            if endpoint not in _followed:
+                _followed.add(endpoint)
+                threading.Thread(target=follow_events, args=(endpoint,), daemon=True).start()
+
+def follow_events(endpoint=endpoints.LOCAL):
+    # Keeps one endpoint's in-memory runtime inventory current for as long as the daemon
+    # runs, or until the endpoint is removed from the configuration
+    while True:
+        try:
+            runtime = container_manager.get_runtime(endpoint)
+        except ValueError:
+            with _followed_lock:
+                _followed.discard(endpoint)
+            return
+        try:
+            for event in runtime.events():
+                runtime.inventory.apply_event(event)
+                if runtime is not container_manager.get_runtime(endpoint):
+                    break
+        except (OSError, ValueError, runtime_client.ApiError) as e:
+            print(f"Runtime event stream error: {e}")
+        # Events may have been missed while disconnected
+        runtime.inventory.invalidate()
+        time.sleep(EVENT_RETRY_DELAY)
+
+
+def serve(path=None, schedule=False):
+    path = path or daemon.socket_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            print(f"A scon daemon is already listening on {path}.")
+            return
+        except OSError:
+            os.unlink(path)
+        finally:
+            probe.close()
+
+    # Bound owner-only from the start; a chmod after bind() leaves a window where anyone can connect
+    umask = os.umask(0o177)
+    try:
+        server = DaemonServer(path)
+    finally:
+        os.umask(umask)
+    sys.stdout = ContextStream(sys.stdout, 'out')
+    sys.stderr = ContextStream(sys.stderr, 'err')
+    follow_endpoints()
+    scheduled = None
+    if schedule:
+        from scon.utils import scheduler
+        scheduled = scheduler.start_background(config_manager.load_config())
+    print(f"scon daemon listening on {path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping scon daemon.")
+    finally:
+        server.server_close()
+        os.unlink(path)
+        if scheduled:
+            scheduler.stop_background(*scheduled)
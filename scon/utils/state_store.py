@@ -0,0 +1,836 @@
+# scon/utils/state_store.py
+
+import fcntl
+import fnmatch
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from scon.utils import tracing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stateful_containers (
+    name TEXT PRIMARY KEY,
+    status TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sc_status ON stateful_containers(status);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    sc_name TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    created_at TEXT,
+    tagged INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sc_name, image_id)
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_created_at ON snapshots(created_at);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS image_usage (
+    image_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+SCAN_BATCH_SIZE = 500
+# The journal is folded into a new checkpoint once it grows past this
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+
+
+class StaleRecordError(Exception):
+    # Every stored record carries a 'version' that each write increments. put() and
+    # put_many() of a record read from the store only succeed while that is still the
+    # stored version; a record without one (a new SC) is written as it is.
+
+    def __init__(self, names):
+        super().__init__(f"Changed by another writer since it was read: {', '.join(names)}")
+        self.names = list(names)
+
+
+def stale_names(records, stored_version):
+    # stored_version(name) -> the version in the store, or None if there is no such record
+    return [record['name'] for record in records
+            if 'version' in record and stored_version(record['name']) != record['version']]
+
+
+def record_status(record):
+    # The status of an SC is the status of its most recent container
+    containers = record.get('containers') or []
+    if containers:
+        return containers[-1].get('status')
+    return None
+
+
+def snapshot_rows(record):
+    # Index both the current 'snapshots' layout and the legacy 'history' layout
+    rows = {}
+    for entry in record.get('snapshots', []):
+        rows[entry['image_id']] = (entry.get('created_at'), entry.get('tagged', False))
+    for entry in record.get('history', []):
+        rows.setdefault(entry['image'], (entry.get('timestamp'), entry.get('tagged', False)))
+    return [(record['name'], image_id, created_at, int(bool(tagged)))
+            for image_id, (created_at, tagged) in rows.items()]
+
+
+def newest_snapshot_at(record):
+    times = [row[2] for row in snapshot_rows(record) if row[2]]
+    return max(times) if times else None
+
+
+def read_image_usage(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def write_image_usage(path, usage, removed):
+    # Merged into the file; the file backends call this under their lock file
+    cached = read_image_usage(path)
+    cached.update(usage)
+    for image_id in removed:
+        cached.pop(image_id, None)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(cached, file, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def sqlite_glob(pattern):
+    # The SQLite GLOB matching what fnmatch.fnmatchcase(name, pattern) matches, or None if
+    # GLOB cannot say it. fnmatch negates a set with '!' and GLOB with '^'; an unclosed
+    # '[' is a literal to fnmatch but matches nothing in GLOB.
+    result, i = [], 0
+    while i < len(pattern):
+        if pattern[i] != '[':
+            result.append(pattern[i])
+            i += 1
+            continue
+        # As in fnmatch, a set runs to the first ']' after an optional '!' and a ']' right after it
+        end = i + 1
+        if pattern[end:end + 1] == '!':
+            end += 1
+        if pattern[end:end + 1] == ']':
+            end += 1
+        end = pattern.find(']', end)
+        if end < 0:
+            result.append('[[]')
+            i += 1
+            continue
+        members = pattern[i + 1:end]
+        if members.startswith('^'):
+            # A literal '^' to fnmatch, a negation to GLOB
+            return None
+        result.append('[' + ('^' + members[1:] if members.startswith('!') else members) + ']')
+        i = end + 1
+    return ''.join(result)
+
+def scan_matches(record, status=None, name_globs=None, tagged=None, newest_before=None, newest_after=None):
+    # Python side of scan(); SqliteStateStore evaluates the same filters in SQL
+    if status is not None and record_status(record) != status:
+        return False
+    if name_globs and not any(fnmatch.fnmatchcase(record['name'], g) for g in name_globs):
+        return False
+    if tagged is not None and any(row[3] for row in snapshot_rows(record)) != tagged:
+        return False
+    if newest_before is not None or newest_after is not None:
+        newest = newest_snapshot_at(record)
+        if newest is None or (newest_before is not None and newest >= newest_before) \
+                or (newest_after is not None and newest < newest_after):
+            return False
+    return True
+
+
+class JsonStateStore:
+    # Whole-file backend, kept for users who set state_backend to 'json'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        # Writers in other processes read-modify-write the same file
+        self._lock_file = open(f"{path}.lock", 'a')
+        # Cached image usage lives next to the records, which are a plain list
+        self.image_usage_path = f"{path}.image-usage"
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as file:
+            tracing.add_bytes(read=os.fstat(file.fileno()).st_size)
+            containers = json.load(file)
+        for record in containers:
+            record.setdefault('version', 0)
+        return containers
+
+    def _write(self, containers):
+        # Write-then-rename so a crash mid-write leaves the previous file intact
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(containers, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+            tracing.add_bytes(written=file.tell())
+        os.replace(tmp_path, self.path)
+
+    def load_all(self):
+        return self._read()
+
+    def replace_all(self, containers):
+        with self._locked():
+            versions = {c['name']: c['version'] for c in self._read()}
+            self._write([dict(record, version=versions.get(record['name'], 0) + 1) for record in containers])
+
+    def names(self):
+        return [c['name'] for c in self._read()]
+
+    def get(self, name):
+        return next((c for c in self._read() if c['name'] == name), None)
+
+    def put(self, record):
+        self.put_many([record])
+
+    def put_many(self, records):
+        with self._locked():
+            containers = self._read()
+            index = {c['name']: i for i, c in enumerate(containers)}
+            stale = stale_names(records, lambda name: containers[index[name]]['version'] if name in index else None)
+            if stale:
+                raise StaleRecordError(stale)
+            stored = []
+            for record in records:
+                if record['name'] in index:
+                    stored.append(dict(record, version=containers[index[record['name']]]['version'] + 1))
+                    containers[index[record['name']]] = stored[-1]
+                else:
+                    stored.append(dict(record, version=1))
+                    index[record['name']] = len(containers)
+                    containers.append(stored[-1])
+            self._write(containers)
+        for record, written in zip(records, stored):
+            record['version'] = written['version']
+
+    def update(self, name, mutate):
+        with self._locked():
+            containers = self._read()
+            record = next((c for c in containers if c['name'] == name), None)
+            if record is None:
+                return None
+            mutate(record)
+            record['version'] += 1
+            self._write(containers)
+            return record
+
+    def update_many(self, names, mutate):
+        with self._locked():
+            containers = self._read()
+            updated = [c for c in containers if c['name'] in names]
+            for record in updated:
+                mutate(record)
+                record['version'] += 1
+            if updated:
+                self._write(containers)
+            return updated
+
+    def delete(self, name):
+        with self._locked():
+            containers = self._read()
+            remaining = [c for c in containers if c['name'] != name]
+            if len(remaining) == len(containers):
+                return False
+            self._write(remaining)
+            return True
+
+    def find_by_status(self, status):
+        return [c for c in self._read() if record_status(c) == status]
+
+    def scan(self, **filters):
+        with tracing.span('state.scan'):
+            records = self._read()
+        for record in records:
+            if scan_matches(record, **filters):
+                yield record
+
+    def snapshots_older_than(self, timestamp):
+        rows = []
+        for c in self._read():
+            rows.extend(r for r in snapshot_rows(c) if r[2] and r[2] < timestamp)
+        return rows
+
+    def load_image_usage(self):
+        with self._locked():
+            return read_image_usage(self.image_usage_path)
+
+    def save_image_usage(self, usage, removed=()):
+        with self._locked():
+            write_image_usage(self.image_usage_path, usage, removed)
+
+    def close(self):
+        self._lock_file.close()
+
+
+class SqliteStateStore:
+    # One row per SC; snapshots are mirrored into an indexed side table so that
+    # status and age queries do not have to decode every record.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _begin(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def _stored_version(self, name):
+        row = self._conn.execute("SELECT version FROM stateful_containers WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _write_record(self, record):
+        # Caller holds the write transaction; returns the version written
+        version = (self._stored_version(record['name']) or 0) + 1
+        data = json.dumps(dict(record, version=version), separators=(',', ':'))
+        tracing.add_bytes(written=len(data))
+        self._conn.execute(
+            "INSERT INTO stateful_containers (name, status, version, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET status = excluded.status, "
+            "version = excluded.version, data = excluded.data",
+            (record['name'], record_status(record), version, data))
+        self._conn.execute("DELETE FROM snapshots WHERE sc_name = ?", (record['name'],))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO snapshots (sc_name, image_id, created_at, tagged) VALUES (?, ?, ?, ?)",
+            snapshot_rows(record))
+        return version
+
+    def _transaction(self, work):
+        with self._lock:
+            self._begin()
+            try:
+                result = work()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _decode(self, version, data):
+        # The version column is authoritative: rows written by older releases have it only there
+        record = json.loads(data)
+        record['version'] = version
+        return record
+
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT version, data FROM stateful_containers ORDER BY rowid").fetchall()
+        tracing.add_bytes(read=sum(len(data) for _, data in rows))
+        return [self._decode(*row) for row in rows]
+
+    def replace_all(self, containers):
+        def work():
+            names = {c['name'] for c in containers}
+            existing = [n for (n,) in self._conn.execute("SELECT name FROM stateful_containers")]
+            for name in existing:
+                if name not in names:
+                    self._delete_row(name)
+            for record in containers:
+                self._write_record(record)
+        self._transaction(work)
+
+    def names(self):
+        with self._lock:
+            return [n for (n,) in self._conn.execute("SELECT name FROM stateful_containers ORDER BY rowid")]
+
+    def get(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT version, data FROM stateful_containers WHERE name = ?",
+                                     (name,)).fetchone()
+        if row is None:
+            return None
+        tracing.add_bytes(read=len(row[1]))
+        return self._decode(*row)
+
+    def put(self, record):
+        self.put_many([record])
+
+    def put_many(self, records):
+        def work():
+            stale = stale_names(records, self._stored_version)
+            if stale:
+                raise StaleRecordError(stale)
+            return [self._write_record(record) for record in records]
+        for record, version in zip(records, self._transaction(work)):
+            record['version'] = version
+
+    def update(self, name, mutate):
+        # Read-modify-write of a single record inside one write transaction
+        def work():
+            row = self._conn.execute("SELECT version, data FROM stateful_containers WHERE name = ?",
+                                     (name,)).fetchone()
+            if row is None:
+                return None
+            tracing.add_bytes(read=len(row[1]))
+            record = self._decode(*row)
+            mutate(record)
+            record['version'] = self._write_record(record)
+            return record
+        return self._transaction(work)
+
+    def update_many(self, names, mutate):
+        # Same as update() for many records, all in one transaction
+        def work():
+            updated = []
+            for name in names:
+                row = self._conn.execute("SELECT version, data FROM stateful_containers WHERE name = ?",
+                                         (name,)).fetchone()
+                if row is None:
+                    continue
+                tracing.add_bytes(read=len(row[1]))
+                record = self._decode(*row)
+                mutate(record)
+                record['version'] = self._write_record(record)
+                updated.append(record)
+            return updated
+        return self._transaction(work)
+
+    def _delete_row(self, name):
+        self._conn.execute("DELETE FROM snapshots WHERE sc_name = ?", (name,))
+        return self._conn.execute("DELETE FROM stateful_containers WHERE name = ?", (name,)).rowcount > 0
+
+    def delete(self, name):
+        return self._transaction(lambda: self._delete_row(name))
+
+    def find_by_status(self, status):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, data FROM stateful_containers WHERE status = ? ORDER BY rowid", (status,)).fetchall()
+        return [self._decode(*row) for row in rows]
+
+    def scan(self, status=None, name_globs=None, tagged=None, newest_before=None, newest_after=None,
+             batch_size=SCAN_BATCH_SIZE):
+        # Yields matching records in creation order, fetching a batch at a time so
+        # callers that stop early never decode the rest
+        where, params = [], []
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        globs = [sqlite_glob(pattern) for pattern in name_globs or []]
+        if globs and None not in globs:
+            where.append("(" + " OR ".join("name GLOB ?" for _ in globs) + ")")
+            params.extend(globs)
+        if tagged is not None:
+            where.append(f"name {'' if tagged else 'NOT '}IN (SELECT sc_name FROM snapshots WHERE tagged = 1)")
+        if newest_before is not None or newest_after is not None:
+            having = ["MAX(created_at) IS NOT NULL"]
+            if newest_before is not None:
+                having.append("MAX(created_at) < ?")
+                params.append(newest_before)
+            if newest_after is not None:
+                having.append("MAX(created_at) >= ?")
+                params.append(newest_after)
+            where.append("name IN (SELECT sc_name FROM snapshots GROUP BY sc_name HAVING " + " AND ".join(having) + ")")
+        query = "SELECT rowid, version, data FROM stateful_containers WHERE rowid > ?"
+        if where:
+            query += " AND " + " AND ".join(where)
+        query += " ORDER BY rowid LIMIT ?"
+
+        last_rowid = 0
+        while True:
+            # One span per batch; a span left open across yields would also time the caller
+            with self._lock, tracing.span('state.scan'):
+                rows = self._conn.execute(query, [last_rowid, *params, batch_size]).fetchall()
+                tracing.add_bytes(read=sum(len(data) for _, _, data in rows))
+            for rowid, version, data in rows:
+                record = self._decode(version, data)
+                # GLOB narrows the rows; fnmatch has the last word, as in the other backends
+                if not name_globs or any(fnmatch.fnmatchcase(record['name'], g) for g in name_globs):
+                    yield record
+            if len(rows) < batch_size:
+                return
+            last_rowid = rows[-1][0]
+
+    def snapshots_older_than(self, timestamp):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT sc_name, image_id, created_at, tagged FROM snapshots WHERE created_at < ? ORDER BY created_at",
+                (timestamp,)).fetchall()
+
+    def load_image_usage(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT image_id, data FROM image_usage").fetchall()
+        return {image_id: json.loads(data) for image_id, data in rows}
+
+    def save_image_usage(self, usage, removed=()):
+        def work():
+            self._conn.executemany("INSERT OR REPLACE INTO image_usage (image_id, data) VALUES (?, ?)",
+                                   [(image_id, json.dumps(info)) for image_id, info in usage.items()])
+            self._conn.executemany("DELETE FROM image_usage WHERE image_id = ?", [(i,) for i in removed])
+        self._transaction(work)
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def migrate_from_json(self, json_path):
+        # One-time import of the legacy stateful_containers.json; the original is
+        # kept next to the database with a '.migrated' suffix.
+        if self.get_meta('migrated_from_json') or not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r') as file:
+            containers = json.load(file)
+
+        def work():
+            for record in containers:
+                self._write_record(record)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                               (json_path,))
+        self._transaction(work)
+        os.replace(json_path, json_path + ".migrated")
+        print(f"Migrated {len(containers)} stateful containers from '{json_path}' to '{self.path}'.")
+        return len(containers)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def encode_journal_entry(entry):
+    # One line per entry: crc32 of the JSON, then the JSON
+    data = json.dumps(entry, separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(data), data)
+
+
+def decode_journal_entries(data, offset=0):
+    # Yields (entry, end offset) for every complete line from offset on. A final line
+    # without its newline is a torn write and is left for the next writer to truncate.
+    while offset < len(data):
+        end = data.find(b'\n', offset)
+        if end < 0:
+            return
+        line = data[offset:end]
+        offset = end + 1
+        checksum, _, payload = line.partition(b' ')
+        try:
+            if int(checksum, 16) != zlib.crc32(payload):
+                raise ValueError("checksum mismatch")
+            entry = json.loads(payload)
+        except ValueError:
+            print(f"Skipping a damaged state journal record ending at byte {offset}.")
+            continue
+        yield entry, offset
+
+
+def fsync_directory(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JournalStateStore:
+    # Append-only backend: every mutation appends one checksummed, fsync'd journal
+    # line, and state is a checkpoint plus a replay of the journal written since.
+    # Several processes share it through a lock file; each keeps the records in
+    # memory and catches up on the journal tail before every operation.
+
+    def __init__(self, path, compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.path = path
+        self.checkpoint_path = f"{path}.checkpoint"
+        self.compact_bytes = compact_bytes
+        self._lock = threading.RLock()
+        self._lock_file = open(f"{path}.lock", 'a')
+        # A cache, not state: kept out of the journal so it never has to be replayed
+        self.image_usage_path = f"{path}.image-usage"
+        self._records = {}
+        self._versions = {}
+        self._generation = 0
+        self._offset = 0
+        self._journal_generation = None
+        self._compactor = None
+        with self._locked(exclusive=False):
+            self._reload()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _keep(self, record):
+        # Entries journaled by older releases carry no version
+        record.setdefault('version', 0)
+        self._records[record['name']] = json.dumps(record)
+        self._versions[record['name']] = record['version']
+
+    def _apply(self, entry):
+        op = entry['op']
+        if op == 'put':
+            self._keep(entry['record'])
+        elif op == 'put_many':
+            for record in entry['records']:
+                self._keep(record)
+        elif op == 'delete':
+            self._records.pop(entry['name'], None)
+            self._versions.pop(entry['name'], None)
+        elif op == 'replace':
+            self._records, self._versions = {}, {}
+            for record in entry['records']:
+                self._keep(record)
+
+    def _reload(self):
+        checkpoint = {'generation': 0, 'source_generation': None, 'covered_offset': 0, 'records': []}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as file:
+                tracing.add_bytes(read=os.fstat(file.fileno()).st_size)
+                checkpoint = json.load(file)
+        self._records, self._versions = {}, {}
+        for record in checkpoint['records']:
+            self._keep(record)
+        self._generation = checkpoint['generation']
+        self._offset = 0
+        self._journal_generation = None
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        tracing.add_bytes(read=len(data))
+        header, header_end = next(decode_journal_entries(data), ({}, 0))
+        journal_generation = self._journal_generation = header.get('generation')
+        if journal_generation == checkpoint['generation']:
+            start = header_end
+        elif journal_generation == checkpoint['source_generation']:
+            # Crashed between writing the checkpoint and starting the new journal
+            start = checkpoint['covered_offset']
+        else:
+            print(f"State journal '{self.path}' does not match its checkpoint; replaying all of it.")
+            start = header_end
+        self._generation = checkpoint['generation']
+        self._offset = start
+        for entry, end in decode_journal_entries(data, start):
+            self._apply(entry)
+            self._offset = end
+
+    def _catch_up(self):
+        # Picks up what other processes appended, or reloads after a compaction. The
+        # journal is identified by the generation in its header, not its inode,
+        # since a compacted journal's inode number can be reused.
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            if self._journal_generation is not None:
+                self._reload()
+            return
+        with file:
+            header = next(decode_journal_entries(file.readline()), ({}, 0))[0]
+            if header.get('generation') != self._journal_generation or os.fstat(file.fileno()).st_size < self._offset:
+                self._reload()
+                return
+            file.seek(self._offset)
+            data = file.read()
+        tracing.add_bytes(read=len(data))
+        base = self._offset
+        for entry, end in decode_journal_entries(data):
+            self._apply(entry)
+            self._offset = base + end
+
+    def _append(self, entry):
+        # Caller holds the exclusive lock and has caught up
+        if self._journal_generation is None:
+            self._start_journal()
+        with open(self.path, 'r+b') as file:
+            # Anything past the last complete record is a torn write from a crash
+            file.truncate(self._offset)
+            file.seek(self._offset)
+            data = encode_journal_entry(entry)
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        tracing.add_bytes(written=len(data))
+        self._offset += len(data)
+        self._apply(entry)
+        if self._offset > self.compact_bytes and (self._compactor is None or not self._compactor.is_alive()):
+            # Non-daemon, so a short-lived CLI process still finishes it before exiting
+            self._compactor = threading.Thread(target=self.compact)
+            self._compactor.start()
+
+    def _start_journal(self):
+        tmp_path = f"{self.path}.tmp"
+        header = encode_journal_entry({'op': 'header', 'generation': self._generation})
+        with open(tmp_path, 'wb') as file:
+            file.write(header)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_directory(self.path)
+        self._journal_generation = self._generation
+        self._offset = len(header)
+
+    def compact(self):
+        # Checkpoint first, then the new journal: a crash in between leaves a checkpoint
+        # that records how much of the old journal it already covers
+        with self._locked(exclusive=True):
+            self._catch_up()
+            checkpoint = {
+                'generation': self._generation + 1,
+                'source_generation': self._generation,
+                'covered_offset': self._offset,
+                'records': [json.loads(data) for data in self._records.values()],
+            }
+            tmp_path = f"{self.checkpoint_path}.tmp"
+            with open(tmp_path, 'w') as file:
+                json.dump(checkpoint, file, separators=(',', ':'))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.checkpoint_path)
+            fsync_directory(self.checkpoint_path)
+            self._generation += 1
+            self._start_journal()
+
+    def _read(self):
+        with self._locked(exclusive=False):
+            self._catch_up()
+            return list(self._records.values())
+
+    def load_all(self):
+        return [json.loads(data) for data in self._read()]
+
+    def _next_version(self, record):
+        return dict(record, version=self._versions.get(record['name'], 0) + 1)
+
+    def replace_all(self, containers):
+        with self._locked(exclusive=True):
+            self._catch_up()
+            self._append({'op': 'replace', 'records': [self._next_version(record) for record in containers]})
+
+    def names(self):
+        with self._locked(exclusive=False):
+            self._catch_up()
+            return list(self._records)
+
+    def get(self, name):
+        with self._locked(exclusive=False):
+            self._catch_up()
+            data = self._records.get(name)
+        return json.loads(data) if data else None
+
+    def put(self, record):
+        with self._locked(exclusive=True):
+            self._catch_up()
+            stale = stale_names([record], self._versions.get)
+            if stale:
+                raise StaleRecordError(stale)
+            stored = self._next_version(record)
+            self._append({'op': 'put', 'record': stored})
+        record['version'] = stored['version']
+
+    def put_many(self, records):
+        # One journal line for the whole batch, so it lands all-or-nothing
+        with self._locked(exclusive=True):
+            self._catch_up()
+            stale = stale_names(records, self._versions.get)
+            if stale:
+                raise StaleRecordError(stale)
+            stored = [self._next_version(record) for record in records]
+            self._append({'op': 'put_many', 'records': stored})
+        for record, written in zip(records, stored):
+            record['version'] = written['version']
+
+    def update(self, name, mutate):
+        with self._locked(exclusive=True):
+            self._catch_up()
+            if name not in self._records:
+                return None
+            record = json.loads(self._records[name])
+            mutate(record)
+            record['version'] = self._versions[name] + 1
+            self._append({'op': 'put', 'record': record})
+            return record
+
+    def update_many(self, names, mutate):
+        with self._locked(exclusive=True):
+            self._catch_up()
+            updated = [json.loads(self._records[name]) for name in names if name in self._records]
+            for record in updated:
+                mutate(record)
+                record['version'] = self._versions[record['name']] + 1
+            if updated:
+                self._append({'op': 'put_many', 'records': updated})
+            return updated
+
+    def delete(self, name):
+        with self._locked(exclusive=True):
+            self._catch_up()
+            if name not in self._records:
+                return False
+            self._append({'op': 'delete', 'name': name})
+            return True
+
+    def find_by_status(self, status):
+        return [record for record in self.load_all() if record_status(record) == status]
+
+    def scan(self, **filters):
+        # Records stay encoded in memory; only decode them as the caller consumes
+        with tracing.span('state.scan'):
+            encoded = self._read()
+        for data in encoded:
+            record = json.loads(data)
+            if scan_matches(record, **filters):
+                yield record
+
+    def snapshots_older_than(self, timestamp):
+        rows = []
+        for record in self.load_all():
+            rows.extend(r for r in snapshot_rows(record) if r[2] and r[2] < timestamp)
+        return sorted(rows, key=lambda r: r[2])
+
+    def load_image_usage(self):
+        with self._locked(exclusive=False):
+            return read_image_usage(self.image_usage_path)
+
+    def save_image_usage(self, usage, removed=()):
+        with self._locked(exclusive=True):
+            write_image_usage(self.image_usage_path, usage, removed)
+
+    def migrate_from_json(self, json_path):
+        # One-time import of the legacy stateful_containers.json, as for SQLite
+        if not os.path.exists(json_path):
+            return 0
+        with self._locked(exclusive=True):
+            self._catch_up()
+            if self._records or self._journal_generation is not None or os.path.exists(self.checkpoint_path):
+                return 0
+            with open(json_path, 'r') as file:
+                containers = json.load(file)
+            self._append({'op': 'replace', 'records': containers})
+        os.replace(json_path, json_path + ".migrated")
+        print(f"Migrated {len(containers)} stateful containers from '{json_path}' to '{self.path}'.")
+        return len(containers)
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+        self._lock_file.close()
@@ -0,0 +1,228 @@
+# scon/utils/tracing.py
+
+import atexit
+import contextvars
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_ENV = "SCON_TRACE"
+TRACE_FILE = "trace.jsonl"
+STATS_FILE = "stats.json"
+# Finished spans are appended here by every process and folded into STATS_FILE
+# by `scon stats`, or by whichever process finds the log grown past STATS_LOG_FOLD_BYTES
+STATS_LOG = "stats.log"
+STATS_LOG_FOLD_BYTES = 4 * 1024 * 1024
+# Durations kept per operation, and per SC and operation, for `scon stats`
+ROLLING_WINDOW = 500
+SC_ROLLING_WINDOW = 50
+# Only the most recently active SCs keep per-SC numbers
+MAX_TRACKED_SCS = 200
+
+_trace_path = contextvars.ContextVar('trace_path', default=None)
+_current_sc = contextvars.ContextVar('current_sc', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+_lock = threading.Lock()
+# Finished spans not yet merged into the rolling stats: (op, sc, ms, ok)
+_pending = []
+_flush_registered = False
+
+
+def data_file(filename):
+    from scon.utils import json_storage
+    return json_storage.data_path(filename)
+
+def enable(path=None):
+    # Writes every span of this context (and the threads it fans out to) to a JSON-lines file
+    _trace_path.set(os.path.abspath(path) if path else data_file(TRACE_FILE))
+
+def trace_path_from_env():
+    value = os.environ.get(TRACE_ENV)
+    if not value:
+        return None
+    return data_file(TRACE_FILE) if value == '1' else os.path.abspath(value)
+
+@contextmanager
+def sc_scope(name):
+    # Attributes the spans inside to one SC
+    token = _current_sc.set(name)
+    try:
+        yield
+    finally:
+        _current_sc.reset(token)
+
+@contextmanager
+def span(op, **attributes):
+    # Times the block; the yielded dict takes exit_code/status and other attributes
+    record = {'op': op, 'sc': _current_sc.get(), **attributes}
+    token = _current_span.set(record)
+    started_at = time.perf_counter()
+    try:
+        yield record
+    except SystemExit as e:
+        record['exit_code'] = e.code if isinstance(e.code, int) else int(e.code is not None)
+        raise
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        record['ms'] = round((time.perf_counter() - started_at) * 1000, 3)
+        finish(record)
+
+def add_bytes(read=0, written=0):
+    # Credits I/O to the innermost open span, if any
+    record = _current_span.get()
+    if record is not None:
+        if read:
+            record['bytes_read'] = record.get('bytes_read', 0) + read
+        if written:
+            record['bytes_written'] = record.get('bytes_written', 0) + written
+
+def succeeded(record):
+    return ('error' not in record and record.get('exit_code') in (None, 0)
+            and (record.get('status') or 0) < 400)
+
+def finish(record):
+    global _flush_registered
+    record['ts'] = round(time.time(), 6)
+    record['ok'] = succeeded(record)
+    path = _trace_path.get()
+    with _lock:
+        _pending.append((record['op'], record['sc'], record['ms'], record['ok']))
+        if not _flush_registered:
+            atexit.register(flush)
+            _flush_registered = True
+        if path:
+            with open(path, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+
+
+class CountingStream:
+    # Passes a stream through, crediting what goes through it to a span
+
+    def __init__(self, stream, record):
+        self._stream = stream
+        self._record = record
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._record['bytes_read'] = self._record.get('bytes_read', 0) + len(data)
+        return data
+
+    def write(self, data):
+        self._record['bytes_written'] = self._record.get('bytes_written', 0) + len(data)
+        return self._stream.write(data)
+
+    def __getattr__(self, attribute):
+        return getattr(self._stream, attribute)
+
+
+# Rolling aggregate
+
+def empty_entry():
+    return {'count': 0, 'errors': 0, 'samples': []}
+
+def add_sample(entry, ms, ok, window):
+    entry['count'] += 1
+    entry['errors'] += 0 if ok else 1
+    entry['samples'].append(ms)
+    del entry['samples'][:-window]
+
+def read_stats(path):
+    if not os.path.exists(path):
+        return {'ops': {}, 'scs': {}}
+    with open(path) as file:
+        return json.load(file)
+
+def fold(stats, spans):
+    now = time.time()
+    for op, sc, ms, ok in spans:
+        add_sample(stats['ops'].setdefault(op, empty_entry()), ms, ok, ROLLING_WINDOW)
+        if sc:
+            per_sc = stats['scs'].setdefault(sc, {'updated': now, 'ops': {}})
+            per_sc['updated'] = now
+            add_sample(per_sc['ops'].setdefault(op, empty_entry()), ms, ok, SC_ROLLING_WINDOW)
+    if len(stats['scs']) > MAX_TRACKED_SCS:
+        keep = sorted(stats['scs'], key=lambda name: stats['scs'][name]['updated'])[-MAX_TRACKED_SCS:]
+        stats['scs'] = {name: stats['scs'][name] for name in keep}
+    return stats
+
+def read_stats_log(path):
+    spans = []
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                try:
+                    spans.append(tuple(json.loads(line)))
+                except ValueError:
+                    # A line cut short by a crash mid-append
+                    continue
+    return spans
+
+@contextmanager
+def stats_locked(exclusive):
+    # Appenders share the lock, so they never wait on each other; folding takes it alone
+    with open(f"{data_file(STATS_FILE)}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+def fold_stats_log():
+    # Folds the appended spans into the stats file and starts the log afresh
+    path, log_path = data_file(STATS_FILE), data_file(STATS_LOG)
+    with stats_locked(exclusive=True):
+        stats = fold(read_stats(path), read_stats_log(log_path))
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(stats, file, separators=(',', ':'))
+        os.replace(temp_path, path)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+    return stats
+
+def load_stats():
+    return fold_stats_log()
+
+def flush():
+    # Appends the spans finished so far to the stats log shared by every scon process:
+    # one write, no read, so a short command pays next to nothing for it
+    with _lock:
+        pending = list(_pending)
+        del _pending[:]
+    if not pending:
+        return
+    log_path = data_file(STATS_LOG)
+    data = ''.join(json.dumps(span, separators=(',', ':')) + '\n' for span in pending).encode()
+    try:
+        with stats_locked(exclusive=False):
+            fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+        if size > STATS_LOG_FOLD_BYTES:
+            fold_stats_log()
+    except OSError as e:
+        print(f"Could not update {log_path}: {e}")
+
+def reset_stats():
+    with stats_locked(exclusive=True):
+        for path in (data_file(STATS_FILE), data_file(STATS_LOG)):
+            if os.path.exists(path):
+                os.remove(path)
+
+def percentile(sorted_samples, fraction):
+    # Nearest rank
+    if not sorted_samples:
+        return None
+    return sorted_samples[max(0, math.ceil(fraction * len(sorted_samples)) - 1)]
+
+def summarize(entry):
+    samples = sorted(entry['samples'])
+    return {'count': entry['count'], 'errors': entry['errors'],
+            'p50': percentile(samples, 0.50), 'p95': percentile(samples, 0.95), 'p99': percentile(samples, 0.99)}
@@ -0,0 +1,251 @@
+# scon/utils/transfer.py
+
+import contextvars
+import copy
+import hashlib
+import json
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from scon.utils import endpoints, json_storage, usage, volumes
+from scon.utils.chunk_store import ChunkReader, ChunkStore, local_store, member_entry, member_info, read_blocks
+from scon.utils.garbage_collector import format_bytes
+
+EXPORT_FORMAT = 1
+# Chunks compressed or decompressed ahead of the stream, per worker
+CHUNKS_IN_FLIGHT = 2
+# Archive members small enough to keep in memory while exporting, so the
+# manifest.json and image configs can be read once the stream has passed them
+METADATA_MAX_SIZE = 1024 * 1024
+
+def submit(pool, function, *args):
+    return pool.submit(contextvars.copy_context().run, function, *args)
+
+def layer_diff_ids(metadata):
+    # {archive path of a layer: its diff ID}, from manifest.json and the image configs
+    # (`docker save` writes both the classic layout and OCI blobs/sha256/... paths)
+    diff_ids = {}
+    for image in json.loads(metadata.get('manifest.json') or '[]'):
+        config = json.loads(metadata.get(image['Config']) or '{}')
+        for path, diff_id in zip(image.get('Layers') or [], config.get('rootfs', {}).get('diff_ids') or []):
+            diff_ids[path] = diff_id
+    return diff_ids
+
+def rootfs_layers(metadata):
+    # Diff IDs of every layer, bottom up, repeats included
+    layers = []
+    for image in json.loads(metadata.get('manifest.json') or '[]'):
+        config = json.loads(metadata.get(image['Config']) or '{}')
+        layers.extend(config.get('rootfs', {}).get('diff_ids') or [])
+    return layers
+
+def export_image(runtime, image, store, pool, workers, stats, seen):
+    # Streams `save` into the store: every archive member is split into chunks that
+    # are hashed here and compressed in the pool, skipping chunks already stored
+    members = []
+    metadata = {}
+    pending = deque()
+
+    def store_chunk(digest, block):
+        stats['read'] += len(block)
+        if digest in seen or store.has(digest):
+            stats['deduplicated'] += len(block)
+            return
+        seen.add(digest)
+        stats['new'] += len(block)
+        while len(pending) >= workers * CHUNKS_IN_FLIGHT:
+            stats['written'] += pending.popleft().result()
+        pending.append(submit(pool, store.put, digest, block))
+
+    with runtime.save_image(image) as stream, tarfile.open(fileobj=stream, mode='r|') as archive:
+        for info in archive:
+            entry = member_entry(info)
+            if info.isfile():
+                for block in read_blocks(archive.extractfile(info)):
+                    digest = hashlib.sha256(block).hexdigest()
+                    entry['chunks'].append(digest)
+                    store_chunk(digest, block)
+                    if info.size <= METADATA_MAX_SIZE:
+                        metadata[info.name] = block
+            members.append(entry)
+    while pending:
+        stats['written'] += pending.popleft().result()
+
+    diff_ids = layer_diff_ids(metadata)
+    for entry in members:
+        if entry['name'] in diff_ids:
+            entry['diff_id'] = diff_ids[entry['name']]
+    return {'image': image, 'members': members, 'layers': rootfs_layers(metadata)}
+
+def image_layers(store, image):
+    # Diff IDs of the image's layers, bottom up. Exports made before they were recorded
+    # have them read back from the archive's manifest.json and image config.
+    if 'layers' in image:
+        return image['layers']
+    members = {entry['name']: entry for entry in image['members']}
+
+    def read(name):
+        entry = members.get(name)
+        return b''.join(store.get(digest) for digest in entry['chunks']) if entry else None
+    metadata = {'manifest.json': read('manifest.json') or b'[]'}
+    for saved in json.loads(metadata['manifest.json']):
+        metadata[saved['Config']] = read(saved['Config'])
+    return rootfs_layers(metadata)
+
+def present_layers(layers, local_chains):
+    # Diff IDs the load can leave out: the runtime reuses a layer only with everything
+    # under it, so only the leading layers whose chain it already has, and only if the
+    # same diff ID is not needed again further up
+    chains = usage.chain_ids(layers)
+    count = next((i for i, chain in enumerate(chains) if chain not in local_chains), len(chains))
+    return set(layers[:count]) - set(layers[count:])
+
+def exported_images(container_data, all_snapshots=False):
+    # The image the next start uses, plus every other snapshot with --all-snapshots
+    images = []
+    if container_data.get('next_snapshot_to_start'):
+        images.append(json_storage.snapshot_image(container_data['next_snapshot_to_start']))
+    if all_snapshots:
+        # Snapshots left on another endpoint by a move are not in this runtime
+        home = endpoints.endpoint_of(container_data)
+        images.extend(json_storage.snapshot_image(entry) for entry in container_data.get('snapshots', [])
+                      if endpoints.snapshot_endpoint(container_data, entry) == home)
+    return list(dict.fromkeys(images))
+
+def portable_record(container_data, images, name=None):
+    # The record as another machine should see it: nothing running, nothing in
+    # flight, and only the snapshots that were exported
+    record = copy.deepcopy(container_data)
+    record['name'] = name or record['name']
+    for key in ('pending_commit', 'warm_container', 'endpoint', 'version'):
+        record.pop(key, None)
+    for container in record.get('containers', []):
+        if container.get('status') == 'running':
+            container['status'] = 'stopped'
+    home = endpoints.endpoint_of(container_data)
+    record['snapshots'] = [entry for entry in record.get('snapshots', []) if json_storage.snapshot_image(entry) in images
+                           and endpoints.snapshot_endpoint(container_data, entry) == home]
+    for entry in record['snapshots']:
+        entry.pop('endpoint', None)
+    next_snapshot = record.get('next_snapshot_to_start')
+    if not next_snapshot or json_storage.snapshot_image(next_snapshot) not in images:
+        record['next_snapshot_to_start'] = record['snapshots'][-1] if record['snapshots'] else None
+    return record
+
+def manifest_chunks(manifest, skip_diff_ids=()):
+    digests = list(manifest.get('captured_chunks', []))
+    for image in manifest['images']:
+        for entry in image['members']:
+            if entry.get('diff_id') not in skip_diff_ids:
+                digests.extend(entry['chunks'])
+    return list(dict.fromkeys(digests))
+
+def copy_chunks(source, target, digests, pool):
+    futures = [submit(pool, source.copy_to, target, digest) for digest in digests]
+    return sum(future.result() for future in futures)
+
+def export_container(runtime, container_data, destination=None, all_snapshots=False, workers=4):
+    name = container_data['name']
+    images = exported_images(container_data, all_snapshots)
+    if not images:
+        print(f"Stateful container '{name}' has no snapshot to export yet; stop or snapshot it first.")
+        return None
+
+    store = local_store()
+    stats = {'read': 0, 'new': 0, 'deduplicated': 0, 'written': 0}
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        manifest = {
+            'format': EXPORT_FORMAT,
+            'name': name,
+            'exported_at': datetime.utcnow().isoformat(),
+            'record': portable_record(container_data, images),
+            'images': [],
+        }
+        for image in images:
+            print(f"Exporting {image}...")
+            manifest['images'].append(export_image(runtime, image, store, pool, workers, stats, seen))
+        # Captured volumes and deltas are already in the store; the export only has to carry them along
+        captured = []
+        for entry in manifest['record']['snapshots'] + [manifest['record']['next_snapshot_to_start']]:
+            for key in ('volumes', 'delta'):
+                if entry and entry.get(key):
+                    captured.extend(volumes.captured_chunks(store, entry[key]))
+        manifest['captured_chunks'] = list(dict.fromkeys(captured))
+        # The manifest goes last: one that exists always has all of its chunks
+        store.save_manifest(name, manifest)
+
+        copied = 0
+        if destination:
+            target = ChunkStore(destination, store.codec)
+            copied = copy_chunks(store, target, manifest_chunks(manifest), pool)
+            target.save_manifest(name, manifest)
+
+    print(f"Exported '{name}' ({len(images)} image(s)): {format_bytes(stats['read'])} read, "
+          f"{format_bytes(stats['deduplicated'])} already stored, {format_bytes(stats['new'])} new "
+          f"({format_bytes(stats['written'])} compressed)"
+          + (f"; copied {format_bytes(copied)} to {destination}." if destination else "."))
+    return manifest
+
+def load_image(runtime, image, store, pool, workers, skip_diff_ids):
+    # Rebuilds the archive `save` produced and streams it into `load`. Layers in
+    # skip_diff_ids go in as empty placeholders, which only a runtime whose
+    # load_skips_present_layers() holds never reads.
+    skipped = 0
+    with runtime.load_image() as writer, tarfile.open(fileobj=writer, mode='w|') as archive:
+        for entry in image['members']:
+            info = member_info(entry)
+            if entry.get('diff_id') in skip_diff_ids:
+                skipped += entry['size']
+                info.size = 0
+                archive.addfile(info)
+            elif info.isfile():
+                archive.addfile(info, ChunkReader(store, entry['chunks'], pool, workers * CHUNKS_IN_FLIGHT))
+            else:
+                archive.addfile(info)
+    return skipped
+
+def local_chain_ids(runtime):
+    images = runtime.list_images() or []
+    infos = runtime.inspect_images([image['id'] for image in images]) if images else {}
+    return set().union(*[usage.chain_ids(info.get('RootFS', {}).get('Layers') or []) for info in infos.values()])
+
+def import_container(runtime, name, source=None, new_name=None, workers=4, skip_present=True):
+    store = local_store()
+    origin = ChunkStore(source) if source else store
+    manifest = origin.load_manifest(name)
+    if manifest is None:
+        print(f"No export of '{name}' found in {origin.root}.")
+        return None
+    if manifest.get('format') != EXPORT_FORMAT:
+        print(f"Export of '{name}' has unsupported format {manifest.get('format')}.")
+        return None
+    target_name = new_name or name
+    if json_storage.get_stateful_container(target_name) is not None:
+        print(f"Stateful container '{target_name}' already exists; import it under another name with --as.")
+        return None
+
+    # The containerd image store and Podman read every layer, so they get all of them
+    local_chains = local_chain_ids(runtime) if skip_present and runtime.load_skips_present_layers() else set()
+    layers = [image_layers(origin, image) for image in manifest['images']]
+    skip = [present_layers(image, local_chains) for image in layers]
+    # A layer's chunks are left behind only if no image needs its content
+    needed = set().union(*[set(image) - skipped for image, skipped in zip(layers, skip)])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        copied = 0
+        if origin is not store:
+            # Chunks already fetched by an earlier, interrupted import are not copied again
+            copied = copy_chunks(origin, store, manifest_chunks(manifest, set().union(*skip) - needed), pool)
+        skipped = 0
+        for image, skip_diff_ids in zip(manifest['images'], skip):
+            print(f"Loading {image['image']}...")
+            skipped += load_image(runtime, image, store, pool, workers, skip_diff_ids)
+
+    record = manifest['record']
+    record['name'] = target_name
+    json_storage.save_stateful_container(record)
+    print(f"Imported '{name}'" + (f" as '{target_name}'" if target_name != name else '')
+          + f" ({len(manifest['images'])} image(s)): copied {format_bytes(copied)}, "
+          f"skipped {format_bytes(skipped)} of layers already present.")
+    return record
@@ -0,0 +1,260 @@
+# scon/utils/usage.py
+#
+# Disk usage of snapshot images: per SC and per snapshot, the bytes it holds alone
+# (what removing it frees) and the bytes it shares with other SCs, snapshots or base
+# images. Layer lists and sizes come from batched image inspects and are cached in the
+# state store by image ID, whose content never changes, so a repeat run costs one
+# image listing per endpoint.
+#
+# Runtimes report an image's total size, not each layer's. A snapshot adds one layer
+# to the image its container started from, so the bytes its layers add are its size
+# minus that of the nearest shorter image found below it; layers in between (a removed
+# snapshot, say) are counted together as one segment. Layers are told apart by chain
+# ID, the digest of a layer and everything under it, as the runtime's layer store does.
+
+import fnmatch
+import hashlib
+import heapq
+import json
+from scon.utils import endpoints, garbage_collector, json_storage, runtime_client
+from scon.utils.garbage_collector import format_bytes
+
+# Owner of the layers of base images, which are never scon's to remove
+BASE = ''
+
+def chain_ids(layers):
+    chains = []
+    for layer in layers:
+        chains.append(layer if not chains else 'sha256:' + hashlib.sha256(f"{chains[-1]} {layer}".encode()).hexdigest())
+    return chains
+
+def segments(info, sizes):
+    # [(chain ID, bytes)] from the top of the image down, split at every image in
+    # sizes ({chain ID of an image's top layer: that image's size})
+    chains = chain_ids(info['layers'])
+    result = []
+    end, size = len(chains), info['size']
+    while end:
+        start = next((i for i in range(end - 1, 0, -1) if chains[i - 1] in sizes), 0)
+        below = sizes[chains[start - 1]] if start else 0
+        result.append((chains[end - 1], max(0, size - below)))
+        end, size = start, below
+    return result
+
+def base_images(record):
+    refs = {record[key] for key in ('image', 'original_image') if record.get(key)}
+    if record.get('containers'):
+        refs.add(record['containers'][0]['image'])
+    return refs
+
+def survey(runtime, records, cache, refresh=False):
+    # The current endpoint's images: {'ids': {ref: image ID}, 'infos': {image ID: info}
+    # for the SCs' snapshot and base images, 'inspected': {image ID: info} not cached
+    # before}, or None if the runtime does not answer
+    endpoint = endpoints.current()
+    listed = runtime.list_images()
+    if listed is None:
+        return None
+    ids = {}
+    for image in listed:
+        ids[image['id']] = image['id']
+        for tag in image['tags']:
+            ids.update(dict.fromkeys(runtime_client.tag_aliases(tag), image['id']))
+
+    wanted = set()
+    for record in records:
+        wanted.update(ids[image] for _, entry, image, _ in garbage_collector.snapshot_entries(record)
+                      if image in ids and endpoints.snapshot_endpoint(record, entry) == endpoint)
+        if endpoints.endpoint_of(record) == endpoint:
+            wanted.update(ids[image] for image in base_images(record) if image in ids)
+    inspected = {image_id: {'size': info.get('Size') or 0, 'layers': info['RootFS']['Layers']}
+                 for image_id, info in runtime.inspect_images(
+                     sorted(image_id for image_id in wanted if refresh or image_id not in cache)).items()}
+    infos = {image_id: inspected.get(image_id) or cache.get(image_id) for image_id in wanted}
+    return {'ids': ids, 'infos': {image_id: info for image_id, info in infos.items() if info},
+            'inspected': inspected}
+
+def account(records, endpoint, result):
+    # Who holds which layers on one endpoint: {'ids': survey()'s, 'snapshots': [row],
+    # 'segments': {image ID: [(chain ID, bytes)]}, 'holders': {chain ID: image IDs},
+    # 'owners': {chain ID: SC names}}
+    ids, infos = result['ids'], result['infos']
+    sizes = {chain_ids(info['layers'])[-1]: info['size'] for info in infos.values() if info['layers']}
+    image_segments = {image_id: segments(info, sizes) for image_id, info in infos.items()}
+    holders, owners, snapshots = {}, {}, []
+
+    def hold(image_id, owner):
+        for chain, _ in image_segments[image_id]:
+            holders.setdefault(chain, set()).add(image_id)
+            owners.setdefault(chain, set()).add(owner)
+
+    for record in records:
+        if endpoints.endpoint_of(record) == endpoint:
+            for image in base_images(record):
+                if ids.get(image) in image_segments:
+                    hold(ids[image], BASE)
+        for _, entry, image, created_at in garbage_collector.snapshot_entries(record):
+            image_id = ids.get(image)
+            if image_id not in image_segments or endpoints.snapshot_endpoint(record, entry) != endpoint:
+                continue
+            hold(image_id, record['name'])
+            if entry.get('base_image_id'):
+                # A delta snapshot's own bytes are chunks; its checkpoint has a row of its own
+                continue
+            snapshots.append({'sc': record['name'], 'snapshot': image, 'image_id': image_id,
+                              'created_at': created_at, 'tagged': entry.get('tagged', False)})
+    return {'endpoint': endpoint, 'ids': ids, 'snapshots': snapshots, 'segments': image_segments,
+            'holders': holders, 'owners': owners}
+
+def snapshot_rows(usage):
+    rows = []
+    for snapshot in usage['snapshots']:
+        image_segments = usage['segments'][snapshot['image_id']]
+        rows.append(dict(snapshot, endpoint=usage['endpoint'], bytes=sum(size for _, size in image_segments),
+                         exclusive=sum(size for chain, size in image_segments
+                                       if usage['holders'][chain] == {snapshot['image_id']})))
+    return rows
+
+def sc_rows(usage):
+    chains, counts = {}, {}
+    for snapshot in usage['snapshots']:
+        chains.setdefault(snapshot['sc'], {}).update(usage['segments'][snapshot['image_id']])
+        counts[snapshot['sc']] = counts.get(snapshot['sc'], 0) + 1
+    rows = []
+    for name, held in chains.items():
+        total = sum(held.values())
+        exclusive = sum(size for chain, size in held.items() if usage['owners'][chain] == {name})
+        rows.append({'sc': name, 'endpoint': usage['endpoint'], 'snapshots': counts[name], 'bytes': total,
+                     'exclusive': exclusive, 'shared': total - exclusive})
+    return rows
+
+def snapshot_bytes(usage):
+    # Bytes only snapshots hold, not base images
+    held = {}
+    for image_segments in usage['segments'].values():
+        held.update(image_segments)
+    return sum(size for chain, size in held.items() if BASE not in usage['owners'].get(chain, {BASE}))
+
+def collect(get_runtime, config, records, refresh=False):
+    # {endpoint: account()} for every endpoint that answers; newly inspected images go
+    # into the cache, and images no endpoint has any more leave it
+    cache = json_storage.load_image_usage()
+
+    def work():
+        return survey(get_runtime(), records, cache, refresh)
+    results, failures = endpoints.fan_out(work, endpoints.endpoint_names(config), endpoints.endpoint_timeout(config))
+    endpoints.report_unreachable(failures)
+
+    inspected = {}
+    for result in results.values():
+        inspected.update(result['inspected'])
+    # An image missing from an endpoint that did not answer may still be there
+    gone = set() if failures else set(cache) - {i for result in results.values() for i in result['ids'].values()}
+    if inspected or gone:
+        json_storage.save_image_usage(inspected, gone)
+    return {endpoint: account(records, endpoint, result) for endpoint, result in results.items()}
+
+def pick_reclaimable(accounts, candidates, target, limit=None):
+    # Of candidates ({endpoint: snapshot image refs}), the ones that free the most bytes,
+    # until target bytes are freed or limit images picked: ({endpoint: refs}, bytes
+    # freed). Each pick is counted given the picks before it, since a snapshot's lower
+    # layers are freed only with the last image stacked on them.
+    refs = {}
+    for endpoint, endpoint_refs in candidates.items():
+        usage = accounts.get(endpoint)
+        for ref in endpoint_refs:
+            if usage and usage['ids'].get(ref) in usage['segments']:
+                refs.setdefault((endpoint, usage['ids'][ref]), []).append(ref)
+
+    # Holders of each chain not picked yet; an image frees the chains it is the last holder of.
+    # Layers of a base image, such as a snapshot another SC was created from, never go.
+    left = {(endpoint, chain): len(holders) if BASE not in usage['owners'][chain] else float('inf')
+            for endpoint, usage in accounts.items() for chain, holders in usage['holders'].items()}
+    gains = {}
+    for endpoint, image_id in refs:
+        gains[endpoint, image_id] = sum(size for chain, size in accounts[endpoint]['segments'][image_id]
+                                        if left[endpoint, chain] == 1)
+    heap = [(-gain, key) for key, gain in gains.items()]
+    heapq.heapify(heap)
+
+    picked, done, freed = {}, set(), 0
+    while heap and freed < target and (limit is None or len(done) < limit):
+        negative_gain, key = heapq.heappop(heap)
+        gain = -negative_gain
+        # Entries left behind when an image's gain went up since
+        if key not in gains or gain != gains[key]:
+            continue
+        if not gain:
+            break
+        endpoint, image_id = key
+        del gains[key]
+        done.add(key)
+        freed += gain
+        picked.setdefault(endpoint, set()).update(refs[key])
+        usage = accounts[endpoint]
+        for chain, size in usage['segments'][image_id]:
+            left[endpoint, chain] -= 1
+            if left[endpoint, chain] != 1:
+                continue
+            # The one holder left now frees this chain too, if it is a candidate
+            last = next(holder for holder in usage['holders'][chain] if (endpoint, holder) not in done)
+            if (endpoint, last) in gains:
+                gains[endpoint, last] += size
+                heapq.heappush(heap, (-gains[endpoint, last], (endpoint, last)))
+    return picked, freed
+
+def retention_picker(accounts):
+    # A choose for garbage_collector.kept_snapshots: of the untagged snapshots over
+    # max_snapshots, drop first the ones that free the most bytes, then the oldest. One
+    # whose layers newer snapshots or other SCs stack on frees nothing and is kept
+    # while there is a choice. Deltas and the checkpoints under them free no image bytes.
+    def choose(container, untagged, count):
+        checkpoints = {entry['base_image_id'] for entry in container.get('snapshots', []) if entry.get('base_image_id')}
+        candidates = {}
+        for _, entry in untagged:
+            key = garbage_collector.snapshot_key(entry)
+            if not entry.get('base_image_id') and key not in checkpoints:
+                candidates.setdefault(endpoints.snapshot_endpoint(container, entry), []).append(key)
+        picked, _ = pick_reclaimable(accounts, candidates, float('inf'), count)
+        freeing = set().union(*picked.values())
+        ordered = sorted(untagged, key=lambda item: (garbage_collector.snapshot_key(item[1]) not in freeing, item[0]))
+        return [garbage_collector.snapshot_key(entry) for _, entry in ordered[:count]]
+    return choose
+
+def run_du(get_runtime, config, patterns=None, by_snapshot=False, output_format='table', refresh=False):
+    records = json_storage.load_stateful_containers()
+    accounts = collect(get_runtime, config, records, refresh)
+    rows = []
+    for usage in accounts.values():
+        rows += snapshot_rows(usage) if by_snapshot else sc_rows(usage)
+    if patterns:
+        rows = [row for row in rows if any(fnmatch.fnmatchcase(row['sc'], pattern) for pattern in patterns)]
+    # Largest reclaimable first
+    rows.sort(key=lambda row: (-row['exclusive'], -row['bytes'], row['sc']))
+
+    if output_format == 'jsonl':
+        for row in rows:
+            print(json.dumps(row))
+        return rows
+    if not rows:
+        print("No snapshot images found.")
+        return rows
+    multi_host = endpoints.is_multi_host(config)
+    endpoint_header = f"{'ENDPOINT':<12} " if multi_host else ''
+    if by_snapshot:
+        print(f"{'SC':<24} {endpoint_header}{'SNAPSHOT':<40} {'CREATED':<20} {'SIZE':>10} {'EXCLUSIVE':>10}")
+        for row in rows:
+            endpoint_column = f"{row['endpoint']:<12} " if multi_host else ''
+            snapshot = row['snapshot'] + (' (tagged)' if row['tagged'] else '')
+            print(f"{row['sc']:<24} {endpoint_column}{snapshot:<40} {row['created_at'][:19]:<20} "
+                  f"{format_bytes(row['bytes']):>10} {format_bytes(row['exclusive']):>10}")
+    else:
+        print(f"{'SC':<24} {endpoint_header}{'SNAPSHOTS':>9} {'SIZE':>10} {'EXCLUSIVE':>10} {'SHARED':>10}")
+        for row in rows:
+            endpoint_column = f"{row['endpoint']:<12} " if multi_host else ''
+            print(f"{row['sc']:<24} {endpoint_column}{row['snapshots']:>9} {format_bytes(row['bytes']):>10} "
+                  f"{format_bytes(row['exclusive']):>10} {format_bytes(row['shared']):>10}")
+    if not patterns:
+        print(f"Snapshot layers take {format_bytes(sum(snapshot_bytes(usage) for usage in accounts.values()))} "
+              "on top of their base images.")
+    return rows
@@ -0,0 +1,139 @@
+# scon/utils/volumes.py
+
+import contextvars
+import hashlib
+import json
+import posixpath
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from scon.utils.chunk_store import ChunkReader, local_store, member_entry, member_info, read_blocks
+
+# Captured state (volumes, or the changed paths of a delta snapshot) is recorded as
+# {'manifest': digest, ...}; the manifest is a chunk of
+# {'paths': [{'path': ..., 'members': [tar member entries]}], ...}
+
+def load_manifest(store, captured):
+    return json.loads(store.get(captured['manifest']))
+
+def save_manifest(store, manifest):
+    # Manifests are chunks too, so identical captured state is recorded once
+    data = json.dumps(manifest, sort_keys=True).encode()
+    digest = hashlib.sha256(data).hexdigest()
+    store.put(digest, data)
+    return digest
+
+def previous_members(manifest):
+    # {path: {member name: entry}} of an earlier capture, to match unchanged files against
+    return {tree['path']: {entry['name']: entry for entry in tree['members']} for tree in manifest['paths']}
+
+def capture_path(runtime, container_ref, path, store, previous_members):
+    # Streams one path, and everything below it, out of the container into the store.
+    # Files whose size and mtime match the previous capture keep its chunks without
+    # being hashed again; everything else is hashed and only stored if the content is new.
+    members = []
+    stats = {'bytes': 0, 'reused': 0, 'stored': 0}
+    with runtime.copy_from(container_ref, path) as stream, tarfile.open(fileobj=stream, mode='r|') as archive:
+        for info in archive:
+            entry = member_entry(info)
+            if info.isfile():
+                stats['bytes'] += info.size
+                prior = previous_members.get(info.name)
+                if prior and prior['size'] == info.size and prior['mtime'] == info.mtime:
+                    entry['chunks'] = prior['chunks']
+                    stats['reused'] += info.size
+                else:
+                    for block in read_blocks(archive.extractfile(info)):
+                        digest = hashlib.sha256(block).hexdigest()
+                        entry['chunks'].append(digest)
+                        stats['stored'] += store.put(digest, block)
+            members.append(entry)
+    return {'path': path, 'members': members}, stats
+
+def capture_paths(runtime, container_ref, paths, store, previous=None, workers=4):
+    # One tar stream per path, read in parallel. Returns (trees, summed stats).
+    if not paths:
+        return [], {'bytes': 0, 'reused': 0, 'stored': 0}
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, capture_path, runtime, container_ref,
+                               path, store, (previous or {}).get(path, {}))
+                   for path in paths]
+        results = [future.result() for future in futures]
+    totals = {key: sum(stats[key] for _, stats in results) for key in ('bytes', 'reused', 'stored')}
+    return [tree for tree, _ in results], totals
+
+def restore_path(runtime, container_ref, tree, store):
+    # `cp` archives are rooted at the path's basename, so they extract into its parent
+    parent = posixpath.dirname(tree['path'].rstrip('/')) or '/'
+    with runtime.copy_to(container_ref, parent) as writer, tarfile.open(fileobj=writer, mode='w|') as archive:
+        for entry in tree['members']:
+            info = member_info(entry)
+            archive.addfile(info, ChunkReader(store, entry['chunks']) if info.isfile() else None)
+
+def restore_paths(runtime, container_ref, trees, workers=4):
+    if not trees:
+        return
+    store = local_store()
+    with ThreadPoolExecutor(max_workers=min(workers, len(trees))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, restore_path, runtime, container_ref, tree, store)
+                   for tree in trees]
+        for future in futures:
+            future.result()
+
+def captured_chunks(store, captured):
+    # Every chunk a capture needs, its manifest included
+    digests = [captured['manifest']]
+    for tree in load_manifest(store, captured)['paths']:
+        for entry in tree['members']:
+            digests.extend(entry['chunks'])
+    return digests
+
+# Mount types a new container can be given again; 'volume' mounts come back as fresh
+# anonymous volumes, since their contents are restored from the capture anyway
+MOUNT_TYPES = ('volume', 'bind', 'tmpfs')
+
+def mount_spec(mount):
+    # The part of an inspected mount needed to create it again
+    spec = {'type': mount.get('Type', 'volume'), 'destination': mount['Destination'],
+            'read_only': not mount.get('RW', True)}
+    if spec['type'] == 'bind':
+        spec['source'] = mount['Source']
+    return spec
+
+def recorded_mounts(volumes):
+    # Mounts to create the container with before restoring into it. Captures made
+    # before mounts were recorded only have their paths; those were volumes.
+    if 'mounts' in volumes:
+        return volumes['mounts']
+    return [{'type': 'volume', 'destination': path, 'read_only': False} for path in volumes['paths']]
+
+def unsupported_mount(mounts):
+    # The first recorded mount that cannot be created again, or None
+    return next((mount for mount in mounts or [] if mount['type'] not in MOUNT_TYPES), None)
+
+def snapshot_mounts(entry):
+    # Mounts a container for the snapshot entry needs, or None if it captured no volumes
+    return recorded_mounts(entry['volumes']) if entry.get('volumes') else None
+
+def capture_volumes(runtime, container_ref, previous=None, workers=4):
+    # Captures every mount of the container. Returns the 'volumes' value for the
+    # snapshot entry, or None if the container has no mounts.
+    mounts = runtime.list_mounts(container_ref)
+    if not mounts:
+        return None
+    store = local_store()
+    previous_trees = previous_members(load_manifest(store, previous)) if previous else None
+    destinations = sorted({mount['Destination'] for mount in mounts})
+    trees, stats = capture_paths(runtime, container_ref, destinations, store, previous_trees, workers)
+    return {
+        'manifest': save_manifest(store, {'paths': trees}),
+        'paths': destinations,
+        'mounts': sorted((mount_spec(mount) for mount in mounts), key=lambda spec: spec['destination']),
+        'bytes': stats['bytes'],
+        'reused_bytes': stats['reused'],
+        'stored_bytes': stats['stored'],
+    }
+
+def restore_volumes(runtime, container_ref, volumes, workers=4):
+    # Writes captured volume contents into a created, not yet started container, which
+    # must have been created with recorded_mounts(volumes)
+    restore_paths(runtime, container_ref, load_manifest(local_store(), volumes)['paths'], workers)
@@ -0,0 +1,59 @@
+# scon/utils/warm_pool.py
+
+import time
+from datetime import datetime
+from scon.utils.json_storage import snapshot_image
+from scon.utils.volumes import snapshot_mounts, unsupported_mount
+
+WARM_PREFIX = "scon_warm_"
+WARM_COMMAND = ['sleep', 'infinity']
+
+def is_warm_name(container_name):
+    return container_name.startswith(WARM_PREFIX)
+
+def refresh_warm_container(container_data, runtime):
+    # Keeps exactly one created-but-not-started container for next_snapshot_to_start.
+    # Returns True if the record changed.
+    next_snapshot = container_data.get('next_snapshot_to_start')
+    warm = container_data.get('warm_container')
+    mounts = snapshot_mounts(next_snapshot) if next_snapshot else None
+    if warm and next_snapshot and warm['image_id'] == snapshot_image(next_snapshot) and warm.get('mounts') == mounts:
+        return False
+
+    if warm:
+        # A newer snapshot arrived (or none is left); the old warm container is stale
+        runtime.remove_container(warm['container_id'])
+        del container_data['warm_container']
+    if not next_snapshot or unsupported_mount(mounts):
+        return bool(warm)
+
+    warm_name = f"{WARM_PREFIX}{container_data['name']}_{int(time.time())}"
+    container_id = runtime.create_container(warm_name, snapshot_image(next_snapshot), WARM_COMMAND, mounts)
+    if container_id:
+        container_data['warm_container'] = {
+            "name": warm_name,
+            "container_id": container_id,
+            "image_id": snapshot_image(next_snapshot),
+            "mounts": mounts,
+            "created_at": datetime.utcnow().isoformat()
+        }
+    return True
+
+def claim_warm_container(container_data, image_id, runtime, before_start=None, mounts=None):
+    # Renames and starts the warm container for image_id and mounts; None means start
+    # cold. before_start(container_id) runs between the two and can veto the start.
+    warm = container_data.pop('warm_container', None)
+    if not warm:
+        return None
+    if warm['image_id'] == image_id and warm.get('mounts') == mounts and runtime.rename(warm['container_id'], container_data['name']):
+        if (before_start is None or before_start(warm['container_id'])) and runtime.start_container(warm['container_id']):
+            return warm['container_id']
+    # Stale or unusable; drop it so a fresh container can take the name
+    runtime.remove_container(warm['container_id'])
+    return None
+
+def discard_warm_container(container_data, runtime):
+    warm = container_data.pop('warm_container', None)
+    if warm:
+        runtime.remove_container(warm['container_id'])
+    return warm
@@ -0,0 +1,166 @@
+# scon/utils/watcher.py
+
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scon.utils import (config_manager, container_manager, endpoints, json_storage, locks, runtime_client, scheduler,
+                        tracing)
+from scon.utils.log import log
+
+DEFAULT_DEBOUNCE_SECONDS = 5
+DEFAULT_MAX_COMMITS = 2
+RECONNECT_DELAY = 5
+EXIT_ACTIONS = {'die', 'died', 'stop'}
+
+def capture_exited_container(name):
+    # Same stop -> rename -> commit as `scon stop`, for a container that already exited.
+    # Skips SCs that scon itself stopped meanwhile or that came back up.
+    try:
+        with locks.sc_lock(name):
+            return capture_locked(name)
+    except TimeoutError as e:
+        return str(e)
+
+def capture_locked(name):
+    container_data = json_storage.get_stateful_container(name)
+    if not container_data or not container_data.get('containers'):
+        return None
+    if container_data['containers'][-1]['status'] != 'running':
+        return None
+    with endpoints.scope(endpoints.endpoint_of(container_data)):
+        return capture_on_current_endpoint(container_data)
+
+def capture_on_current_endpoint(container_data):
+    name = container_data['name']
+    runtime = container_manager.get_runtime()
+    if runtime.container_id(name) is None or runtime.container_id(name, running_only=True) is not None:
+        return None
+
+    ok, message = container_manager.stop_stateful_container(container_data, defer_commit=True)
+    if not ok:
+        return message
+    json_storage.save_stateful_container(container_data)
+    # Through the durable queue, so a commit interrupted by a restart is picked up again;
+    # if the process dies before this, process_jobs() queues it from the record
+    json_storage.get_job_queue().enqueue(name, 'commit', container_data['pending_commit'])
+    container_manager.process_jobs(name, 'commit')
+    return f"Auto-snapshotted '{name}' after it exited"
+
+
+class Watcher:
+    # Debounces exit events per SC and hands the commits to a small pool, so a mass
+    # shutdown is committed a few containers at a time
+
+    def __init__(self, max_commits=DEFAULT_MAX_COMMITS, debounce=DEFAULT_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self.pool = ThreadPoolExecutor(max_workers=max_commits)
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._queued = set()
+        # Captures run in a copy of this context, so `scon --trace watch` traces them
+        self._context = contextvars.copy_context()
+
+    def schedule(self, name):
+        # Every new event for an SC restarts its debounce window
+        with self._lock:
+            if self._timers.get(name):
+                self._timers[name].cancel()
+            timer = threading.Timer(self.debounce, self._submit, (name,))
+            timer.daemon = True
+            self._timers[name] = timer
+            timer.start()
+
+    def _submit(self, name):
+        with self._lock:
+            self._timers.pop(name, None)
+            if name in self._queued:
+                return
+            self._queued.add(name)
+        self.pool.submit(self._context.copy().run, self._capture, name)
+
+    def _capture(self, name):
+        try:
+            with tracing.sc_scope(name), tracing.span('sc.auto-snapshot'):
+                message = capture_exited_container(name)
+        except Exception as e:
+            message = f"Auto-snapshot of '{name}' failed: {e}"
+        finally:
+            with self._lock:
+                self._queued.discard(name)
+        if message:
+            log(message)
+        # A watcher runs for days; `scon stats` should not have to wait for it to exit
+        tracing.flush()
+
+    def catch_up(self, endpoint=endpoints.LOCAL):
+        # SCs on this endpoint recorded as running whose container is gone or stopped
+        # exited while nobody was watching (e.g. across a host reboot)
+        runtime = container_manager.get_runtime(endpoint)
+        for container_data in json_storage.load_stateful_containers():
+            containers = container_data.get('containers') or []
+            if containers and containers[-1]['status'] == 'running' \
+                    and endpoints.endpoint_of(container_data) == endpoint \
+                    and runtime.container_id(container_data['name'], running_only=True) is None:
+                self.schedule(container_data['name'])
+
+    def handle_event(self, event, endpoint=endpoints.LOCAL):
+        if event['type'] != 'container' or event['action'] not in EXIT_ACTIONS or not event['name']:
+            return
+        container_data = json_storage.get_stateful_container(event['name'])
+        if container_data is not None and endpoints.endpoint_of(container_data) == endpoint:
+            self.schedule(event['name'])
+
+    def close(self):
+        with self._lock:
+            timers, self._timers = list(self._timers.values()), {}
+        for timer in timers:
+            timer.cancel()
+        self.pool.shutdown(wait=True)
+
+
+def follow(watcher, endpoint):
+    # Feeds one endpoint's exit events to the watcher for as long as it runs
+    runtime = container_manager.get_runtime(endpoint)
+    since = f"{time.time():.6f}"
+    watcher.catch_up(endpoint)
+    while True:
+        try:
+            for event in runtime.events(since=since):
+                # The same stream keeps this process's runtime inventory current
+                runtime.inventory.apply_event(event)
+                if event['time']:
+                    since = str(event['time'])
+                watcher.handle_event(event, endpoint)
+        except (OSError, ValueError, runtime_client.ApiError) as e:
+            log(f"Event stream error ({endpoint}): {e}")
+        # The stream ended (daemon restart, socket closed); resume from the last event seen
+        log(f"Event stream of endpoint '{endpoint}' closed; reconnecting in {RECONNECT_DELAY}s")
+        time.sleep(RECONNECT_DELAY)
+        watcher.catch_up(endpoint)
+
+def run_watch(max_commits=None, debounce=None, schedule=False):
+    config = config_manager.load_config()
+    max_commits = max_commits or config.get('watch_max_commits', DEFAULT_MAX_COMMITS)
+    debounce = debounce if debounce is not None else config.get('watch_debounce', DEFAULT_DEBOUNCE_SECONDS)
+    runtime = container_manager.get_runtime(endpoints.LOCAL)
+    watcher = Watcher(max_commits, debounce)
+    names = endpoints.endpoint_names(config)
+    on_endpoints = f" on {len(names)} endpoints" if len(names) > 1 else ''
+    log(f"Watching {runtime.runtime} events{on_endpoints} (debounce {debounce}s, up to {max_commits} concurrent commits)")
+
+    # Each endpoint's stream is followed in a thread of its own; this one waits for Ctrl-C
+    for endpoint in names:
+        threading.Thread(target=contextvars.copy_context().run, args=(follow, watcher, endpoint), daemon=True).start()
+    scheduled = None
+    if schedule:
+        scheduled = scheduler.start_background(config)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        log("Stopping; waiting for in-flight snapshot commits")
+    finally:
+        watcher.close()
+        if scheduled:
+            scheduler.stop_background(*scheduled)
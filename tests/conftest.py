@@ -0,0 +1,28 @@
+# tests/conftest.py
+
+import os
+import sys
+import pytest
+from scon.utils import config_manager, container_manager, json_storage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_api
+import fake_runtime
+
+@pytest.fixture
+def scon_home(tmp_path, monkeypatch):
+    # scon with its own config, state store and job queue under tmp_path, talking to a
+    # fake runtime API; yields the fake API server, whose model is server.runtime.state
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path / 'data'))
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('SCON_NO_DAEMON', '1')
+    for name in ('_dirs', '_config', '_config_stamp'):
+        monkeypatch.setattr(config_manager, name, None)
+    server = fake_api.FakeApiServer(str(tmp_path / 'api.sock'), fake_runtime.empty_state()).start()
+    config_manager.save_config(dict(config_manager.DEFAULT_CONFIG, runtime_api='api',
+                                    runtime_socket=str(tmp_path / 'api.sock')))
+    yield server
+    container_manager.reset_runtime()
+    json_storage.reset_stores()
+    server.stop()
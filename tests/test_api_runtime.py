@@ -0,0 +1,96 @@
+# tests/test_api_runtime.py
+
+import os
+import sys
+import pytest
+from scon.utils import runtime_client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_api
+import fake_runtime
+
+@pytest.fixture
+def api(tmp_path):
+    server = fake_api.FakeApiServer(str(tmp_path / 'api.sock'), fake_runtime.empty_state()).start()
+    runtime = runtime_client.ApiRuntime(str(tmp_path / 'api.sock'))
+    yield server, runtime
+    runtime.close()
+    server.stop()
+
+def test_container_lifecycle(api):
+    server, runtime = api
+    assert runtime.ping()
+    container_id = runtime.run_container('web', fake_runtime.BASE_IMAGE, ['sleep', 'infinity'])
+    assert container_id
+    assert runtime.container_id('web') == container_id
+    assert runtime.container_id('web', running_only=True) == container_id
+    assert runtime.container_id('we') is None
+
+    assert runtime.stop('web')
+    # Already stopped is a 304, which counts as stopped
+    assert runtime.stop('web')
+    assert runtime.container_id('web', running_only=True) is None
+    assert runtime.list_containers() == [{'id': container_id, 'names': ['web'], 'image': fake_runtime.BASE_IMAGE,
+                                          'state': 'exited'}]
+
+    assert runtime.rename('web', 'web_stopped_1')
+    assert runtime.container_id('web') is None
+    assert runtime.remove_container('web_stopped_1')
+    assert runtime.list_containers() == []
+
+def test_commit_and_images(api):
+    server, runtime = api
+    runtime.create_container('web', fake_runtime.BASE_IMAGE, None)
+    assert runtime.commit('web', 'web_snapshot_1')
+    tags = {tag for image in runtime.list_images() for tag in image['tags']}
+    assert tags == {f"{fake_runtime.BASE_IMAGE}:latest", 'web_snapshot_1:latest'}
+    assert runtime.layer_count('web_snapshot_1') == 2
+
+    infos = runtime.inspect_images(['web_snapshot_1', 'missing'])
+    assert list(infos) == ['web_snapshot_1']
+    assert infos['web_snapshot_1']['Id'] == fake_runtime.digest('web_snapshot_1')
+
+    # The base image is in use by 'web'; a missing image counts as removed
+    assert runtime.remove_images(['web_snapshot_1', 'missing', fake_runtime.BASE_IMAGE]) == {'web_snapshot_1', 'missing'}
+    assert runtime.inspect_image('web_snapshot_1') is None
+
+def test_errors_are_reported_not_raised(api, capsys):
+    server, runtime = api
+    assert runtime.create_container('web', fake_runtime.BASE_IMAGE, None)
+    assert runtime.create_container('web', fake_runtime.BASE_IMAGE, None) is None
+    assert 'already in use' in capsys.readouterr().out
+    assert runtime.create_container('db', 'no-such-image', None) is None
+    assert not runtime.start_container('db')
+    assert not runtime.commit('db', 'db_snapshot_1')
+    with pytest.raises(runtime_client.ApiError) as error:
+        runtime.request('GET', '/images/no-such-image/json')
+    assert error.value.status == 404
+
+def test_connections_are_reused(api):
+    server, runtime = api
+    for _ in range(5):
+        runtime.container_id('web')
+    assert len(runtime._idle) == 1
+    assert [op for op, _ in server.calls] == ['GET /containers/json'] * 5
+
+def test_exec(api):
+    server, runtime = api
+    runtime.run_container('web', fake_runtime.BASE_IMAGE, ['sleep', 'infinity'])
+    assert runtime.exec_in('web', ['true'])
+    assert not runtime.exec_in('web', ['false'])
+    assert not runtime.exec_in('db', ['true'])
+    assert [op for op, _ in server.calls if 'exec' in op] == [
+        'POST /containers/{id}/exec', 'POST /exec/{id}/start', 'GET /exec/{id}/json'] * 2 + \
+        ['POST /containers/{id}/exec']
+
+def test_unreachable_runtime_fails_like_the_cli(tmp_path, capsys):
+    runtime = runtime_client.ApiRuntime(str(tmp_path / 'missing.sock'))
+    assert not runtime.ping()
+    assert runtime.run_container('web', fake_runtime.BASE_IMAGE, None) is None
+    assert not runtime.stop('web')
+    assert not runtime.exec_in('web', ['true'])
+    assert runtime.container_id('web') is None
+    assert runtime.list_containers() is None and runtime.list_images() is None
+    assert runtime.remove_images(['web_snapshot_1']) == set()
+    assert 'Cannot connect to docker' in capsys.readouterr().out
@@ -0,0 +1,45 @@
+# tests/test_bulk.py
+
+import threading
+from scon.utils import bulk
+from scon.utils.state_store import StaleRecordError
+
+def test_batch_committer_batches_what_queues_up_meanwhile():
+    batches, writing, release = [], threading.Event(), threading.Event()
+
+    def save_batch(records):
+        batches.append([record['name'] for record in records])
+        if len(batches) == 1:
+            writing.set()
+            release.wait(10)
+        if 'stale' in [record['name'] for record in records]:
+            raise StaleRecordError(['stale'])
+    committer = bulk.BatchCommitter(save_batch)
+    errors = {}
+
+    def save(name):
+        errors[name] = committer.save({'name': name})
+    first = threading.Thread(target=save, args=('a',))
+    first.start()
+    writing.wait(10)
+    # These queue up behind the batch being written and go out together
+    others = [threading.Thread(target=save, args=(name,)) for name in ('b', 'stale', 'c')]
+    for thread in others:
+        thread.start()
+    while len(committer._queued) < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [first] + others:
+        thread.join(10)
+
+    assert batches[0] == ['a']
+    assert sorted(batches[1]) == ['b', 'c', 'stale']
+    # The stale record is left out and the rest saved again
+    assert sorted(batches[2]) == ['b', 'c']
+    assert errors['a'] is None and errors['b'] is None and errors['c'] is None
+    assert 'changed by another scon process' in errors['stale']
+
+def test_batch_committer_reports_a_failed_write():
+    def save_batch(records):
+        raise OSError('disk full')
+    assert bulk.BatchCommitter(save_batch).save({'name': 'a'}) == "Failed to save 'a': disk full"
@@ -0,0 +1,46 @@
+# tests/test_config.py
+
+from scon.utils import (bulk, config_manager, container_manager, endpoints, incremental, runtime_client,
+                        scheduler, watcher)
+
+def test_defaults_match_what_each_module_falls_back_to():
+    defaults = {key: default for key, (_, default, _) in config_manager.SETTINGS.items()}
+    assert defaults['max_workers'] == bulk.DEFAULT_MAX_WORKERS
+    assert defaults['max_snapshots'] == container_manager.DEFAULT_MAX_SNAPSHOTS
+    assert defaults['retention_days'] == container_manager.DEFAULT_RETENTION_DAYS
+    assert defaults['flatten_threshold'] == container_manager.DEFAULT_FLATTEN_THRESHOLD
+    assert defaults['checkpoint_interval'] == incremental.DEFAULT_CHECKPOINT_INTERVAL
+    assert defaults['runtime_api'] == runtime_client.DEFAULT_RUNTIME_API
+    assert defaults['watch_max_commits'] == watcher.DEFAULT_MAX_COMMITS
+    assert defaults['watch_debounce'] == watcher.DEFAULT_DEBOUNCE_SECONDS
+    assert defaults['schedule_max_commits'] == scheduler.DEFAULT_MAX_COMMITS
+    assert defaults['schedule_window'] == scheduler.DEFAULT_WINDOW
+    assert defaults['endpoint_timeout'] == endpoints.DEFAULT_ENDPOINT_TIMEOUT
+
+def test_set_and_show(scon_home, capsys):
+    config_manager.set_config('max_snapshots', '3')
+    config_manager.set_config('schedule_byte_budget', '1K')
+    config_manager.set_config('warm_pool', 'TRUE')
+    config_manager.set_config('endpoint', 'b1=/run/b1.sock')
+    assert capsys.readouterr().out.splitlines() == [
+        "Set max_snapshots to 3", "Set schedule_byte_budget to 1024", "Set warm_pool to True",
+        "Set runtime endpoint 'b1' to unix:///run/b1.sock"]
+    config = config_manager.load_config()
+    assert (config['max_snapshots'], config['schedule_byte_budget'], config['warm_pool']) == (3, 1024, True)
+
+    # Nothing invalid is saved
+    for key, value in (('max_snapshots', '0'), ('container_runtime', 'lxc'), ('endpoint', 'local=/x'),
+                       ('snapshots', '1')):
+        config_manager.set_config(key, value)
+    assert config_manager.load_config() == config
+    assert capsys.readouterr().out.splitlines()[:2] == [
+        "Invalid value for max_snapshots. Use a positive integer.",
+        "Invalid value for container_runtime. Use 'docker' or 'podman'."]
+
+    # Every key shows, at its default unless it was set
+    config_manager.show_config()
+    shown = capsys.readouterr().out.splitlines()
+    assert [line.split(':')[0].strip() for line in shown[1:len(config_manager.SETTINGS) + 1]] == \
+        list(config_manager.SETTINGS)
+    assert {"  max_snapshots: 3", "  retention_days: 30", "  schedule_window: 3600", "  warm_pool: True",
+            "    b1: unix:///run/b1.sock"} <= set(shown)
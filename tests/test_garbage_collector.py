@@ -0,0 +1,153 @@
+# tests/test_garbage_collector.py
+
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from scon.utils import chunk_store, garbage_collector, volumes
+
+def ago(days):
+    return (datetime.utcnow() - timedelta(days=days)).isoformat()
+
+def snapshot(image, days, **fields):
+    return dict({'name': image, 'image_id': image, 'created_at': ago(days), 'source_container': f"{image}_c"},
+                **fields)
+
+def sc(name, snapshots, **fields):
+    return dict({'name': name, 'image': 'alpine', 'containers': [{'name': name, 'image': 'alpine'}],
+                 'snapshots': snapshots, 'next_snapshot_to_start': dict(snapshots[-1]) if snapshots else None},
+                **fields)
+
+def test_plan_keeps_what_is_reachable():
+    web = sc('web', [snapshot('web_1', 60), snapshot('web_2', 50, tagged=True), snapshot('web_3', 3),
+                     snapshot('web_4', 2), snapshot('web_5', 1)],
+             warm_container={'image_id': 'web_4'}, pending_commit={'image': 'web_6'})
+    db = sc('db', [snapshot('db_1', 40), snapshot('db_2', 1)])
+    result = garbage_collector.plan([web, db], [], max_snapshots=1, retention_days=30)
+    # Tagged, next to start, warm and within max_snapshots stay; the rest go
+    assert result['images'] == {'web_1': 'web', 'web_3': 'web', 'db_1': 'db'}
+
+    # Within max_snapshots and retention_days, nothing goes
+    assert garbage_collector.plan([web], [], max_snapshots=3, retention_days=30)['images'] == {'web_1': 'web'}
+
+def test_plan_marks_across_every_sc():
+    # An image reachable from one SC is never swept for another that also lists it
+    web = sc('web', [snapshot('shared', 60), snapshot('web_2', 1)])
+    clone = sc('clone', [snapshot('shared', 60)])
+    assert garbage_collector.plan([web, clone], [], max_snapshots=1, retention_days=30)['images'] == {}
+
+def test_plan_sweeps_committed_stopped_containers_only():
+    web = sc('web', [snapshot('web_1', 2), snapshot('web_2', 1)])
+    runtime_containers = [
+        {'id': 'a', 'names': ['web_1_c'], 'state': 'exited'},
+        {'id': 'b', 'names': ['web_2_c'], 'state': 'running'},
+        # Not committed to any snapshot yet
+        {'id': 'c', 'names': ['web_3_c'], 'state': 'exited'},
+    ]
+    result = garbage_collector.plan([web], runtime_containers, max_snapshots=5, retention_days=30)
+    assert result['containers'] == {'a': 'web'}
+    assert garbage_collector.plan([web], runtime_containers, 5, 30, include_stopped=False)['containers'] == {}
+
+def test_plan_per_endpoint():
+    web = sc('web', [snapshot('web_1', 60, endpoint='local'), snapshot('web_2', 50), snapshot('web_3', 1)],
+             endpoint='b1')
+    assert garbage_collector.plan([web], [], 1, 30, endpoint='local')['images'] == {'web_1': 'web'}
+    assert garbage_collector.plan([web], [], 1, 30, endpoint='b1')['images'] == {'web_2': 'web'}
+
+def put(store, data):
+    digest = hashlib.sha256(data).hexdigest()
+    store.put(digest, data)
+    return digest
+
+def age(store, digest, seconds):
+    path = store.chunk_path(digest)
+    os.utime(path, (time.time() - seconds,) * 2)
+
+def capture(store, *contents):
+    members = [{'name': f"file{number}", 'chunks': [put(store, data)]} for number, data in enumerate(contents)]
+    return {'manifest': volumes.save_manifest(store, {'paths': [{'path': '/data', 'members': members}]})}
+
+def test_chunk_mark_and_sweep(tmp_path):
+    store = chunk_store.ChunkStore(str(tmp_path))
+    kept = capture(store, b'kept')
+    dropped = capture(store, b'dropped')
+    delta = capture(store, b'delta')
+    exported = put(store, b'exported')
+    store.save_manifest('web', {'images': [{'members': [{'diff_id': 'sha256:x', 'chunks': [exported]}]}],
+                        'captured_chunks': []})
+    orphan = put(store, b'orphan')
+    recent = put(store, b'recent')
+    web = sc('web', [snapshot('web_1', 2, volumes=dropped), snapshot('web_2', 1, volumes=kept, delta=delta)])
+    for digest, _ in store.chunk_files():
+        if digest != recent:
+            age(store, digest, garbage_collector.CHUNK_GRACE_SECONDS + 60)
+
+    marked = garbage_collector.marked_chunks([web], store)
+    assert {exported, kept['manifest'], delta['manifest']} <= marked
+    assert orphan not in marked
+
+    # web_1 is about to be dropped, so its capture is not marked
+    marked = garbage_collector.marked_chunks([web], store, dropping={('local', 'web_1')})
+    assert dropped['manifest'] not in marked
+    assert garbage_collector.sweep_chunks(store, marked, dry_run=True)[0] == 3
+    assert store.has(orphan)
+
+    count, size = garbage_collector.sweep_chunks(store, marked)
+    # The dropped capture's manifest and file, and the orphan; the recent chunk is in its grace period
+    assert count == 3 and size > 0
+    assert not store.has(orphan) and not store.has(dropped['manifest'])
+    assert store.has(recent) and store.has(exported)
+    assert volumes.captured_chunks(store, kept) and volumes.captured_chunks(store, delta)
+
+def delta(name, checkpoint, days):
+    return snapshot(name, days, base_image_id=checkpoint, delta={'checkpoint': checkpoint})
+
+def test_deltas_on_one_checkpoint(tmp_path, monkeypatch):
+    from scon.utils import container_manager, listing, state_store
+    web = sc('web', [snapshot('web_1', 5), delta('web_2', 'web_1', 4), delta('web_3', 'web_1', 3),
+                     delta('web_4', 'web_1', 2), delta('web_5', 'web_1', 1)])
+    # Every delta is a snapshot of its own in list and in the SQLite index
+    assert listing.FIELDS['snapshots'](web) == 5
+    store = state_store.SqliteStateStore(str(tmp_path / 'stateful_containers.db'))
+    store.put(web)
+    assert len(store.snapshots_older_than(ago(-1))) == 5
+    store.close()
+
+    # The checkpoint is out of the newest two but both kept deltas go on top of it
+    assert garbage_collector.kept_snapshots(web, 2, 30) == {'web_4', 'web_5'}
+    assert garbage_collector.plan([web], [], max_snapshots=2, retention_days=30)['images'] == {}
+
+    removed = []
+    class Runtime:
+        def remove_images(self, images):
+            removed.extend(images)
+            return set(images)
+    monkeypatch.setattr(container_manager, 'get_runtime', lambda endpoint=None: Runtime())
+    assert container_manager.prune_snapshots(web, 2, 30, garbage_collector.oldest_first) == 3
+    assert [entry['image_id'] for entry in web['snapshots']] == ['web_4', 'web_5']
+    assert removed == []
+
+    # Once no kept delta needs it, the checkpoint image goes too
+    web['snapshots'].append(snapshot('web_6', 0))
+    web['next_snapshot_to_start'] = dict(web['snapshots'][-1])
+    assert container_manager.prune_snapshots(web, 1, 30, garbage_collector.oldest_first) == 2
+    assert removed == ['web_1']
+
+def test_retention_drops_what_frees_the_most(monkeypatch):
+    from scon.utils import usage
+    web = sc('web', [snapshot('web_1', 4), snapshot('web_2', 3), snapshot('web_3', 2), snapshot('web_4', 1)])
+    # web_4 goes on top of web_1; web_2 and web_3 went elsewhere
+    infos = {'alpine': {'size': 10, 'layers': ['b']}, 'web_1': {'size': 15, 'layers': ['b', 'y']},
+             'web_2': {'size': 110, 'layers': ['b', 'x']}, 'web_3': {'size': 15, 'layers': ['b', 'z']},
+             'web_4': {'size': 20, 'layers': ['b', 'y', 'w']}}
+    accounts = {'local': usage.account([web], 'local', {'ids': {ref: ref for ref in infos}, 'infos': infos})}
+    choose = usage.retention_picker(accounts)
+
+    # By age web_1 and web_2 would go, but web_1 frees nothing while web_4 needs its layer
+    assert garbage_collector.kept_snapshots(web, 2, 30) == {'web_3', 'web_4'}
+    assert garbage_collector.kept_snapshots(web, 2, 30, choose=choose) == {'web_1', 'web_4'}
+    assert garbage_collector.plan([web], [], 2, 30, choose=choose)['images'] == {'web_2': 'web', 'web_3': 'web'}
+    # With more to drop than free anything, the oldest of the rest go
+    assert garbage_collector.kept_snapshots(web, 1, 30, choose=choose) == {'web_4'}
+    assert usage.pick_reclaimable(accounts, {'local': ['web_1', 'web_2', 'web_3']}, float('inf'), 1) == \
+        ({'local': {'web_2'}}, 100)
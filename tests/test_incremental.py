@@ -0,0 +1,21 @@
+# tests/test_incremental.py
+
+from scon.utils import incremental
+
+def test_leaf_changes():
+    changes = [('C', '/etc'), ('A', '/etc/app'), ('A', '/etc/app/config.yml'), ('C', '/var'), ('C', '/var/lib'),
+               ('C', '/var/lib/db'), ('D', '/var/lib/db/old.log'), ('A', '/var/lib/db/new.log'), ('A', '/empty')]
+    copied, deleted = incremental.leaf_changes(changes)
+    # Directories above a change are not copied; a new empty directory is
+    assert copied == ['/empty', '/etc/app/config.yml', '/var/lib/db/new.log']
+    assert deleted == ['/var/lib/db/old.log']
+
+def test_checkpoint_due():
+    next_snapshot = {'image_id': 'web_2', 'base_image_id': 'web_1', 'delta': {'checkpoint': 'web_1', 'number': 2}}
+    record = {'next_snapshot_to_start': next_snapshot, 'containers': [{'image': 'web_1'}]}
+    assert not incremental.checkpoint_due(record, 10)
+    # Every interval-th snapshot is a full commit
+    assert incremental.checkpoint_due(record, 3)
+    # A container that did not start from the checkpoint has no delta to take
+    assert incremental.checkpoint_due(dict(record, containers=[{'image': 'alpine'}]), 10)
+    assert incremental.checkpoint_due(dict(record, next_snapshot_to_start=None), 10)
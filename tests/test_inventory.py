@@ -0,0 +1,56 @@
+# tests/test_inventory.py
+
+from scon.utils import inventory
+
+WEB_ID = 'a' * 64
+DB_ID = 'b' * 64
+
+class Runtime:
+    # Counts the bulk listings the inventory makes
+    def __init__(self, containers, images):
+        self.containers, self.images = containers, images
+        self.listings = 0
+
+    def list_containers(self):
+        self.listings += 1
+        return self.containers
+
+    def list_images(self):
+        self.listings += 1
+        return self.images
+
+def event(action, container_id, name='', image='alpine', kind='container'):
+    return {'type': kind, 'action': action, 'id': container_id, 'name': name, 'image': image}
+
+def test_apply_event_follows_container_lifecycle():
+    runtime = Runtime([{'id': WEB_ID, 'names': ['web'], 'image': 'alpine', 'state': 'running'}],
+                      [{'id': 'sha256:' + 'c' * 64, 'tags': ['alpine:latest']}])
+    tracked = inventory.RuntimeInventory(runtime)
+    assert tracked.container_id('web', running_only=True) == WEB_ID
+
+    tracked.apply_event(event('die', WEB_ID))
+    assert tracked.container_id('web', running_only=True) is None
+    tracked.apply_event(event('rename', WEB_ID, 'web_stopped_1'))
+    assert tracked.container_id('web') is None
+    assert tracked.container('web_stopped_1')['state'] == 'exited'
+
+    tracked.apply_event(event('create', DB_ID, 'db'))
+    assert tracked.container('db')['state'] == 'created'
+    tracked.apply_event(event('start', DB_ID, 'db'))
+    assert tracked.container_id('db', running_only=True) == DB_ID
+    # Found by its short ID too
+    assert tracked.container(DB_ID[:12])['names'] == ['db']
+    tracked.apply_event(event('destroy', DB_ID, 'db'))
+    assert tracked.container('db') is None and tracked.container(DB_ID[:12]) is None
+    # A container started before it was seen is added running
+    tracked.apply_event(event('start', 'd' * 64, 'cache'))
+    assert tracked.container_id('cache', running_only=True) == 'd' * 64
+    assert runtime.listings == 1
+
+    # Image events drop the image index, listed again on next use
+    assert tracked.has_image('alpine')
+    runtime.images = []
+    assert tracked.has_image('alpine')
+    tracked.apply_event(event('delete', 'sha256:' + 'c' * 64, kind='image'))
+    assert not tracked.has_image('alpine')
+    assert runtime.listings == 3
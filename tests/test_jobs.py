@@ -0,0 +1,106 @@
+# tests/test_jobs.py
+
+import subprocess
+from scon.utils import container_manager, job_queue, json_storage
+
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+def test_claim_fail_and_retry(tmp_path):
+    queue = job_queue.JobQueue(str(tmp_path / 'jobs.db'))
+    first = queue.enqueue('web', 'commit', {'image': 'web_1'})
+    second = queue.enqueue('db', 'commit', {'image': 'db_1'})
+    assert queue.queued_commits() == {('web', 'web_1'), ('db', 'db_1')}
+    assert queue.queued_commits('db') == {('db', 'db_1')}
+
+    # Oldest first, skipping SCs another process holds
+    assert queue.claim_next(exclude={'web'})['id'] == second
+    job = queue.claim_next()
+    assert (job['id'], job['status'], job['attempts']) == (first, 'running', 1)
+    assert queue.claim_next() is None
+
+    # Handed back untried, a job keeps its attempts
+    queue.release(first)
+    assert queue.claim_next()['attempts'] == 1
+    for attempt in range(1, job_queue.MAX_ATTEMPTS):
+        assert queue.fail(first, 'boom') == 'pending'
+        assert queue.claim_next()['attempts'] == attempt + 1
+    assert queue.fail(first, 'boom') == 'failed'
+    assert queue.claim_next() is None
+    assert queue.queued_commits('web') == set()
+
+    assert queue.retry(first)
+    assert queue.claim_next()['attempts'] == 1
+    queue.complete(first)
+    queue.complete(second)
+    assert queue.purge_done() == 2
+    queue.close()
+
+def test_requeue_abandoned(tmp_path):
+    queue = job_queue.JobQueue(str(tmp_path / 'jobs.db'))
+    crashed = queue.enqueue('web', 'commit', {'image': 'web_1'})
+    alive = queue.enqueue('db', 'commit', {'image': 'db_1'})
+    queue.claim_next()
+    queue.claim_next()
+    queue._conn.execute("UPDATE jobs SET worker_pid = ? WHERE id = ?", (dead_pid(), crashed))
+
+    # Only the job of the worker that is gone goes back to the queue
+    assert queue.requeue_abandoned() == 1
+    assert [job['id'] for job in queue.list_jobs('pending')] == [crashed]
+    assert [job['id'] for job in queue.list_jobs('running')] == [alive]
+    queue.close()
+
+def stopped_sc(server, name, image):
+    # A record stopped with its commit deferred, and the renamed container it waits on
+    server.runtime.create(f"{name}_stopped_1", 'alpine')
+    record = {'name': name, 'image': 'alpine', 'snapshots': [], 'next_snapshot_to_start': None,
+              'containers': [{'name': name, 'container_id': None, 'image': 'alpine', 'status': 'stopped'}],
+              'pending_commit': {'container': f"{name}_stopped_1", 'image': image, 'queued_at': '2026-01-01T00:00:00'}}
+    json_storage.save_stateful_container(record)
+
+def test_commit_that_a_crash_left_unqueued(scon_home):
+    stopped_sc(scon_home, 'web', 'web_snapshot_1')
+    queue = json_storage.get_job_queue()
+    assert queue.list_jobs() == []
+
+    assert container_manager.process_jobs() == 1
+    record = json_storage.get_stateful_container('web')
+    assert 'pending_commit' not in record
+    assert record['next_snapshot_to_start']['image_id'] == 'web_snapshot_1'
+    assert 'web_snapshot_1' in scon_home.runtime.state['images']
+    assert [job['status'] for job in queue.list_jobs()] == ['done']
+    # Committed once; running again finds nothing to do
+    assert container_manager.process_jobs() == 0
+
+def test_job_of_a_crashed_worker_runs_again(scon_home):
+    stopped_sc(scon_home, 'web', 'web_snapshot_1')
+    queue = json_storage.get_job_queue()
+    job_id = queue.enqueue('web', 'commit', json_storage.get_stateful_container('web')['pending_commit'])
+    queue.claim_next()
+    queue._conn.execute("UPDATE jobs SET worker_pid = ? WHERE id = ?", (dead_pid(), job_id))
+
+    assert container_manager.process_jobs() == 1
+    assert json_storage.get_stateful_container('web')['next_snapshot_to_start']['image_id'] == 'web_snapshot_1'
+    assert [(job['id'], job['status']) for job in queue.list_jobs()] == [(job_id, 'done')]
+
+def test_failing_commit_is_retried_then_marked(scon_home, capsys):
+    stopped_sc(scon_home, 'web', 'web_snapshot_1')
+    scon_home.runtime.remove_container('web_stopped_1')
+    queue = json_storage.get_job_queue()
+
+    assert container_manager.process_jobs() == job_queue.MAX_ATTEMPTS
+    [job] = queue.list_jobs()
+    assert (job['status'], job['attempts']) == ('failed', job_queue.MAX_ATTEMPTS)
+    record = json_storage.get_stateful_container('web')
+    assert 'Failed to commit' in record['pending_commit']['error']
+    # A failed commit is not queued again behind the user's back
+    assert container_manager.process_jobs() == 0
+    assert 'Failed to commit' in capsys.readouterr().out
+
+    # Once the container is back, `scon jobs retry` lets it through
+    scon_home.runtime.create('web_stopped_1', 'alpine')
+    assert queue.retry(job['id'])
+    assert container_manager.process_jobs() == 1
+    assert json_storage.get_stateful_container('web')['next_snapshot_to_start']['image_id'] == 'web_snapshot_1'
@@ -0,0 +1,73 @@
+# tests/test_reconcile.py
+
+from scon.utils import reconcile
+from scon.utils.inventory import build_inventory
+
+WEB_ID = 'a' * 64
+
+def inventory(containers, images):
+    return {'local': build_inventory([{'id': container_id, 'names': [name], 'image': 'alpine', 'state': state}
+                                      for container_id, name, state in containers],
+                                     [{'id': f"sha256:{image * 8}", 'tags': [f"{image}:latest"]} for image in images])}
+
+def snapshot(image, created_at):
+    return {'name': image, 'image_id': image, 'created_at': created_at}
+
+def record(**fields):
+    return dict({'name': 'web', 'image': 'alpine',
+                 'containers': [{'name': 'web', 'container_id': WEB_ID, 'image': 'alpine', 'status': 'running'}],
+                 'snapshots': [snapshot('web_1', '2026-01-01'), snapshot('web_2', '2026-01-02')],
+                 'next_snapshot_to_start': snapshot('web_2', '2026-01-02')}, **fields)
+
+class Queue:
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, sc_name, kind, payload):
+        self.jobs.append((sc_name, kind, payload['image']))
+
+def test_consistent_record_has_no_issues():
+    inventories = inventory([(WEB_ID, 'web', 'running')], ['alpine', 'web_1', 'web_2'])
+    assert reconcile.check_container(record(), inventories) == []
+
+def test_repairs_status_and_missing_snapshots():
+    web = record()
+    inventories = inventory([(WEB_ID, 'web', 'exited')], ['alpine', 'web_1'])
+    assert reconcile.check_container(web, inventories, repair=True) == [
+        "recorded as running but no running container exists",
+        "snapshot image missing: web_2"]
+    assert web['containers'][-1]['status'] == 'stopped'
+    # Start falls back to the newest snapshot left
+    assert [entry['image_id'] for entry in web['snapshots']] == ['web_1']
+    assert web['next_snapshot_to_start']['image_id'] == 'web_1'
+
+    # Started behind scon's back
+    web = record(containers=[{'name': 'web', 'container_id': None, 'image': 'alpine', 'status': 'stopped'}])
+    inventories = inventory([(WEB_ID, 'web', 'running')], ['alpine', 'web_1', 'web_2'])
+    assert reconcile.check_container(web, inventories, repair=True) == \
+        ["recorded as stopped but container 'web' is running"]
+    assert web['containers'][-1] == {'name': 'web', 'container_id': WEB_ID, 'image': 'alpine', 'status': 'running'}
+
+def test_pending_commits():
+    pending = {'container': 'web_stopped_1', 'image': 'web_3'}
+    inventories = inventory([('b' * 64, 'web_stopped_1', 'exited')], ['alpine', 'web_1', 'web_2'])
+    stopped = [{'name': 'web', 'container_id': None, 'image': 'alpine', 'status': 'stopped'}]
+
+    # Queued, all is well; never queued, it is queued now
+    web = record(containers=stopped, pending_commit=dict(pending))
+    assert reconcile.check_container(web, inventories, {('web', 'web_3')}) == []
+    queue = Queue()
+    assert reconcile.check_container(web, inventories, repair=True, queue=queue) == \
+        ["pending commit was never queued: web_3"]
+    assert queue.jobs == [('web', 'commit', 'web_3')]
+
+    # The stopped container it would commit is gone, so nothing can commit it
+    web = record(containers=stopped, pending_commit=dict(pending))
+    assert reconcile.check_container(web, inventory([], ['alpine', 'web_1', 'web_2']), repair=True, queue=queue) == \
+        ["pending commit's stopped container is gone: web_stopped_1"]
+    assert 'pending_commit' not in web
+
+def test_endpoint_that_did_not_answer_is_not_checked():
+    web = record(snapshots=[dict(snapshot('web_1', '2026-01-01'), endpoint='b1'), snapshot('web_2', '2026-01-02')])
+    inventories = inventory([(WEB_ID, 'web', 'running')], ['alpine', 'web_2'])
+    assert reconcile.check_container(web, inventories) == []
@@ -0,0 +1,66 @@
+# tests/test_scheduler.py
+
+from concurrent.futures import ThreadPoolExecutor
+from scon.utils import json_storage, scheduler
+
+def test_byte_budget():
+    budget = scheduler.ByteBudget(limit=100, window=60)
+    # One commit always goes through an empty window, however large
+    assert budget.allows(500, now=0)
+    budget.charge(500, now=0)
+    assert not budget.allows(1, now=30)
+    assert budget.used(now=30) == 500
+
+    # Spent bytes leave the window after window seconds
+    assert budget.allows(60, now=60)
+    budget.charge(60, now=60)
+    assert budget.allows(40, now=70) and not budget.allows(41, now=70)
+    budget.charge(40, now=70)
+    assert budget.used(now=119) == 100
+    assert budget.used(now=125) == 40
+
+def test_byte_budget_without_a_limit():
+    budget = scheduler.ByteBudget(limit=0, window=60)
+    budget.charge(10 ** 12, now=0)
+    assert budget.allows(10 ** 12, now=1)
+
+def running_sc(server, name, size):
+    container_id, _ = server.runtime.create(name, 'alpine', running=True)
+    server.runtime.state['containers'][container_id]['size_rw'] = size
+    json_storage.save_stateful_container({
+        'name': name, 'image': 'alpine', 'snapshots': [], 'next_snapshot_to_start': None, 'snapshot_interval': 60,
+        'containers': [{'name': name, 'container_id': container_id, 'image': 'alpine', 'status': 'running',
+                        'created_at': '2026-01-01T00:00:00'}]})
+
+def test_tick_measures_only_when_it_decides_something(scon_home, monkeypatch):
+    committed = []
+    monkeypatch.setattr(scheduler, 'snapshot_due', lambda name, size: committed.append((name, size)))
+    for name, size in (('small', 10), ('large', 300), ('medium', 200)):
+        running_sc(scon_home, name, size)
+
+    def inspects():
+        return len([op for op, _ in scon_home.calls if op == 'GET /containers/{id}/json'])
+
+    # Enough slots and no budget: every due SC goes, unmeasured
+    pool = scheduler.Scheduler(max_commits=3)
+    assert pool.tick() == 3
+    pool.close()
+    assert sorted(committed) == [('large', None), ('medium', None), ('small', None)] and inspects() == 0
+
+    # One slot: the most grown goes first; the sizes of the rest are reused while they wait
+    committed.clear()
+    pool = scheduler.Scheduler(max_commits=1)
+    assert pool.tick() == 1
+    pool.close()
+    assert committed == [('large', 300)] and inspects() == 3
+    pool.pool = ThreadPoolExecutor(max_workers=1)
+    assert pool.tick() == 1
+    pool.close()
+    assert committed == [('large', 300), ('large', 300)] and inspects() == 4
+
+    # A budget passes over what does not fit for what still does
+    committed.clear()
+    pool = scheduler.Scheduler(max_commits=3, byte_budget=400)
+    assert pool.tick() == 2
+    pool.close()
+    assert sorted(committed) == [('large', 300), ('small', 10)]
@@ -0,0 +1,172 @@
+# tests/test_state_store.py
+
+import fnmatch
+import json
+import multiprocessing
+import os
+import pytest
+from scon.utils import state_store
+
+BACKENDS = {
+    'json': lambda directory: state_store.JsonStateStore(os.path.join(directory, 'stateful_containers.json')),
+    'sqlite': lambda directory: state_store.SqliteStateStore(os.path.join(directory, 'stateful_containers.db')),
+    'journal': lambda directory: state_store.JournalStateStore(os.path.join(directory, 'stateful_containers.journal')),
+}
+
+def record(name, **fields):
+    return dict({'name': name, 'containers': [], 'snapshots': [], 'next_snapshot_to_start': None, 'deleted': []},
+                **fields)
+
+def open_store(backend, directory):
+    return BACKENDS[backend](str(directory))
+
+@pytest.mark.parametrize('backend', ['sqlite', 'journal'])
+def test_migrates_legacy_json_once(backend, tmp_path):
+    json_path = tmp_path / 'stateful_containers.json'
+    json_path.write_text(json.dumps([record('a'), record('b', labels={'team': 'x'})]))
+    store = open_store(backend, tmp_path)
+    assert store.migrate_from_json(str(json_path)) == 2
+    assert [r['name'] for r in store.load_all()] == ['a', 'b']
+    assert store.get('b')['labels'] == {'team': 'x'}
+    assert not json_path.exists()
+    assert (tmp_path / 'stateful_containers.json.migrated').exists()
+
+    # A JSON file turning up again later is not imported over the store
+    json_path.write_text(json.dumps([record('c')]))
+    assert store.migrate_from_json(str(json_path)) == 0
+    store.close()
+    store = open_store(backend, tmp_path)
+    assert sorted(store.names()) == ['a', 'b']
+    store.close()
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_put_of_a_stale_record_fails(backend, tmp_path):
+    store = open_store(backend, tmp_path)
+    store.put(record('a'))
+    first, second = store.get('a'), store.get('a')
+    first['labels'] = {'by': 'first'}
+    store.put(first)
+    second['labels'] = {'by': 'second'}
+    with pytest.raises(state_store.StaleRecordError) as error:
+        store.put(second)
+    assert error.value.names == ['a']
+    assert store.get('a')['labels'] == {'by': 'first'}
+
+    # A batch with one stale record writes none of them
+    store.put(record('b'))
+    fresh, stale = store.get('b'), second
+    fresh['labels'] = {'by': 'batch'}
+    with pytest.raises(state_store.StaleRecordError):
+        store.put_many([fresh, stale])
+    assert 'labels' not in store.get('b')
+
+    # Re-read, the write goes through
+    current = store.get('a')
+    current['labels'] = {'by': 'second'}
+    store.put(current)
+    assert store.get('a')['labels'] == {'by': 'second'}
+    store.close()
+
+def test_journal_recovers_from_a_torn_and_a_damaged_record(tmp_path, capsys):
+    path = tmp_path / 'stateful_containers.journal'
+    store = state_store.JournalStateStore(str(path))
+    store.put(record('a'))
+    store.put(record('b'))
+    store.close()
+
+    # A complete line whose checksum does not match, then a write cut short by a crash
+    damaged = state_store.encode_journal_entry({'op': 'put', 'record': record('c')}).replace(b'"c"', b'"d"')
+    torn = state_store.encode_journal_entry({'op': 'put', 'record': record('e')})[:-10]
+    with open(path, 'ab') as file:
+        file.write(damaged + torn)
+
+    store = state_store.JournalStateStore(str(path))
+    assert sorted(store.names()) == ['a', 'b']
+    assert 'damaged state journal record' in capsys.readouterr().out
+    # The next write truncates the torn tail before appending
+    store.put(record('f'))
+    store.close()
+    assert path.read_bytes().endswith(state_store.encode_journal_entry({'op': 'put', 'record': dict(record('f'), version=1)}))
+    store = state_store.JournalStateStore(str(path))
+    assert sorted(store.names()) == ['a', 'b', 'f']
+    store.close()
+
+def test_journal_compaction(tmp_path):
+    path = tmp_path / 'stateful_containers.journal'
+    store = state_store.JournalStateStore(str(path), compact_bytes=2048)
+    for number in range(50):
+        store.put(record(f"sc-{number}", labels={'n': str(number)}))
+    store.delete('sc-0')
+    # close() waits for the background compaction
+    store.close()
+    assert (tmp_path / 'stateful_containers.journal.checkpoint').exists()
+    assert path.stat().st_size < 2048 + 512
+
+    store = state_store.JournalStateStore(str(path))
+    assert len(store.names()) == 49
+    assert store.get('sc-49')['labels'] == {'n': '49'}
+    assert store.get('sc-49')['version'] == 1
+    store.close()
+
+def test_journal_crash_between_checkpoint_and_new_journal(tmp_path, capsys):
+    path = tmp_path / 'stateful_containers.journal'
+    store = state_store.JournalStateStore(str(path))
+    store.put(record('a'))
+    store.put(record('b'))
+    old_journal = path.read_bytes()
+    store.compact()
+    store.close()
+
+    # The checkpoint made it to disk but the old journal is still in place; one more
+    # record appended past what the checkpoint covers has to be replayed once
+    with open(path, 'wb') as file:
+        file.write(old_journal + state_store.encode_journal_entry({'op': 'put', 'record': dict(record('c'), version=1)}))
+    store = state_store.JournalStateStore(str(path))
+    assert sorted(store.names()) == ['a', 'b', 'c']
+    assert 'does not match its checkpoint' not in capsys.readouterr().out
+    store.close()
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_name_globs_match_fnmatch(backend, tmp_path):
+    names = ['web', 'db', 'a[b', '^x', ']y', 'w!']
+    store = open_store(backend, tmp_path)
+    store.put_many([record(name) for name in names])
+    for globs in (['[!w]*'], ['[^x]*'], ['a[b'], ['w*', 'd?'], ['[]]*'], ['[!]]*'], ['w[!a-c]']):
+        expected = [name for name in names if any(fnmatch.fnmatchcase(name, g) for g in globs)]
+        assert [r['name'] for r in store.scan(name_globs=globs)] == expected, globs
+    store.close()
+
+def bump(backend, directory, rounds):
+    # Optimistic read-modify-write, retried whenever another process got there first
+    store = open_store(backend, directory)
+    for _ in range(rounds):
+        while True:
+            current = store.get('counter')
+            current['count'] += 1
+            try:
+                store.put(current)
+                break
+            except state_store.StaleRecordError:
+                continue
+        store.update('total', lambda r: r.update(count=r['count'] + 1))
+    store.close()
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_concurrent_processes_lose_no_updates(backend, tmp_path):
+    store = open_store(backend, tmp_path)
+    store.put_many([record('counter', count=0), record('total', count=0)])
+    store.close()
+
+    processes, rounds = 4, 25
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=bump, args=(backend, str(tmp_path), rounds)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    assert [worker.exitcode for worker in workers] == [0] * processes
+
+    store = open_store(backend, tmp_path)
+    assert store.get('counter')['count'] == processes * rounds
+    assert store.get('total')['count'] == processes * rounds
+    store.close()
@@ -0,0 +1,39 @@
+# tests/test_transfer.py
+
+import hashlib
+from scon.utils import chunk_store, runtime_client, transfer, usage
+
+def test_present_layers():
+    layers = ['sha256:base', 'sha256:app', 'sha256:data']
+    chains = usage.chain_ids(layers)
+    assert transfer.present_layers(layers, set(chains)) == set(layers)
+    assert transfer.present_layers(layers, set(chains[:2])) == {'sha256:base', 'sha256:app'}
+    assert transfer.present_layers(layers, set()) == set()
+    # The runtime has the top chain without the ones under it; a layer is only reused with its parents
+    assert transfer.present_layers(layers, {chains[0], chains[2]}) == {'sha256:base'}
+    # The same diff ID on another base is a different chain
+    assert transfer.present_layers(['sha256:other', 'sha256:app'], set(chains)) == set()
+
+def test_present_layers_keeps_a_diff_id_needed_again_further_up():
+    # An empty layer repeats the same diff ID; leaving it out would drop the upper copy too
+    layers = ['sha256:base', 'sha256:empty', 'sha256:app', 'sha256:empty']
+    chains = usage.chain_ids(layers)
+    assert transfer.present_layers(layers, set(chains[:2])) == {'sha256:base'}
+
+def test_only_the_classic_image_store_skips_present_layers():
+    assert runtime_client.classic_image_store({'DriverStatus': [['Backing Filesystem', 'extfs']]},
+                                              {'Components': [{'Name': 'Engine'}]})
+    assert not runtime_client.classic_image_store({'DriverStatus': [['driver-type', 'io.containerd.snapshotter.v1']]})
+    assert not runtime_client.classic_image_store({'DriverStatus': None}, {'Components': [{'Name': 'Podman Engine'}]})
+    # podman's own `info` has no DriverStatus
+    assert not runtime_client.classic_image_store({'host': {}, 'store': {}})
+    assert not runtime_client.classic_image_store(None)
+
+def test_chunks_round_trip(tmp_path):
+    store = chunk_store.ChunkStore(str(tmp_path))
+    data = b'layer data ' * 1000
+    digest = hashlib.sha256(data).hexdigest()
+    assert 0 < store.put(digest, data) < len(data)
+    assert store.put(digest, data) == 0
+    assert store.chunk_path(digest).endswith(f".{chunk_store.preferred_codec()}")
+    assert store.get(digest) == data
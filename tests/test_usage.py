@@ -0,0 +1,49 @@
+# tests/test_usage.py
+
+from scon.utils import usage
+
+def snapshot(image, days_ago=1):
+    return {'name': image, 'image_id': image, 'created_at': f"2026-01-{30 - days_ago:02d}T00:00:00"}
+
+def sc(name, images, base='alpine'):
+    return {'name': name, 'image': base, 'containers': [{'name': name, 'image': base}],
+            'snapshots': [snapshot(image) for image in images], 'next_snapshot_to_start': snapshot(images[-1])}
+
+def accounts_for(records, infos):
+    return {'local': usage.account(records, 'local', {'ids': {ref: ref for ref in infos}, 'infos': infos})}
+
+INFOS = {
+    'alpine': {'size': 10, 'layers': ['b']},
+    # web_2 goes on top of web_1; clone was started from web_1 and went on from there
+    'web_1': {'size': 30, 'layers': ['b', 'w1']},
+    'web_2': {'size': 35, 'layers': ['b', 'w1', 'w2']},
+    'clone_1': {'size': 70, 'layers': ['b', 'w1', 'c1']},
+    'db_1': {'size': 110, 'layers': ['b', 'd1']},
+}
+RECORDS = [sc('web', ['web_1', 'web_2']), sc('clone', ['clone_1'], base='web_1'), sc('db', ['db_1'])]
+
+def test_account_rows():
+    accounts = accounts_for(RECORDS, INFOS)
+    rows = {row['snapshot']: row for row in usage.snapshot_rows(accounts['local'])}
+    assert {name: (row['bytes'], row['exclusive']) for name, row in rows.items()} == \
+        {'web_1': (30, 0), 'web_2': (35, 5), 'clone_1': (70, 40), 'db_1': (110, 100)}
+    per_sc = {row['sc']: (row['exclusive'], row['shared']) for row in usage.sc_rows(accounts['local'])}
+    # web_1's layer is the base image of clone, so web only shares it
+    assert per_sc == {'web': (5, 30), 'clone': (40, 30), 'db': (100, 10)}
+    assert usage.snapshot_bytes(accounts['local']) == 5 + 40 + 100
+
+def test_pick_reclaimable_across_shared_chains():
+    accounts = accounts_for(RECORDS, INFOS)
+    everything = {'local': ['web_1', 'web_2', 'clone_1', 'db_1']}
+    assert usage.pick_reclaimable(accounts, everything, 100) == ({'local': {'db_1'}}, 100)
+    assert usage.pick_reclaimable(accounts, everything, 120) == ({'local': {'db_1', 'clone_1'}}, 140)
+    # web_1 holds a layer clone starts from, so removing every snapshot never frees it
+    assert usage.pick_reclaimable(accounts, everything, 10 ** 6) == \
+        ({'local': {'db_1', 'clone_1', 'web_2'}}, 145)
+
+    # Once web_2 is picked, the chain under it is web_1's alone
+    alone = accounts_for([sc('web', ['web_1', 'web_2'])], INFOS)
+    assert usage.pick_reclaimable(alone, {'local': ['web_1', 'web_2']}, 10 ** 6) == \
+        ({'local': {'web_1', 'web_2'}}, 25)
+    assert usage.pick_reclaimable(alone, {'local': ['web_1']}, 10 ** 6) == ({}, 0)
+    assert usage.pick_reclaimable(accounts, {'elsewhere': ['db_1']}, 10 ** 6) == ({}, 0)
@@ -0,0 +1,66 @@
+# tests/test_volumes.py
+
+from scon.utils import container_manager, json_storage, volumes, warm_pool
+import fake_runtime
+
+DATA = {'type': 'volume', 'destination': '/data', 'read_only': False}
+CONFIG = {'type': 'bind', 'source': '/srv/web', 'destination': '/etc/web', 'read_only': True}
+
+def stopped_sc(server, volume_state):
+    snapshot = {'name': 'web_1', 'image_id': 'web_1', 'created_at': '2026-01-01T00:00:00', 'volumes': volume_state}
+    server.runtime.state['images']['web_1'] = server.runtime.layers('alpine') + ['web_1/top']
+    record = {'name': 'web', 'image': 'alpine', 'snapshots': [snapshot], 'next_snapshot_to_start': dict(snapshot),
+              'containers': [{'name': 'web', 'container_id': None, 'image': 'alpine', 'status': 'stopped'}]}
+    json_storage.save_stateful_container(record)
+    return record
+
+def restored_into(monkeypatch, server):
+    # The mounts of each container restore_volumes wrote into, as inspect shows them
+    seen = []
+    def restore(runtime, container_ref, volume_state, workers=4):
+        seen.append([volumes.mount_spec(mount) for mount in runtime.list_mounts(container_ref)])
+    monkeypatch.setattr(volumes, 'restore_volumes', restore)
+    return seen
+
+def test_mount_spec_round_trips():
+    inspected = [fake_runtime.inspected_mount('volume', None, '/data', False),
+                 fake_runtime.inspected_mount('bind', '/srv/web', '/etc/web', True)]
+    assert [volumes.mount_spec(mount) for mount in inspected] == [DATA, CONFIG]
+    # Captures from before mounts were recorded come back as volumes at their paths
+    assert volumes.recorded_mounts({'manifest': 'x', 'paths': ['/data']}) == [DATA]
+
+def test_start_restores_into_the_recorded_mounts(scon_home, monkeypatch):
+    seen = restored_into(monkeypatch, scon_home)
+    record = stopped_sc(scon_home, {'manifest': 'x', 'paths': ['/data', '/etc/web'], 'mounts': [DATA, CONFIG]})
+    started, message = container_manager.start_stateful_container(record)
+    assert started, message
+    assert seen == [[DATA, CONFIG]]
+
+def test_warm_container_gets_the_mounts_too(scon_home, monkeypatch):
+    seen = restored_into(monkeypatch, scon_home)
+    record = stopped_sc(scon_home, {'manifest': 'x', 'paths': ['/data']})
+    runtime = container_manager.get_runtime()
+    assert warm_pool.refresh_warm_container(record, runtime)
+    assert record['warm_container']['mounts'] == [DATA]
+    warm_id = record['warm_container']['container_id']
+    started, message = container_manager.start_stateful_container(record)
+    assert started and 'warm start' in message
+    assert seen == [[DATA]] and record['containers'][-1]['container_id'] == warm_id
+
+    # A warm container made without the mounts is not used for a capture that needs them
+    record = stopped_sc(scon_home, {'manifest': 'x', 'paths': ['/data']})
+    runtime.stop('web')
+    runtime.remove_container('web')
+    record['warm_container'] = {'name': 'scon_warm_web_1', 'image_id': 'web_1', 'created_at': '2026-01-01T00:00:00',
+                                'container_id': runtime.create_container('scon_warm_web_1', 'web_1', None)}
+    started, message = container_manager.start_stateful_container(record)
+    assert started and 'cold start' in message
+    assert seen[-1] == [DATA]
+
+def test_start_refuses_mounts_it_cannot_recreate(scon_home, monkeypatch):
+    seen = restored_into(monkeypatch, scon_home)
+    pipe = {'type': 'npipe', 'source': 'x', 'destination': '/pipe', 'read_only': False}
+    record = stopped_sc(scon_home, {'manifest': 'x', 'paths': ['/data', '/pipe'], 'mounts': [DATA, pipe]})
+    started, message = container_manager.start_stateful_container(record)
+    assert not started and "npipe mount at '/pipe' cannot be recreated" in message
+    assert seen == [] and container_manager.get_runtime().container_id('web') is None